@@ -0,0 +1,307 @@
+"""Fake Exchange Clients"""
+import json
+import time
+import zlib
+import threading
+from collections import Counter
+import numpy as np
+from tradingtools import commontools
+
+TRADE_EPOCH = 1577836800000
+TRADE_MS = 500
+
+
+class FakeClient:
+    """
+    Base of the in-process fake clients. Counts every call and sleeps the injected latency on each of them
+    """
+
+    def __init__(self, latency=0.0, symbols=200, seed=0):
+        """
+        :param latency: seconds slept on every call
+        :param symbols: number of synthetic symbols
+        :param seed: random seed of the synthetic prices
+        """
+        self.latency = latency
+        self.symbols = [f'SYM{i}USDT' for i in range(symbols - 1)] + ['BTCUSDT']
+        self.seed = seed
+        self.calls = Counter()
+        self.server_time = 0.0
+        self.timestamp_offset = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset(self):
+        """
+        Reset the call counters and the time spent generating responses (summed over all the calling threads)
+        :return: None
+        """
+        self.calls.clear()
+        self.server_time = 0.0
+
+    def price(self, symbol):
+        """
+        Synthetic price of a symbol
+        :param symbol: symbol string ('BTCUSDT')
+        :return: price float
+        """
+        return 30000.0 if symbol == 'BTCUSDT' else 1.0 + zlib.crc32(symbol.encode()) % 1000
+
+    def klines(self, start, end, step, limit=None):
+        """
+        Synthetic klines between two timestamps
+        :param start: epoch milliseconds
+        :param end: epoch milliseconds
+        :param step: timeframe in milliseconds
+        :param limit: maximum number of klines
+        :return: tuple of (open_times, ohlcv) numpy.array
+        """
+        t0 = time.perf_counter()
+        times = np.arange(start - start % step + (step if start % step else 0), end + 1, step, dtype=np.int64)
+        if limit is not None:
+            times = times[:limit]
+        rng = np.random.default_rng(self.seed + int(times[0] // step) if len(times) else self.seed)
+        close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.001, len(times))))
+        open = np.r_[close[:1], close[:-1]]
+        high = np.maximum(open, close) * (1 + rng.random(len(times)) * 0.001)
+        low = np.minimum(open, close) * (1 - rng.random(len(times)) * 0.001)
+        vol = rng.random(len(times)) * 10
+        self.server_time += time.perf_counter() - t0
+        return times, np.column_stack([open, high, low, close, vol])
+
+
+class FakeBinanceClient(FakeClient):
+    """
+    In-process fake of python-binance Client serving synthetic klines, exchange info, tickers, orders and positions
+    """
+
+    def __init__(self, latency=0.0, symbols=200, positions=50, seed=0):
+        """
+        :param latency: seconds slept on every call
+        :param symbols: number of synthetic symbols
+        :param positions: number of open futures positions
+        :param seed: random seed of the synthetic prices
+        """
+        super().__init__(latency, symbols, seed)
+        self.positions = {s: round((1 if i % 2 else -1) * 100 / self.price(s), 3) for i, s in enumerate(self.symbols[:positions])}
+        self.open_orders = []
+        self.order_id = 0
+
+    def _rows(self, times, values, step):
+        t0 = time.perf_counter()
+        text = np.char.mod('%.8f', values)
+        rows = [[int(t), o, h, lo, c, v, int(t) + step - 1, v, 100, v, v, '0'] for t, (o, h, lo, c, v) in zip(times, text.tolist())]
+        self.server_time += time.perf_counter() - t0
+        return rows
+
+    def _klines_page(self, symbol, interval, startTime, endTime=None, limit=1000, **kwargs):
+        step = commontools.timeframe_to_ms(interval)
+        times, values = self.klines(startTime, endTime if endTime is not None else int(time.time() * 1000), step, limit)
+        return self._rows(times, values, step)
+
+    def _historical_klines(self, symbol, interval, start_str, end_str=None, limit=1000, **kwargs):
+        start = commontools.to_milliseconds(start_str)
+        end = commontools.to_milliseconds(end_str) if end_str is not None else int(time.time() * 1000)
+        step = commontools.timeframe_to_ms(interval)
+        rows = []
+        while start <= end:
+            self._call('klines')
+            page = self._klines_page(symbol, interval, start, end, limit)
+            if not page:
+                break
+            rows += page
+            start = page[-1][0] + step
+        return rows
+
+    def get_klines(self, **params):
+        self._call('klines')
+        return self._klines_page(**params)
+
+    futures_klines = get_klines
+
+    def futures_coin_klines(self, *args, **params):
+        if args:
+            return self._historical_klines(*args, **params)
+        self._call('klines')
+        return self._klines_page(**params)
+
+    get_historical_klines = _historical_klines
+    futures_historical_klines = _historical_klines
+
+    def get_server_time(self):
+        self._call('time')
+        return {'serverTime': int(time.time() * 1000)}
+
+    def _exchange_info(self, spot=False):
+        notional = {'filterType': 'NOTIONAL', 'minNotional': '5'} if spot else {'filterType': 'MIN_NOTIONAL', 'notional': '5'}
+        return {'symbols': [{'symbol': s, 'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.01'},
+                                                      {'filterType': 'LOT_SIZE', 'minQty': '0.001'}, notional]}
+                            for s in self.symbols]}
+
+    def futures_exchange_info(self):
+        self._call('exchange_info')
+        return self._exchange_info()
+
+    def futures_coin_exchange_info(self):
+        self._call('exchange_info')
+        return self._exchange_info()
+
+    def get_exchange_info(self):
+        self._call('exchange_info')
+        return self._exchange_info(spot=True)
+
+    def get_symbol_info(self, symbol):
+        self._call('exchange_info')
+        return next(s for s in self._exchange_info(spot=True)['symbols'] if s['symbol'] == symbol)
+
+    def futures_symbol_ticker(self, symbol=None):
+        self._call('ticker')
+        if symbol is not None:
+            return {'symbol': symbol, 'price': str(self.price(symbol))}
+        return [{'symbol': s, 'price': str(self.price(s))} for s in self.symbols]
+
+    get_symbol_ticker = futures_symbol_ticker
+
+    def futures_coin_symbol_ticker(self, symbol=None):
+        self._call('ticker')
+        return [{'symbol': s, 'price': str(self.price(s))} for s in (self.symbols if symbol is None else [symbol])]
+
+    def _order(self, **params):
+        with self._lock:
+            self.order_id += 1
+            order = dict(params, orderId=self.order_id)
+        if params.get('type') != 'MARKET':
+            self.open_orders.append(order)
+        elif params.get('symbol') in self.positions:
+            self.positions[params['symbol']] = 0.0
+        return order
+
+    def create_order(self, **params):
+        self._call('order')
+        return self._order(**params)
+
+    futures_create_order = create_order
+    futures_coin_create_order = create_order
+
+    def futures_place_batch_order(self, batchOrders):
+        self._call('batch_orders')
+        return [self._order(**order) for order in batchOrders]
+
+    futures_coin_place_batch_order = futures_place_batch_order
+
+    def get_open_orders(self, symbol=None):
+        self._call('open_orders')
+        return [o for o in self.open_orders if symbol is None or o['symbol'] == symbol]
+
+    futures_get_open_orders = get_open_orders
+    futures_coin_get_open_orders = get_open_orders
+
+    def _cancel(self, orderId):
+        with self._lock:
+            order = next((o for o in self.open_orders if o['orderId'] == orderId), None)
+            self.open_orders = [o for o in self.open_orders if o['orderId'] != orderId]
+        return dict(order, status='CANCELED') if order is not None else {'code': -2011, 'msg': 'Unknown order sent.'}
+
+    def cancel_order(self, symbol, orderId):
+        self._call('cancel_order')
+        order = self._cancel(orderId)
+        if 'code' in order:
+            raise ValueError(order['msg'])
+        return order
+
+    futures_cancel_order = cancel_order
+    futures_coin_cancel_order = cancel_order
+
+    def futures_cancel_all_open_orders(self, symbol):
+        self._call('cancel_all_orders')
+        self.open_orders = [o for o in self.open_orders if o['symbol'] != symbol]
+
+    futures_coin_cancel_all_open_orders = futures_cancel_all_open_orders
+
+    def futures_cancel_orders(self, symbol, orderIdList):
+        self._call('cancel_orders')
+        return [self._cancel(orderId) for orderId in json.loads(orderIdList)]
+
+    futures_coin_cancel_orders = futures_cancel_orders
+
+    def futures_position_information(self):
+        self._call('positions')
+        return [{'symbol': s, 'positionAmt': str(self.positions.get(s, 0.0)), 'entryPrice': str(self.price(s))} for s in self.symbols]
+
+    def futures_coin_position_information(self):
+        self._call('positions')
+        return [{'symbol': s, 'positionAmt': str(int(self.positions.get(s, 0.0) * 2)), 'entryPrice': str(self.price(s))} for s in self.symbols]
+
+    def futures_account_balance(self):
+        self._call('balance')
+        return [{'asset': 'USDT', 'balance': '10000.0', 'crossWalletBalance': '9000.0'}]
+
+    def futures_coin_account_balance(self):
+        self._call('balance')
+        return [{'asset': 'BTC', 'balance': '1.0', 'crossWalletBalance': '0.9'}]
+
+    def get_account(self):
+        self._call('account')
+        return {'balances': [{'asset': s[:-4], 'free': '1.0', 'locked': '0.0'} for s in self.symbols]}
+
+    def get_aggregate_trades(self, symbol, fromId=None, startTime=None, endTime=None, limit=500):
+        """
+        Synthetic aggregate trades: one every TRADE_MS since TRADE_EPOCH, each one grouping two trades
+        """
+        self._call('aggTrades')
+        first = fromId if fromId is not None else max(0, -(-(startTime - TRADE_EPOCH) // TRADE_MS))
+        last = (endTime - TRADE_EPOCH) // TRADE_MS if endTime is not None else (int(time.time() * 1000) - TRADE_EPOCH) // TRADE_MS
+        ids = np.arange(first, min(first + limit, last + 1), dtype=np.int64)
+        price = np.char.mod('%.2f', self.price(symbol) + (ids % 1000) * 0.01).tolist()
+        qty = np.char.mod('%.3f', 0.001 * (1 + ids % 7)).tolist()
+        return [{'a': int(i), 'p': p, 'q': q, 'f': int(i) * 2, 'l': int(i) * 2 + 1, 'T': TRADE_EPOCH + int(i) * TRADE_MS, 'm': bool(i % 3 == 0)}
+                for i, p, q in zip(ids, price, qty)]
+
+    futures_aggregate_trades = get_aggregate_trades
+    futures_coin_aggregate_trades = get_aggregate_trades
+
+    def get_order_book(self, symbol, limit=100):
+        self._call('depth')
+        price = self.price(symbol)
+        return {'lastUpdateId': self.calls['depth'], 'T': int(time.time() * 1000),
+                'bids': [[f'{price - 0.01 * (i + 1):.2f}', '1.000'] for i in range(limit)],
+                'asks': [[f'{price + 0.01 * (i + 1):.2f}', '1.000'] for i in range(limit)]}
+
+    futures_order_book = get_order_book
+    futures_coin_order_book = get_order_book
+
+
+class FakeKucoinClient(FakeClient):
+    """
+    In-process fake of the kucoin-python market clients, returning at most 1500 klines per call like the exchange
+    """
+
+    def __init__(self, latency=0.0, symbols=200, futures=False, seed=0):
+        """
+        :param latency: seconds slept on every call
+        :param symbols: number of synthetic symbols
+        :param futures: behave as the futures market client instead of the spot one
+        :param seed: random seed of the synthetic prices
+        """
+        super().__init__(latency, symbols, seed)
+        self.futures = futures
+
+    def get_kline_data(self, symbol, kline_type=None, start=None, end=None, granularity=None, begin_t=None, end_t=None):
+        self._call('klines')
+        if self.futures:
+            step = commontools.timeframe_to_ms(granularity)
+            times, values = self.klines(begin_t, end_t, step, 1500)
+            return [[int(t)] + list(v) for t, v in zip(times, values.tolist())]
+        step = commontools.timeframe_to_ms(kline_type)
+        times, values = self.klines(start * 1000, end * 1000, step)
+        times, values = times[-1500:][::-1], values[-1500:][::-1]
+        t0 = time.perf_counter()
+        text = np.char.mod('%.8f', values).tolist()
+        rows = [[str(t // 1000), o, c, h, lo, v, v] for t, (o, h, lo, c, v) in zip(times.tolist(), text)]
+        self.server_time += time.perf_counter() - t0
+        return rows
@@ -0,0 +1,160 @@
+"""Benchmark Suite
+
+Run the representative scenarios against the in-process fake clients and save the results as JSON:
+
+    python -m benchmarks.run --latency 0.005 --output results.json --compare previous.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from tradingtools import binancetools, kucointools, ticktools
+from benchmarks.fake_client import FakeBinanceClient, FakeKucoinClient
+
+logger = logging.getLogger('benchmarks')
+
+YEAR = ('2022-01-01', '2022-12-31 23:59')
+
+
+def backfill_1y_1m(client, path):
+    """One year of 1m USDM klines downloaded into an empty store"""
+    binancetools.download_data(client, 'USDM', 'BTCUSDT', '1m', *YEAR, path)
+
+
+def bulk_backfill_1y_1m(client, path):
+    """One year of 1m USDM klines downloaded into an empty store with bulk_download"""
+    binancetools.bulk_download(client, [('USDM', 'BTCUSDT', '1m', *YEAR)], path, budget=100)
+
+
+def setup_incremental_update(client, path):
+    binancetools.bulk_download(client, [('USDM', 'BTCUSDT', '1m', *YEAR)], path, budget=100)
+
+
+def incremental_update(client, path):
+    """One more day of 1m klines appended to a one year dataset"""
+    binancetools.download_data(client, 'USDM', 'BTCUSDT', '1m', YEAR[0], '2023-01-01 23:59', path)
+
+
+def kucoin_backfill_1w_1min(client, path):
+    """One week of 1min KuCoin spot klines downloaded into an empty store"""
+    kucointools.download_data(client, 'SPOT', 'BTC-USDT', '1min', '2022-01-01', '2022-01-07 23:59', path)
+
+
+def aggtrades_1d(client, path):
+    """One day of USDM aggregate trades downloaded into an empty store and rebuilt into 1m klines"""
+    ticktools.download_agg_trades(client, 'USDM', 'BTCUSDT', '2022-01-01', '2022-01-01 23:59:59.999', path, 2, 3, budget=100)
+    ticktools.trades_to_klines(ticktools.read_agg_trades(path, 'BTCUSDT'), '1m')
+
+
+def orders_100(client, path):
+    """100 notional orders placed one by one with create_order"""
+    for i in range(100):
+        binancetools.create_order(client, 'USDM', client.symbols[i % len(client.symbols)], 'BUY', notional=100)
+
+
+def batch_orders_100(client, path):
+    """100 notional orders placed with create_orders"""
+    binancetools.create_orders(client, 'USDM', [{'symbol': client.symbols[i % len(client.symbols)], 'side': 'BUY', 'notional': 100}
+                                                for i in range(100)])
+
+
+def flatten_50_positions(client, path):
+    """50 open USDM positions closed with close_positions"""
+    binancetools.close_positions(client, 'USDM')
+
+
+SCENARIOS = {
+    'backfill_1y_1m': (backfill_1y_1m, None, FakeBinanceClient),
+    'bulk_backfill_1y_1m': (bulk_backfill_1y_1m, None, FakeBinanceClient),
+    'incremental_update': (incremental_update, setup_incremental_update, FakeBinanceClient),
+    'kucoin_backfill_1w_1min': (kucoin_backfill_1w_1min, None, FakeKucoinClient),
+    'aggtrades_1d': (aggtrades_1d, None, FakeBinanceClient),
+    'orders_100': (orders_100, None, FakeBinanceClient),
+    'batch_orders_100': (batch_orders_100, None, FakeBinanceClient),
+    'flatten_50_positions': (flatten_50_positions, None, FakeBinanceClient),
+}
+
+
+def run_scenario(name, latency=0.0, memory=True):
+    """
+    Run one scenario on a fresh fake client and temporary store
+    :param name: scenario name in SCENARIOS
+    :param latency: seconds slept by the fake client on every call
+    :param memory: also measure the peak memory (runs the scenario a second time under tracemalloc)
+    :return: result dict
+    """
+    function, setup, client_class = SCENARIOS[name]
+    result = {'scenario': name, 'description': function.__doc__}
+    for traced in ((False, True) if memory else (False,)):
+        path = tempfile.mkdtemp(prefix='tradingtools-bench-')
+        try:
+            client = client_class(latency=latency)
+            binancetools.symbol_info_cache.clear()
+            if setup is not None:
+                setup(client, path)
+            client.reset()
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            function(client, path)
+            wall = time.perf_counter() - start
+            if traced:
+                result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                result.update(wall_time=wall, server_time=client.server_time, api_calls=dict(client.calls),
+                              api_calls_total=sum(client.calls.values()))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    logger.info(f'{name}: {result["wall_time"]:.3f} s, {result["api_calls_total"]} calls')
+    return result
+
+
+def compare(results, previous):
+    """
+    Print the ratio of each metric against a previous run
+    :param results: results dict of this run
+    :param previous: results dict of the previous run
+    :return: None
+    """
+    old = {r['scenario']: r for r in previous['results']}
+    for r in results['results']:
+        if r['scenario'] in old:
+            ratios = ', '.join(f'{m} x{r[m] / old[r["scenario"]][m]:.2f}' for m in ('wall_time', 'peak_memory', 'api_calls_total')
+                               if m in r and old[r['scenario']].get(m))
+            print(f'{r["scenario"]}: {ratios}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='tradingtools benchmark suite')
+    parser.add_argument('--scenarios', nargs='*', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency injected on every client call')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--output', default=None, help='JSON file to save the results')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for name in ('binancetools', 'kucointools', 'commontools', 'storetools', 'ticktools'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'latency': args.latency,
+               'results': [run_scenario(name, args.latency, not args.no_memory) for name in args.scenarios]}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare and os.path.isfile(args.compare):
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import asyncio
+import inspect
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import asyncbinancetools, binancetools
+
+
+class AsyncFakeClient:
+    """Coroutine version of the fake client, whose all-tickers response misses the last symbol"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def futures_symbol_ticker(self, symbol=None):
+        async def ticker():
+            tickers = self.client.futures_symbol_ticker(symbol=symbol)
+            return tickers if symbol is not None else tickers[:-1]
+        return ticker()
+
+    def __getattr__(self, name):
+        function = getattr(self.client, name)
+        if not callable(function) or inspect.iscoroutinefunction(function):
+            return function
+
+        async def wrapper(*args, **kwargs):
+            return function(*args, **kwargs)
+        return wrapper
+
+
+def test_async_create_orders_awaits_missing_tickers():
+    binancetools.symbol_info_cache.clear()
+    client = AsyncFakeClient(FakeBinanceClient(symbols=10))
+    orders = [{'symbol': s, 'side': 'BUY', 'notional': 100} for s in client.client.symbols]
+    placed = asyncio.run(asyncbinancetools.create_orders(client, 'USDM', orders))
+    assert all(p is not None for p in placed)
+    order = asyncio.run(asyncbinancetools.create_order(client, 'USDM', client.client.symbols[-1], 'SELL', notional=100))
+    assert order is not None
@@ -0,0 +1,47 @@
+import logging
+import numpy as np
+from tradingtools import backtesttools, binancetools, commontools
+
+logger = logging.getLogger('tests')
+
+
+def random_orders(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = np.round(100 * np.exp(rng.normal(0, 0.02, n)), 2)
+    limit = np.where(rng.random(n) < 0.5, np.round(price * (1 + rng.normal(0, 0.02, n)), 2), np.nan)
+    stop = np.where(rng.random(n) < 0.5, np.round(price * (1 + rng.normal(0, 0.02, n)), 2), np.nan)
+    side = np.where(rng.random(n) < 0.5, 1, -1).astype(np.int8)
+    quantity = rng.random(n) * 0.05
+    return price, limit, stop, side, quantity
+
+
+def test_check_arrays_match_scalar_checks():
+    price, limit, stop, side, quantity = random_orders()
+    limits, stops = commontools.check_prices_array(price, limit, stop, side, 0.001)
+    quantities = commontools.check_quantities_array(quantity, price, 0.001, 1.0)
+    for i in range(len(price)):
+        expected = commontools.check_prices(price[i], None if np.isnan(limit[i]) else limit[i], None if np.isnan(stop[i]) else stop[i],
+                                            'BUY' if side[i] > 0 else 'SELL', 0.001, logger)
+        assert expected == tuple(None if np.isnan(x) else x for x in (limits[i], stops[i]))
+        expected = commontools.check_quantities(quantity[i], price[i], 0.001, 1.0, logger)
+        assert (expected is None and np.isnan(quantities[i])) or float(expected) == quantities[i]
+
+
+def test_order_types_match_send_order():
+    price, limit, stop, side, quantity = random_orders()
+    limits, stops = commontools.check_prices_array(price, limit, stop, side, 0.001)
+    types = backtesttools.order_types(price, limits, stops, side)
+    for i in range(len(price)):
+        params = binancetools.send_order(lambda **kwargs: kwargs, 'USDM', '0.01', price[i], None if np.isnan(limit[i]) else limit[i],
+                                         None if np.isnan(stop[i]) else stop[i], 'BTCUSDT', 'BUY' if side[i] > 0 else 'SELL', None,
+                                         'GTC', 0.01, 0.001)
+        assert params['type'] == backtesttools.TYPES[types[i]]
+
+
+def test_stop_limit_rests_from_the_next_bar():
+    open, high, low, close = (np.array(x, dtype=float) for x in ([100, 100, 104], [100, 110, 107], [100, 99, 104], [100, 108, 105]))
+    side, stop, limit = np.array([1, 0, 0]), np.array([106.0, np.nan, np.nan]), np.array([105.0, np.nan, np.nan])
+    orders, _ = backtesttools.backtest(open, high, low, close, side, quantity=1, limitprice=limit, stopprice=stop, ttl=2)
+    assert orders['type'][0] == 'STOP' and orders['fill_bar'][0] == 2 and orders['fill_price'][0] == 104
+    orders, _ = backtesttools.backtest(open, high, low, close, side, quantity=1, limitprice=limit, stopprice=stop, ttl=2, same_bar=True)
+    assert orders['fill_bar'][0] == 1 and orders['fill_price'][0] == 105
@@ -0,0 +1,16 @@
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools, storetools
+
+
+def test_bulk_download_migrates_legacy_datasets(tmp_path):
+    client = FakeBinanceClient(symbols=5)
+    legacy = binancetools.get_klines(client, 'USDM', 'BTCUSDT', '1h', '2022-01-01', '2022-02-28 23:00')
+    expected = binancetools.get_klines(client, 'USDM', 'BTCUSDT', '1h', '2022-01-01', '2022-03-10')
+    for repair in (False, True):
+        path = str(tmp_path / str(repair))
+        (tmp_path / str(repair)).mkdir()
+        legacy.to_parquet(storetools.legacy_path(path, 'BTCUSDT', '1h'), compression='gzip')
+        reports = binancetools.bulk_download(client, [('USDM', 'BTCUSDT', '1h', '2022-01-01', '2022-03-10')], path, repair=repair)
+        assert reports[0]['windows'] == 1
+        df = binancetools.get_data('BTCUSDT', '1h', path)
+        assert len(df) == len(expected) and (df['open_time'].to_numpy() == expected['open_time'].to_numpy()).all()
@@ -0,0 +1,51 @@
+import sys
+import time
+import datetime
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+import tradingtools
+from tradingtools import commontools
+
+NOON = 1609502400000  # 2021-01-01 12:00 UTC
+
+
+def test_to_milliseconds_fast_paths(monkeypatch):
+    def parse_date(text, base=None):
+        raise AssertionError(f'{text} went through dateparser')
+
+    monkeypatch.setattr(commontools, 'parse_date', parse_date)
+    for date in (NOON, float(NOON), np.int64(NOON), '2021-01-01 12:00', '2021-01-01T12:00:00Z', '2021-01-01T12:00:00.000z',
+                 '2021-01-01 14:00+02:00', '2021-01-01T07:00:00-0500', np.datetime64('2021-01-01T12:00'),
+                 datetime.datetime(2021, 1, 1, 12), datetime.datetime(2021, 1, 1, 13, tzinfo=datetime.timezone(datetime.timedelta(hours=1))),
+                 pd.Timestamp('2021-01-01 12:00')):
+        assert commontools.to_milliseconds(date) == NOON, date
+    assert commontools.to_milliseconds(datetime.date(2021, 1, 1)) == commontools.to_milliseconds('2021-01-01') == NOON - 12 * 3600000
+    for text, ms in (('now', 0), ('3 days ago', 3 * 86400000), (' 2  Hours  AGO', 2 * 3600000), ('1 week ago', 604800000)):
+        assert abs(commontools.to_milliseconds(text) - (time.time() * 1000 - ms)) < 5000, text
+
+
+def test_parse_absolute_caches_only_absolute_phrases():
+    commontools.parse_absolute.cache_clear()
+    assert commontools.to_milliseconds('1 jan 2021 12:00') == NOON
+    assert commontools.parse_absolute('1 jan 2021 12:00') == NOON
+    assert commontools.parse_absolute('yesterday') is None
+    assert abs(commontools.to_milliseconds('yesterday') - (time.time() * 1000 - 86400000)) < 86400000
+    assert commontools.parse_absolute.cache_info().hits >= 1
+    with pytest.raises(ValueError):
+        commontools.to_milliseconds('not a date at all')
+
+
+def test_tools_modules_are_imported_lazily():
+    code = ("import sys, tradingtools\n"
+            "assert 'tradingtools.binance' not in sys.modules\n"
+            "tradingtools.binancetools, tradingtools.kucointools, tradingtools.asyncbinancetools\n"
+            "assert not [m for m in ('pandas', 'pyarrow', 'dateparser') if m in sys.modules]\n"
+            "tradingtools.storetools\n"
+            "assert 'pyarrow' in sys.modules\n")
+    subprocess.run([sys.executable, '-c', code], check=True)
+    assert tradingtools.binancetools is sys.modules['tradingtools.binance']
+    assert 'binancetools' in dir(tradingtools)
+    with pytest.raises(AttributeError):
+        tradingtools.unknowntools
@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from tradingtools import indicatortools
+
+
+def random_klines(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    spread = np.abs(rng.normal(0, 0.002, n)) * close
+    return pd.DataFrame({'open_time': pd.date_range('2021-01-01', periods=n, freq='5min'), 'open': np.r_[close[0], close[:-1]],
+                         'high': close + spread, 'low': close - spread, 'close': close, 'vol': rng.random(n) * 10})
+
+
+def indicator_set():
+    return indicatortools.IndicatorSet({'ema': indicatortools.EMA(20), 'rsi': indicatortools.RSI(14), 'atr': indicatortools.ATR(14),
+                                        'bb': indicatortools.Bollinger(20), 'vwap': indicatortools.VWAP('1d'),
+                                        'vol': indicatortools.Volatility(20)})
+
+
+def test_update_is_bit_identical_to_compute():
+    df = random_klines()
+    expected = indicator_set().compute(df)
+    for split in (0, 1, 1000, 2999):
+        indicators = indicator_set()
+        head = indicators.compute(df.iloc[:split])
+        # reload the state as update_indicators does after a restart
+        indicators = indicatortools.IndicatorSet.from_dict(json.loads(json.dumps(indicators.to_dict())))
+        result = pd.concat([head, indicators.update(df)], ignore_index=True)
+        for name in indicator_set().names():
+            np.testing.assert_array_equal(result[name].to_numpy().view(np.int64), expected[name].to_numpy().view(np.int64), err_msg=name)
+
+
+def test_indicator_requires_bulk_and_update():
+    class Partial(indicatortools.Indicator):
+        def bulk(self, data):
+            return ()
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,10 @@
+from tradingtools import kucointools
+
+
+def test_kucoin_calls_share_one_limiter_per_pool():
+    assert kucointools.limiters['SPOT'].period == kucointools.WEIGHT_PERIOD == 30
+    assert kucointools.limiters['SPOT'].weight == kucointools.WEIGHT_LIMIT['SPOT'] * kucointools.BUDGET
+    shared = dict(kucointools.limiters)
+    kucointools.bulk_download(None, [], '.', budget=0.5)
+    assert kucointools.limiters == shared and kucointools.limiters['FUTURES'].weight == 1000
+    kucointools.set_budget(kucointools.BUDGET)
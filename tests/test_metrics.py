@@ -0,0 +1,22 @@
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools, metricstools
+
+
+class FlakyClient(FakeBinanceClient):
+    def __init__(self):
+        super().__init__(symbols=5)
+        self.failed = False
+
+    def futures_klines(self, **params):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError('reset')
+        return self.get_klines(**params)
+
+
+def test_bulk_download_records_retries_under_the_client_endpoint(tmp_path):
+    sink = metricstools.MemorySink()
+    client = metricstools.instrument(FlakyClient(), sink)
+    reports = binancetools.bulk_download(client, [('USDM', 'BTCUSDT', '1h', '2 days ago', 'now')], str(tmp_path), retries=2)
+    assert reports[0]['failed'] == 0
+    assert sink.retries == {('binance', 'futures_klines'): 1}
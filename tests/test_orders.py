@@ -0,0 +1,66 @@
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools
+
+
+class FailingClient(FakeBinanceClient):
+    """Fails every batch or spot order that includes the first symbol"""
+
+    def futures_place_batch_order(self, batchOrders):
+        if any(order['symbol'] == self.symbols[0] for order in batchOrders):
+            raise ConnectionError('batch lost')
+        return super().futures_place_batch_order(batchOrders)
+
+    def create_order(self, **params):
+        if params['symbol'] == self.symbols[0]:
+            raise ConnectionError('order lost')
+        return super().create_order(**params)
+
+
+def test_create_orders_keeps_placed_orders_when_one_fails():
+    for market in ('USDM', 'SPOT'):
+        client = FailingClient(symbols=20)
+        orders = [{'symbol': client.symbols[i], 'side': 'BUY', 'notional': 100} for i in range(12)]
+        placed = binancetools.create_orders(client, market, orders)
+        failed = 5 if market == 'USDM' else 1
+        assert all(p is None for p in placed[:failed])
+        assert all(p is not None for p in placed[failed:])
+
+
+class FailingCancelClient(FakeBinanceClient):
+    """Fails the cancellations of the first symbol"""
+
+    def futures_cancel_all_open_orders(self, symbol):
+        if symbol == self.symbols[0]:
+            raise ConnectionError('cancel lost')
+        return super().futures_cancel_all_open_orders(symbol)
+
+    def futures_cancel_orders(self, symbol, orderIdList):
+        if symbol == self.symbols[0]:
+            raise ConnectionError('cancel lost')
+        return super().futures_cancel_orders(symbol, orderIdList)
+
+
+def limit_orders(client, n=12):
+    orders = [{'symbol': client.symbols[i % 3], 'side': 'BUY', 'notional': 100, 'limitprice': client.price(client.symbols[i % 3]) * 0.9}
+              for i in range(n)]
+    return binancetools.create_orders(client, 'USDM', orders)
+
+
+def test_cancel_order_list_uses_the_batch_endpoint():
+    client = FailingCancelClient(symbols=20)
+    placed = limit_orders(client)
+    client.reset()
+    cancelled = binancetools.cancel_order_list(client, 'USDM', placed + [dict(placed[1], orderId=10 ** 6)])
+    assert client.calls == {'cancel_orders': 2}
+    assert [c is not None for c in cancelled] == [i % 3 != 0 for i in range(12)] + [False]
+    assert sorted(o['orderId'] for o in client.open_orders) == [o['orderId'] for o in placed[::3]]
+
+
+def test_cancel_all_orders_isolates_failures_and_lists_only_the_given_symbols():
+    client = FailingCancelClient(symbols=20)
+    limit_orders(client)
+    client.reset()
+    assert binancetools.cancel_all_orders(client, 'USDM', client.symbols[:3]) == 8
+    assert client.calls['open_orders'] == 3
+    assert len(client.open_orders) == 4
+    assert binancetools.cancel_all_orders(client, 'USDM') == 0
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools, paneltools, resampletools, storetools
+
+
+def test_load_panel_aligns_symbols_with_different_ranges(tmp_path):
+    path, out = str(tmp_path / 'store'), str(tmp_path / 'panel')
+    client = FakeBinanceClient(symbols=5)
+    first = binancetools.get_klines(client, 'USDM', 'AAAUSDT', '1h', '2022-01-01', '2022-01-10 23:00')
+    second = binancetools.get_klines(client, 'USDM', 'BBBUSDT', '1h', '2022-01-05', '2022-01-15 23:00')
+    second[['open', 'high', 'low', 'close']] *= 2
+    second = second[(second['open_time'] < '2022-01-08') | (second['open_time'] >= '2022-01-09')]
+    storetools.write_klines(resampletools.resample_klines(first, '4h'), path, 'AAAUSDT', '4h')
+    storetools.write_klines(second, path, 'BBBUSDT', '1h')
+    symbols = ['AAAUSDT', 'BBBUSDT', 'CCCUSDT']
+
+    panel = paneltools.load_panel(path, symbols, '4h', source='1h', out=out)
+    expected = pd.date_range('2022-01-01', '2022-01-15 20:00', freq='4h')
+    assert (panel.times == expected.to_numpy().astype('datetime64[ms]')).all()
+    for j, df in enumerate((resampletools.resample_klines(first, '4h'), resampletools.resample_klines(second, '4h'))):
+        rows = np.searchsorted(panel.times, df['open_time'].to_numpy().astype('datetime64[ms]'))
+        assert panel.mask[:, j].sum() == len(df) and panel.mask[rows, j].all()
+        np.testing.assert_array_equal(panel.field('close')[rows, j], df['close'].to_numpy())
+        assert np.isnan(panel.field('close')[~panel.mask[:, j], j]).all()
+    assert not panel.mask[:, 2].any() and np.isnan(panel.values[:, 2]).all()
+    assert not panel.mask[(panel.times >= np.datetime64('2022-01-08')) & (panel.times < np.datetime64('2022-01-09')), 1].any()
+
+    opened = paneltools.open_panel(out)
+    assert isinstance(opened.values, np.memmap) and opened.symbols == symbols and opened.fields == panel.fields
+    np.testing.assert_array_equal(opened.values, panel.values)
+    np.testing.assert_array_equal(opened.mask, panel.mask)
+    assert (opened.times == panel.times).all()
+    pd.testing.assert_frame_equal(opened.to_frame('close'), panel.to_frame('close'))
+
+    start = paneltools.load_panel(path, symbols, '4h', '2022-01-06', '2022-01-07', source='1h', mmap=True)
+    assert len(start.times) == 7 and start.mask[:, :2].all()
@@ -0,0 +1,20 @@
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import positiontools
+
+
+def test_futures_balances_follow_account_updates():
+    tracker = positiontools.PositionTracker('USDM').load(FakeBinanceClient(symbols=4, positions=2))
+    assert tracker.balance('USDT') == {'asset': 'USDT', 'walletBalance': 10000.0, 'crossWalletBalance': 9000.0}
+    tracker.apply({'e': 'ACCOUNT_UPDATE', 'a': {'B': [{'a': 'USDT', 'wb': '950.5', 'cw': '850.5'}], 'P': []}})
+    assert tracker.balance('USDT')['walletBalance'] == 950.5
+
+
+def test_spot_balance_update_is_not_double_counted():
+    deposit = {'e': 'balanceUpdate', 'a': 'BTC', 'd': '0.5', 'E': 101, 'T': 100}
+    position = {'e': 'outboundAccountPosition', 'E': 101, 'u': 100, 'B': [{'a': 'BTC', 'f': '1.5', 'l': '0.0'}]}
+    for events in ([deposit, position], [position, deposit]):
+        tracker = positiontools.PositionTracker('SPOT').load(FakeBinanceClient(symbols=2))
+        assert tracker.balance('BTC')['free'] == 1.0
+        for event in events:
+            tracker.apply(event)
+        assert tracker.balance('BTC')['free'] == 1.5
@@ -0,0 +1,37 @@
+import time
+from types import SimpleNamespace
+from tradingtools import commontools
+
+
+def test_rate_limiter_never_exceeds_weight_in_a_period():
+    limiter = commontools.RateLimiter(20, period=0.3)
+    times = []
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < 0.8:
+        limiter.acquire(2)
+        times.append(limiter._history[-1][0])
+    for t in times:
+        assert 2 * sum(t <= u < t + 0.3 for u in times) <= 20
+
+
+def test_rate_limiter_sync_with_used_weight_header():
+    limiter = commontools.RateLimiter(10, period=0.3)
+    client = SimpleNamespace(response=SimpleNamespace(headers={'x-mbx-used-weight-1m': '9'}))
+    limiter.sync(commontools.used_weight(client))
+    t0 = time.monotonic()
+    limiter.acquire(2)
+    assert time.monotonic() - t0 >= 0.25
+    assert commontools.used_weight(SimpleNamespace()) is None
+
+
+def test_binance_calls_share_one_limiter_per_market(tmp_path, monkeypatch):
+    from tradingtools import binancetools, ticktools
+    from tests.test_ticks import SparseClient, EPOCH
+    shared = dict(binancetools.limiters)
+    binancetools.bulk_download(None, [], str(tmp_path), budget=0.5)
+    assert binancetools.limiters == shared and binancetools.limiters['USDM'].weight == 1200
+    binancetools.set_budget(binancetools.BUDGET)
+    acquired = []
+    monkeypatch.setattr(shared['SPOT'], 'acquire', acquired.append)
+    ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + 600000, str(tmp_path), 2, 3)
+    assert acquired == [ticktools.AGG_TRADES_WEIGHT['SPOT']] * 2
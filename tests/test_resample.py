@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools, resampletools, storetools
+
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'vol': 'sum', 'trades': 'sum'}
+
+
+def hourly_klines(start='2021-12-20', end='2022-03-05'):
+    return binancetools.get_klines(FakeBinanceClient(symbols=5), 'USDM', 'BTCUSDT', '1h', start, end)
+
+
+def test_resample_klines_matches_pandas():
+    df = hourly_klines()
+    for timeframe, rule in (('4h', '4h'), ('1d', '1D'), ('1w', 'W-MON'), ('1M', 'MS')):
+        result = resampletools.resample_klines(df, timeframe).set_index('open_time')
+        expected = df.set_index('open_time').resample(rule, label='left', closed='left').agg(AGGREGATIONS)
+        assert (result.index == expected.index).all(), timeframe
+        for column in AGGREGATIONS:
+            np.testing.assert_allclose(result[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float), err_msg=timeframe)
+        if timeframe == '1w':
+            assert (result.index.dayofweek == 0).all()
+
+
+def test_update_resampled_recomputes_only_the_open_bucket(tmp_path, monkeypatch):
+    path, df = str(tmp_path), hourly_klines()
+    storetools.write_klines(df[df['open_time'] < '2022-02-10 13:00'], path, 'BTCUSDT', '1h')
+    binancetools.BASE_TIMEFRAME, base = '1h', binancetools.BASE_TIMEFRAME
+    try:
+        binancetools.resample_data('BTCUSDT', '1d', path)
+        storetools.write_klines(df, path, 'BTCUSDT', '1h')
+        stale = storetools.read_klines(path, 'BTCUSDT', '1d')
+        assert stale['open_time'].iloc[-1] == pd.Timestamp('2022-02-10')
+        expected = resampletools.resample_klines(df, '1d')
+        fresh = binancetools.get_data('BTCUSDT', '1d', path)
+        assert fresh['close'].tolist() == expected['close'].tolist()
+
+        resampled = []
+        resample_klines = resampletools.resample_klines
+        monkeypatch.setattr(resampletools, 'resample_klines', lambda df, tf: resampled.append(len(df)) or resample_klines(df, tf))
+        binancetools.resample_data('BTCUSDT', '1d', path)
+        assert resampled == [len(df[df['open_time'] >= '2022-02-10'])]
+        assert storetools.read_klines(path, 'BTCUSDT', '1d')['close'].tolist() == expected['close'].tolist()
+    finally:
+        binancetools.BASE_TIMEFRAME = base
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools, storetools, commontools
+
+STEP = 3600000
+
+
+def klines(start, n, legacy=False):
+    times = start + STEP * np.arange(n, dtype=np.int64)
+    rows = [[t, 1.0, 2.0, 0.5, 1.5, 10.0, t + STEP - 1, 15.0, 7, 5.0, 7.5, '0'] for t in times.tolist()]
+    if not legacy:
+        return commontools.decode_klines(rows, commontools.KLINES_SCHEMA + [None])
+    df = pd.DataFrame(rows, columns=commontools.KLINES_SCHEMA + ['ignore']).astype(float)
+    df['open_time'] = pd.to_datetime(df['open_time'] * 1e6).astype('datetime64[us]')
+    df['close_time'] = pd.to_datetime(df['close_time'] * 1e6).astype('datetime64[us]')
+    return pd.concat([df.iloc[:n // 2], df.iloc[n // 2:]])
+
+
+def test_legacy_migration_keeps_common_schema(tmp_path):
+    path = str(tmp_path)
+    january = 1640995200000
+    klines(january, 24 * 31, legacy=True).to_parquet(storetools.legacy_path(path, 'BTCUSDT', '1h'), compression='gzip')
+    assert storetools.migrate(path, 'BTCUSDT', '1h') == 1
+    storetools.write_klines(klines(january + 24 * 31 * STEP, 24), path, 'BTCUSDT', '1h')
+
+    expected = klines(january, 24 * 32)
+    for mmap in (False, True):
+        df = storetools.read_klines(path, 'BTCUSDT', '1h', mmap=mmap)
+        assert list(df.columns) == commontools.KLINES_SCHEMA
+        assert df['trades'].dtype == np.int64
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    table = storetools.read_table(path, 'BTCUSDT', '1h', january + STEP, None, ['open_time', 'trades'])
+    assert table.num_rows == 24 * 32 - 1 and table.schema.field('trades').type == 'int64'
+
+
+def test_coverage_finds_interior_gaps_and_rescans_modified_partitions(tmp_path):
+    path = str(tmp_path)
+    january = 1640995200000
+    storetools.write_klines(klines(january, 100), path, 'BTCUSDT', '1h')
+    storetools.write_klines(klines(january + 150 * STEP, 700), path, 'BTCUSDT', '1h')
+    storetools.write_klines(klines(january + 900 * STEP, 100), path, 'BTCUSDT', '1h')
+    covered = storetools.coverage(path, 'BTCUSDT', '1h', STEP)
+    assert covered.tolist() == [[january, january + 99 * STEP], [january + 150 * STEP, january + 849 * STEP],
+                                [january + 900 * STEP, january + 999 * STEP]]
+    missing = storetools.gaps(covered, january, january + 1099 * STEP, STEP)
+    assert missing.tolist() == [[january + 99 * STEP + 1, january + 150 * STEP - 1], [january + 849 * STEP + 1, january + 900 * STEP - 1],
+                                [january + 999 * STEP + 1, january + 1099 * STEP]]
+    report = commontools.get_coverage(path, 'BTCUSDT', '1h')
+    assert report['stored'].tolist() == [True, False, True, False, True]
+    assert report['candles'].tolist() == [100, 50, 700, 50, 100]
+
+    storetools.write_klines(klines(january + 850 * STEP, 50), path, 'BTCUSDT', '1h')
+    assert storetools.coverage(path, 'BTCUSDT', '1h', STEP).tolist() == [[january, january + 99 * STEP],
+                                                                         [january + 150 * STEP, january + 999 * STEP]]
+
+
+class HoleClient(FakeBinanceClient):
+    """Listed at 2022-01-03 with a 6 hour maintenance on 2022-01-10"""
+    LISTING, HOLE = 1641168000000, (1641772800000, 1641772800000 + 5 * STEP)
+
+    def _klines_page(self, *args, **kwargs):
+        return [row for row in super()._klines_page(*args, **kwargs)
+                if row[0] >= self.LISTING and not self.HOLE[0] <= row[0] <= self.HOLE[1]]
+
+
+def test_repair_skips_intervals_without_exchange_data(tmp_path):
+    client = HoleClient(symbols=5)
+    for n, download in enumerate((lambda repair: binancetools.download_data(client, 'USDM', 'BTCUSDT', '1h', '2022-01-01', '2022-01-20',
+                                                                            str(tmp_path / 'single'), repair=repair),
+                                  lambda repair: binancetools.bulk_download(client, [('USDM', 'BTCUSDT', '1h', '2022-01-01', '2022-01-20')],
+                                                                            str(tmp_path / 'bulk'), repair=repair))):
+        path = str(tmp_path / ('single', 'bulk')[n])
+        download(False)
+        assert storetools.empty_intervals(path, 'BTCUSDT', '1h').tolist() == [[1640995200000, HoleClient.LISTING - 1],
+                                                                             [HoleClient.HOLE[0] - STEP + 1, HoleClient.HOLE[1] + STEP - 1]]
+        client.reset()
+        download(True)
+        assert not client.calls
+        report = commontools.get_coverage(path, 'BTCUSDT', '1h', '2022-01-01', '2022-01-20')
+        assert report['stored'].all()
@@ -0,0 +1,32 @@
+import time
+import asyncio
+from tradingtools import streamtools, storetools
+
+
+def message(i, closed=True):
+    t = 1640995200000 + i * 60000
+    return {'e': 'kline', 'k': {'s': 'BTCUSDT', 'i': '1m', 't': t, 'T': t + 59999, 'x': closed, 'o': '1', 'h': '2', 'l': '0.5',
+                                'c': '1.5', 'v': '10', 'q': '15', 'n': 7, 'V': '5', 'Q': '7.5'}}
+
+
+def test_arun_flushes_without_blocking_the_loop(tmp_path, monkeypatch):
+    write_klines = storetools.write_klines
+
+    def slow_write(*args, **kwargs):
+        time.sleep(0.2)
+        return write_klines(*args, **kwargs)
+
+    monkeypatch.setattr(storetools, 'write_klines', slow_write)
+    stream = streamtools.KlineStream(str(tmp_path), flush_size=10)
+    times = []
+
+    async def source():
+        for i in range(100):
+            await asyncio.sleep(0.005)
+            times.append(time.monotonic())
+            yield message(i)
+
+    asyncio.run(stream.arun(source()))
+    assert max(b - a for a, b in zip(times[:-1], times[1:])) < 0.1
+    assert len(storetools.read_klines(str(tmp_path), 'BTCUSDT', '1m')) == 100
+    assert stream.buffer('BTCUSDT', '1m').latest()[0] == 1640995200000 + 99 * 60000
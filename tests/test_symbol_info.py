@@ -0,0 +1,25 @@
+import pytest
+from benchmarks.fake_client import FakeBinanceClient
+from tradingtools import binancetools
+
+
+def test_unknown_symbols_are_cached_until_the_ttl_expires():
+    binancetools.symbol_info_cache.clear()
+    client = FakeBinanceClient(symbols=5)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            binancetools.get_symbol_info(client, 'USDM', 'NOPEUSDT')
+    assert client.calls['exchange_info'] == 1
+    with pytest.raises(ValueError):
+        binancetools.get_symbol_info(client, 'USDM', 'NOPEUSDT', ttl=0)
+    assert client.calls['exchange_info'] == 2
+
+
+def test_symbol_info_cache_is_keyed_by_base_url():
+    binancetools.symbol_info_cache.clear()
+    live, testnet = FakeBinanceClient(symbols=5), FakeBinanceClient(symbols=5)
+    live.FUTURES_URL, testnet.FUTURES_URL = 'https://fapi.binance.com/fapi', 'https://testnet.binancefuture.com/fapi'
+    binancetools.get_symbol_info(live, 'USDM', 'BTCUSDT')
+    binancetools.get_symbol_info(testnet, 'USDM', 'BTCUSDT')
+    binancetools.get_symbol_info(live, 'USDM', 'BTCUSDT')
+    assert live.calls['exchange_info'] == testnet.calls['exchange_info'] == 1
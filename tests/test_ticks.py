@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from tradingtools import ticktools
+
+EPOCH = 1640995200000
+
+
+class SparseClient:
+    """Aggregate trades endpoint with one trade every 10 seconds"""
+
+    def get_aggregate_trades(self, symbol, fromId=None, startTime=None, endTime=None, limit=500):
+        first = fromId if fromId is not None else -(-(startTime - EPOCH) // 10000)
+        last = (endTime - EPOCH) // 10000 if endTime is not None else 10 ** 6
+        return [{'a': i, 'p': '100.01', 'q': '0.5', 'f': i, 'l': i, 'T': EPOCH + i * 10000, 'm': bool(i % 2)}
+                for i in range(first, min(first + limit, last + 1))]
+
+
+def test_scale_is_exact():
+    assert ticktools.scale(['123.456789015', '0.00000001', '30000.01'], 8).tolist() == [12345678902, 1, 3000001000000]
+    with pytest.raises(OverflowError):
+        ticktools.scale(['123456789012.5'], 8)
+
+
+def test_download_agg_trades_sparse_feed(tmp_path):
+    n = ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + ticktools.DAY - 1, str(tmp_path), 2, 3)
+    trades = ticktools.read_agg_trades(str(tmp_path), 'BTCUSDT', scaled=True)
+    assert n == len(trades) == 8640
+    assert np.all(np.diff(trades['agg_id']) == 1)
+    assert trades['price'].unique().tolist() == [10001]
+
+
+def test_download_agg_trades_again_writes_nothing(tmp_path):
+    for expected in (61, 0):
+        n = ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + 600000, str(tmp_path), 2, 3)
+        assert n == expected
+    assert len(ticktools.read_agg_trades(str(tmp_path), 'BTCUSDT')) == 61
+
+
+def test_resumed_download_keeps_the_stored_decimals(tmp_path):
+    path = str(tmp_path)
+    ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + 600000, path, 2, 3)
+    with pytest.raises(ValueError):
+        ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + 1200000, path, 8, 8)
+    ticktools.download_agg_trades(SparseClient(), 'SPOT', 'BTCUSDT', EPOCH, EPOCH + 1200000, path)
+    assert ticktools.read_agg_trades(path, 'BTCUSDT')['price'].unique().tolist() == [100.01]
+
+    folder = ticktools.dataset_path(path, 'BTCUSDT', 'aggtrades')
+    columns = ticktools.decode_agg_trades(SparseClient().get_aggregate_trades('BTCUSDT', fromId=9000, limit=1), 8, 8)
+    with ticktools.TickWriter(folder, ticktools.AGG_TRADES_SCHEMA, {'price_decimals': 8, 'qty_decimals': 8}) as writer:
+        writer.write(columns)
+    with pytest.raises(ValueError):
+        ticktools.read_agg_trades(path, 'BTCUSDT')
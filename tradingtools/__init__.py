@@ -1,3 +1,23 @@
-import tradingtools.comon as commontools
-import tradingtools.binance as binancetools
-import tradingtools.kucoin as kucointools
\ No newline at end of file
+import importlib
+
+MODULES = {'metricstools': 'metrics', 'storetools': 'store', 'commontools': 'comon', 'resampletools': 'resample',
+           'streamtools': 'stream', 'paneltools': 'panel', 'indicatortools': 'indicators', 'backtesttools': 'backtest',
+           'positiontools': 'positions', 'ticktools': 'ticks', 'binancetools': 'binance', 'kucointools': 'kucoin', 'asyncbinancetools': 'binance_async'}
+__all__ = list(MODULES)
+
+
+def __getattr__(name):
+    """
+    Import the tools modules on first access (PEP 562), so importing the package does not load pandas, pyarrow...
+    :param name: module alias ('binancetools')
+    :return: module
+    """
+    if name not in MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module = importlib.import_module(f'{__name__}.{MODULES[name]}')
+    globals()[name] = module
+    return module
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""Backtesting Tools"""
+import logging
+import numpy as np
+import pandas as pd
+from tradingtools import commontools
+
+logger = logging.getLogger('backtesttools')
+
+TYPES = ['MARKET', 'LIMIT', 'STOP_MARKET', 'STOP', 'TAKE_PROFIT_MARKET', 'TAKE_PROFIT']
+MARKET, LIMIT, STOP_MARKET, STOP, TAKE_PROFIT_MARKET, TAKE_PROFIT = range(len(TYPES))
+
+
+def order_types(price, limit, stop, side):
+    """
+    Choose the order type of many orders the way send_order does
+    :param price: numpy.array of actual prices
+    :param limit: numpy.array of checked limit prices (NaN if none)
+    :param stop: numpy.array of checked stop prices (NaN if none)
+    :param side: numpy.array with 1 for 'BUY' and -1 for 'SELL'
+    :return: int8 numpy.array with the index of each order type in TYPES
+    """
+    has_limit, has_stop = ~np.isnan(limit), ~np.isnan(stop)
+    stop_side = ((side > 0) & (price <= stop)) | ((side < 0) & (price >= stop))
+    types = np.full(len(price), MARKET, dtype=np.int8)
+    types[has_limit & ~has_stop] = LIMIT
+    types[~has_limit & has_stop] = np.where(stop_side, STOP_MARKET, TAKE_PROFIT_MARKET)[~has_limit & has_stop]
+    types[has_limit & has_stop] = np.where(stop_side, STOP, TAKE_PROFIT)[has_limit & has_stop]
+    return types
+
+
+def fill_orders(open, high, low, bars, types, side, price, limit, stop, ttl=1, same_bar=False):
+    """
+    Simulate the intrabar fills of many orders over the bars following the one they are placed at. A triggered STOP or
+    TAKE_PROFIT (stop-limit) order rests from the next bar, since the order of the high and the low within the bar is
+    unknown
+    :param open: numpy.array of open prices
+    :param high: numpy.array of high prices
+    :param low: numpy.array of low prices
+    :param bars: numpy.array with the bar each order is placed at
+    :param types: numpy.array of order types (see order_types)
+    :param side: numpy.array with 1 for 'BUY' and -1 for 'SELL'
+    :param price: numpy.array of prices when the orders are placed
+    :param limit: numpy.array of limit prices (NaN if none)
+    :param stop: numpy.array of stop prices (NaN if none)
+    :param ttl: number of bars an unfilled order stays open
+    :param same_bar: let a triggered stop-limit order fill on the bar it is triggered at (optimistic)
+    :return: tuple of (fill_bar, fill_price) numpy.array, -1 and NaN for the orders not filled
+    """
+    n = len(open)
+    buy = side > 0
+    has_stop = ~np.isnan(stop)
+    up = has_stop & (stop > price)
+    triggered = ~has_stop
+    fill_bar = np.full(len(bars), -1, dtype=np.int64)
+    fill_price = np.full(len(bars), np.nan)
+
+    for k in range(1, ttl + 1):
+        j = bars + k
+        active = (fill_bar < 0) & (j < n)
+        j = np.minimum(j, n - 1)
+        o, h, lo = open[j], high[j], low[j]
+
+        market = active & (types == MARKET)
+        fill_bar[market], fill_price[market] = j[market], o[market]
+
+        hit = active & ~triggered & np.where(up, h >= stop, lo <= stop)
+        entry = np.where(hit, np.where(up, np.maximum(o, stop), np.minimum(o, stop)), o)
+        resting = triggered | hit if same_bar else triggered.copy()
+        triggered |= hit
+
+        stop_market = hit & ((types == STOP_MARKET) | (types == TAKE_PROFIT_MARKET))
+        fill_bar[stop_market], fill_price[stop_market] = j[stop_market], entry[stop_market]
+
+        resting &= active & ((types == LIMIT) | (types == STOP) | (types == TAKE_PROFIT))
+        reached = resting & np.where(buy, lo <= limit, h >= limit)
+        limit_price = np.where(buy, np.minimum(entry, limit), np.maximum(entry, limit))
+        fill_bar[reached], fill_price[reached] = j[reached], limit_price[reached]
+    return fill_bar, fill_price
+
+
+def backtest(open, high, low, close, side, quantity=None, notional=None, limitprice=None, stopprice=None, tick_size=0.01,
+             min_qty=0.001, min_notional=0.0, eps=0.001, maker_fee=0.0002, taker_fee=0.0004, ttl=1, same_bar=False):
+    """
+    Backtest a set of order signals over OHLC arrays applying the same rules as create_order and send_order: quantities
+    are checked with check_quantities, prices with check_prices (LIMIT to STOP MARKET conversions...) and floored to
+    tick_size, and STOP or TAKE_PROFIT is chosen from the price when the order is placed (the close of its bar)
+    :param open: numpy.array of open prices
+    :param high: numpy.array of high prices
+    :param low: numpy.array of low prices
+    :param close: numpy.array of close prices
+    :param side: numpy.array with 1 to place a 'BUY', -1 to place a 'SELL' and 0 for no order at each bar
+    :param quantity: quantity to buy/sell in coin, scalar or numpy.array
+    :param notional: quantity to buy/sell in notional, scalar or numpy.array (used when quantity is None)
+    :param limitprice: numpy.array of limit prices (NaN for none)
+    :param stopprice: numpy.array of stop prices (NaN for none)
+    :param tick_size: symbol resolution
+    :param min_qty: minimum quantity (and quantity step)
+    :param min_notional: minimum notional
+    :param eps: tolerance
+    :param maker_fee: fee rate of the orders filled as limit orders
+    :param taker_fee: fee rate of the orders filled as market orders
+    :param ttl: number of bars an unfilled order stays open
+    :param same_bar: let a triggered stop-limit order fill on the bar it is triggered at (optimistic)
+    :return: tuple of (orders, equity) pandas.DataFrame
+    """
+    open, high, low, close = (np.asarray(x, dtype=float) for x in (open, high, low, close))
+    side = np.asarray(side)
+    n = len(close)
+    bars = np.flatnonzero(side != 0)
+    sides = np.sign(side[bars]).astype(np.int8)
+    price = close[bars]
+    limit = np.broadcast_to(np.asarray(limitprice if limitprice is not None else np.nan, dtype=float), n)[bars]
+    stop = np.broadcast_to(np.asarray(stopprice if stopprice is not None else np.nan, dtype=float), n)[bars]
+
+    order_price = np.where(~np.isnan(limit), limit, np.where(~np.isnan(stop), stop, price))
+    if quantity is not None:
+        amount = np.broadcast_to(np.asarray(quantity, dtype=float), n)[bars]
+    else:
+        amount = np.broadcast_to(np.asarray(notional, dtype=float), n)[bars] / order_price
+    amount = commontools.check_quantities_array(amount, order_price, min_qty, min_notional)
+
+    limit, stop = commontools.check_prices_array(price, limit, stop, sides, eps)
+    types = order_types(price, limit, stop, sides)
+    limit = np.floor(limit * round(1 / tick_size)) / round(1 / tick_size)
+    stop = np.floor(stop * round(1 / tick_size)) / round(1 / tick_size)
+
+    valid = ~np.isnan(amount)
+    fill_bar, fill_price = fill_orders(open, high, low, bars, types, sides, price, limit, stop, ttl, same_bar)
+    fill_bar[~valid], fill_price[~valid] = -1, np.nan
+    filled = fill_bar >= 0
+    taker = (types == MARKET) | (types == STOP_MARKET) | (types == TAKE_PROFIT_MARKET)
+    fee = np.where(filled, fill_price * amount * np.where(taker, taker_fee, maker_fee), 0.0)
+
+    signed = np.where(filled, sides * amount, 0.0)
+    position = np.cumsum(np.bincount(fill_bar[filled], weights=signed[filled], minlength=n))
+    cash = np.cumsum(np.bincount(fill_bar[filled], weights=-(signed * fill_price + fee)[filled], minlength=n))
+    logger.debug(f'{len(bars)} orders over {n} bars: {valid.sum()} valid, {filled.sum()} filled')
+
+    orders = pd.DataFrame({'bar': bars, 'side': np.where(sides > 0, 'BUY', 'SELL'), 'type': np.array(TYPES)[types],
+                           'quantity': amount, 'limitprice': limit, 'stopprice': stop, 'fill_bar': fill_bar,
+                           'fill_price': fill_price, 'fee': fee})
+    equity = pd.DataFrame({'position': position, 'cash': cash, 'equity': cash + position * close})
+    return orders, equity
@@ -1,12 +1,39 @@
 """Binance Tools"""
+import json
 import logging
 import time
 import numpy as np
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from tradingtools import commontools
 
 logger = logging.getLogger('binancetools')
 
+BASE_TIMEFRAME = '1m'
+KLINES_FIELDS = ['open_time', 'open', 'high', 'low', 'close', 'vol', 'close_time', 'quote_vol', 'trades', 'taker_base_vol', 'taker_quote_vol', None]
+KLINES_LIMIT = 1000
+KLINES_WEIGHT = {'SPOT': 2, 'USDM': 5, 'COINM': 5}
+KLINES_ENDPOINT = {'SPOT': 'get_klines', 'USDM': 'futures_klines', 'COINM': 'futures_coin_klines'}
+WEIGHT_LIMIT = {'SPOT': 6000, 'USDM': 2400, 'COINM': 2400}
+BUDGET = 0.8
+EXCHANGE_INFO_TTL = 3600
+EXCHANGE_URL = {'SPOT': 'API_URL', 'USDM': 'FUTURES_URL', 'COINM': 'FUTURES_COIN_URL'}
+BATCH_ORDERS_LIMIT = 5
+BATCH_CANCEL_LIMIT = 10
+
+symbol_info_cache = {}
+# request weight per minute of each market, shared by every call of this module so concurrent downloads stay under the limit
+limiters = {market: commontools.RateLimiter(limit * BUDGET) for market, limit in WEIGHT_LIMIT.items()}
+
+
+def set_budget(budget):
+    """
+    Change the fraction of the weight limits used by the shared limiters
+    :param budget: fraction of the exchange weight limit per minute to use (0.8)
+    :return: None
+    """
+    for market, limiter in limiters.items():
+        limiter.weight = WEIGHT_LIMIT[market] * budget
+
 
 def fix_time(client):
     """
@@ -18,56 +45,223 @@ def fix_time(client):
     return client
 
 
-def get_klines(client, market, symbol, timeframe, start, end, reduce=None):
+def get_klines(client, market, symbol, timeframe, start, end, reduce=None, float32=False):
     """
     Get the candles of a symbol in a specified time-frame between two timestamps
     :param client: client class
     :param market: 'SPOT', 'USDM' or 'COINM'
     :param symbol: symbol string ('BTCUSDT')
     :param timeframe: klines timeframe string ('5m')
-    :param start: human-readable datetime for data start ('5 days ago')
-    :param end: human-readable datetime for data end ('now')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
     :param reduce: reduce the indices in the pandas.DataFrame to some list ([1, 150])
+    :param float32: store prices and volumes as float32
     :return: pandas.DataFrame with the data
     """
-    cols = ['open_time', 'open', 'high', 'low', 'close', 'vol', 'close_time', 'quote_vol', 'trades', 'taker_base_vol', 'taker_quote_vol', 'ignore']
     market = market.upper()
     symbol = symbol.upper()
     fun = client.futures_historical_klines if market == 'USDM' else (client.futures_coin_klines if market == 'COINM' else client.get_historical_klines)
-    df = pd.DataFrame(fun(symbol, timeframe, start + ' UTC', end + ' UTC'), columns=cols).astype(float)
-    if reduce is not None:
-        df = df[reduce]
-    else:
-        df['open_time'] = pd.to_datetime(df['open_time'] * 1e6).astype("datetime64[us]")
-        df['close_time'] = pd.to_datetime(df['close_time'] * 1e6).astype("datetime64[us]")
-    return df
+    return klines_to_frame(fun(symbol, timeframe, commontools.to_milliseconds(start), commontools.to_milliseconds(end)), reduce, float32)
 
 
-def download_data(client, market, symbol, timeframe, start, end, path):
+def klines_to_frame(klines, reduce=None, float32=False):
+    """
+    Convert the klines returned by the exchange into a DataFrame with the common klines schema
+    :param klines: list of klines
+    :param reduce: reduce the indices in the pandas.DataFrame to some list ([1, 150])
+    :param float32: store prices and volumes as float32
+    :return: pandas.DataFrame with the data
     """
-    Download the desired klines to a parquet file
+    df = commontools.decode_klines(klines, KLINES_FIELDS, float32=float32)
+    return df[reduce] if reduce is not None else df
+
+
+def get_klines_window(client, market, symbol, timeframe, start, end):
+    """
+    Get a single page of candles (up to KLINES_LIMIT) between two timestamps
     :param client: client class
     :param market: 'SPOT', 'USDM' or 'COINM'
     :param symbol: symbol string ('BTCUSDT')
     :param timeframe: klines timeframe string ('5m')
-    :param start: human-readable datetime for data start ('5 days ago')
-    :param end: human-readable datetime for data end ('now')
-    :param path: save path string
+    :param start: epoch milliseconds for data start
+    :param end: epoch milliseconds for data end
+    :return: pandas.DataFrame with the data
+    """
+    fun = getattr(client, KLINES_ENDPOINT[market.upper()])
+    return klines_to_frame(fun(symbol=symbol.upper(), interval=timeframe, startTime=start, endTime=end, limit=KLINES_LIMIT))
+
+
+def bulk_download(client, jobs, path, workers=8, budget=None, retries=3, compression='zstd', progress=None, repair=False):
+    """
+    Download many symbols and timeframes concurrently into the partitioned store without exceeding the weight limits
+    :param client: client class
+    :param jobs: list of (market, symbol, timeframe, start, end) tuples (('USDM', 'BTCUSDT', '1m', '1 year ago', 'now'))
+    :param path: store root path string
+    :param workers: number of concurrent requests
+    :param budget: fraction of the exchange weight limit per minute to use, applied to the shared limiters (see set_budget).
+    The actual one if None
+    :param retries: attempts for each window before giving it up
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param progress: function called with the job report every time one of its windows finishes
+    :param repair: fetch every interval missing from the ranges, not only before and after the stored data
+    :return: list with one report dict per job
+    """
+    if budget is not None:
+        set_budget(budget)
+    return commontools.bulk_download(client, jobs, path, logger, get_klines_window, KLINES_LIMIT, KLINES_WEIGHT, limiters,
+                                     KLINES_ENDPOINT, workers, retries, compression, progress, repair)
+
+
+def download_data(client, market, symbol, timeframe, start, end, path, compression='zstd', repair=False):
+    """
+    Download the desired klines into the partitioned store
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param path: store root path string
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param repair: fetch every interval missing from the range, not only before and after the stored data
     :return: None
     """
-    return commontools.download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines)
+    return commontools.download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines, compression, repair)
 
 
-def get_data(symbol, timeframe, path):
+def get_coverage(symbol, timeframe, path, start=None, end=None):
     """
-    Read a parquet file
+    Get the intervals stored and missing for a dataset without loading it
     :param symbol: symbol string ('BTCUSDT')
     :param timeframe: klines timeframe string ('5m')
-    :param path: save path string
-    :return: pandas.DataFrame with the data
-    :return: pandas.DataFrame with the data
+    :param path: store root path string
+    :param start: datetime for range start ('5 days ago'). The first stored open time if None
+    :param end: datetime for range end ('now'). The last stored open time if None
+    :return: pandas.DataFrame with start, end, candles and stored (False for gaps) columns
+    """
+    return commontools.get_coverage(path, symbol, timeframe, start, end)
+
+
+def get_data(symbol, timeframe, path, start=None, end=None, columns=None, mmap=False):
+    """
+    Read a dataset from the partitioned store
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param path: store root path string
+    :param start: datetime for data start ('5 days ago'). Only the partitions and row groups after it are read
+    :param end: datetime for data end ('now'). Only the partitions and row groups before it are read
+    :param columns: list of columns to read (['open_time', 'close'])
+    :param mmap: read from a memory-mapped Arrow copy of the dataset
+    :return: pandas.DataFrame with the data (resampled from BASE_TIMEFRAME klines if the timeframe is not stored, and
+    with the buckets newer than the stored ones resampled from them if it was stored with resample_data)
+    """
+    from tradingtools import storetools, resampletools
+    start = commontools.to_milliseconds(start) if start is not None else None
+    end = commontools.to_milliseconds(end) if end is not None else None
+    if timeframe != BASE_TIMEFRAME and storetools.exists(path, symbol, BASE_TIMEFRAME):
+        if not storetools.exists(path, symbol, timeframe):
+            return resampletools.read_resampled(path, symbol, BASE_TIMEFRAME, timeframe, start, end, columns)
+        return resampletools.read_refreshed(path, symbol, BASE_TIMEFRAME, timeframe, start, end, columns, mmap)
+    return storetools.read_klines(path, symbol, timeframe, start, end, columns, mmap)
+
+
+def get_panel(symbols, timeframe, path, start=None, end=None, fields=('open', 'high', 'low', 'close', 'vol'), workers=8, mmap=False,
+              out=None):
+    """
+    Read many symbols from the partitioned store aligned on a shared time index
+    :param symbols: list of symbol strings (['BTCUSDT', 'ETHUSDT'])
+    :param timeframe: klines timeframe string ('1h')
+    :param path: store root path string
+    :param start: datetime for data start ('5 days ago')
+    :param end: datetime for data end ('now')
+    :param fields: list of columns loaded for each symbol
+    :param workers: number of datasets read concurrently
+    :param mmap: read the datasets from their memory-mapped Arrow copies
+    :param out: folder where the panel is written as memory-mapped .npy files. In memory if None
+    :return: paneltools.Panel with (time, symbol, field) values and a (time, symbol) mask (resampled from BASE_TIMEFRAME
+    klines for the symbols without a stored timeframe)
+    """
+    from tradingtools import paneltools
+    return paneltools.load_panel(path, symbols, timeframe, start, end, fields, BASE_TIMEFRAME, workers, mmap, out)
+
+
+def resample_data(symbol, timeframe, path, compression='zstd'):
+    """
+    Store a higher timeframe derived from the stored BASE_TIMEFRAME klines, recomputing only from the last stored bucket
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('4h')
+    :param path: store root path string
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :return: number of partitions written
+    """
+    from tradingtools import resampletools
+    return resampletools.update_resampled(path, symbol, BASE_TIMEFRAME, timeframe, compression)
+
+
+def parse_symbol_info(info):
+    """
+    Extract the order filters of a symbol looking them up by filterType
+    :param info: symbol dict from the exchange info
+    :return: dict with tick_size, min_qty and min_notional
+    """
+    filters = {f['filterType']: f for f in info['filters']}
+    notional = filters.get('MIN_NOTIONAL', filters.get('NOTIONAL', {}))
+    return {'tick_size': float(filters['PRICE_FILTER']['tickSize']),
+            'min_qty': float(filters['LOT_SIZE']['minQty']),
+            'min_notional': float(notional.get('notional', notional.get('minNotional', 0)))}
+
+
+def symbol_info_key(client, market):
+    """
+    Get the cache key of the exchange info of a market, so clients of different endpoints (testnet...) do not share it
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: tuple with the base url, the testnet flag and the market
     """
-    return pd.read_parquet(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip')
+    market = market.upper()
+    return getattr(client, EXCHANGE_URL[market], None), getattr(client, 'testnet', False), market
+
+
+def refresh_symbol_info(client, market):
+    """
+    Fetch the exchange info of a market and store the parsed filters of every symbol in the cache
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: dict of symbol filters
+    """
+    market = market.upper()
+    logger.debug(f'Refreshing exchange info of {market}.')
+    if market == 'COINM':
+        info = client.futures_coin_exchange_info()
+    elif market == 'USDM':
+        info = client.futures_exchange_info()
+    else:
+        info = client.get_exchange_info()
+    # the set keeps the unknown symbols requested since the refresh, so they do not force another one until the ttl expires
+    symbol_info_cache[symbol_info_key(client, market)] = (time.time(), {x['symbol']: parse_symbol_info(x) for x in info['symbols']}, set())
+    return symbol_info_cache[symbol_info_key(client, market)][1]
+
+
+def get_symbol_info(client, market, symbol, ttl=EXCHANGE_INFO_TTL, refresh=False):
+    """
+    Get the order filters of a symbol from the cache, refreshing the market info when it is older than ttl or the symbol
+    was not seen since the last refresh
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param ttl: maximum age in seconds of the cached info
+    :param refresh: force a refresh of the market info
+    :return: dict with tick_size, min_qty and min_notional
+    """
+    market, symbol, key = market.upper(), symbol.upper(), symbol_info_key(client, market)
+    cached = symbol_info_cache.get(key)
+    if refresh or cached is None or time.time() - cached[0] > ttl or (symbol not in cached[1] and symbol not in cached[2]):
+        refresh_symbol_info(client, market)
+        cached = symbol_info_cache[key]
+    if symbol not in cached[1]:
+        cached[2].add(symbol)
+        raise ValueError(f'Unknown symbol {symbol} at {market}')
+    return cached[1][symbol]
 
 
 def send_order(f, market, quantity, price, limitprice, stopprice, symbol, side, positionside, timeinforce, tick_size, eps):
@@ -123,36 +317,33 @@ def send_order(f, market, quantity, price, limitprice, stopprice, symbol, side,
         return None
 
 
-def create_order(client, market, symbol, side, quantity=None, notional=None, limitprice=None, stopprice=None,
-                 positionside=None, timeinforce='GTC', custom=None, eps=0.001):
+def order_params(market, symbol, side, info, price, quantity=None, notional=None, limitprice=None, stopprice=None,
+                 positionside=None, timeinforce='GTC', eps=0.001):
     """
-    Place an order into the exchange (with more options that send_order)
-    :param client: client class
+    Validate an order and build its request parameters without any request, so it works for any client
     :param market: 'SPOT', 'USDM' or 'COINM'
     :param symbol: symbol ('BTCUSDT')
     :param side: 'BUY' or 'SELL'
+    :param info: dict with tick_size, min_qty and min_notional of the symbol (see get_symbol_info)
+    :param price: actual price
     :param quantity: quantity to buy/sell in coin (0.01)
     :param notional: quantity to buy/sell in notional (100)
     :param limitprice: limit price
     :param stopprice: stop price
     :param positionside: 'LONG' or 'SHORT'
     :param timeinforce: 'GTC', 'IOC' or 'FOK'
-    :param custom: custom order functions
     :param eps: tolerance
-    :return:
+    :return: dict of order parameters, or None if the order is not valid
     """
-    function_spot = custom[0] if custom is not None else client.create_order
-    function_usdm = custom[1] if custom is not None else client.futures_create_order
-    function_coin = custom[2] if custom is not None else client.futures_coin_create_order
-    symbol = symbol.upper()
+    market, symbol = market.upper(), symbol.upper()
+    min_qty, min_notional, tick_size = info['min_qty'], info['min_notional'], info['tick_size']
+
+    if market == 'COINM':
+        if not (quantity % 1 == 0 and quantity > 0):
+            quantity = None
 
-    if market.upper() == 'USDM':
-        info = next(filter(lambda x: x['symbol'] == symbol, client.futures_exchange_info()['symbols']))
-        price = float(client.futures_symbol_ticker(symbol=symbol)['price'])
+    else:
         order_price = float(limitprice) if limitprice else (float(stopprice) if (stopprice and not limitprice) else price)
-        min_qty = float(info['filters'][1]['minQty'])
-        min_notional = float(info['filters'][5]['notional'])
-        tick_size = float(info['filters'][0]['tickSize'])
 
         if notional is None and quantity is not None:
             quantity = commontools.check_quantities(quantity, order_price, min_qty, min_notional, logger)
@@ -164,37 +355,151 @@ def create_order(client, market, symbol, side, quantity=None, notional=None, lim
         else:
             quantity = None
 
-        return send_order(function_usdm, 'USDM', quantity, price, limitprice, stopprice, symbol, side, positionside, timeinforce, tick_size, eps)
+    return send_order(lambda **params: params, market, quantity, price, limitprice, stopprice, symbol, side, positionside, timeinforce,
+                      tick_size, eps)
 
-    elif market.upper() == 'COINM':
-        info = next(filter(lambda x: x['symbol'] == symbol, client.futures_coin_exchange_info()['symbols']))
-        price = float(client.futures_coin_symbol_ticker(symbol=symbol)[0]['price'])
-        tick_size = float(info['filters'][0]['tickSize'])
 
-        if not (quantity % 1 == 0 and quantity > 0):
-            quantity = None
+def order_function(client, market):
+    """
+    Get the order creation method of a market
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: client method
+    """
+    if market.upper() == 'COINM':
+        return client.futures_coin_create_order
+    elif market.upper() == 'USDM':
+        return client.futures_create_order
+    return client.create_order
+
+
+def create_order(client, market, symbol, side, quantity=None, notional=None, limitprice=None, stopprice=None,
+                 positionside=None, timeinforce='GTC', custom=None, eps=0.001, price=None):
+    """
+    Place an order into the exchange (with more options that send_order)
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol ('BTCUSDT')
+    :param side: 'BUY' or 'SELL'
+    :param quantity: quantity to buy/sell in coin (0.01)
+    :param notional: quantity to buy/sell in notional (100)
+    :param limitprice: limit price
+    :param stopprice: stop price
+    :param positionside: 'LONG' or 'SHORT'
+    :param timeinforce: 'GTC', 'IOC' or 'FOK'
+    :param custom: custom order functions
+    :param eps: tolerance
+    :param price: actual price, the ticker is not requested when given
+    :return: placed order
+    """
+    market, symbol = market.upper(), symbol.upper()
+    info = get_symbol_info(client, market, symbol)
+    price = get_price(client, market, symbol) if price is None else price
+    params = order_params(market, symbol, side, info, price, quantity, notional, limitprice, stopprice, positionside, timeinforce, eps)
+    if params is None:
+        return None
+    function = custom[('SPOT', 'USDM', 'COINM').index(market)] if custom is not None else order_function(client, market)
+    return function(**params)
 
-        return send_order(function_coin, 'COINM', quantity, price, limitprice, stopprice, symbol, side, positionside, timeinforce, tick_size, eps)
 
+def get_price(client, market, symbol):
+    """
+    Get the actual price of a symbol
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :return: price float
+    """
+    if market.upper() == 'COINM':
+        return float(client.futures_coin_symbol_ticker(symbol=symbol)[0]['price'])
+    elif market.upper() == 'USDM':
+        return float(client.futures_symbol_ticker(symbol=symbol)['price'])
+    return float(client.get_symbol_ticker(symbol=symbol)['price'])
+
+
+def get_prices(client, market):
+    """
+    Get the actual price of every symbol in one request
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: dict of symbol prices
+    """
+    if market.upper() == 'COINM':
+        tickers = client.futures_coin_symbol_ticker()
+    elif market.upper() == 'USDM':
+        tickers = client.futures_symbol_ticker()
     else:
-        info = client.get_symbol_info(symbol)
-        price = float(client.get_symbol_ticker(symbol=symbol)['price'])
-        order_price = float(limitprice) if limitprice else (float(stopprice) if (stopprice and not limitprice) else price)
-        min_qty = float(info['filters'][2]['minQty'])
-        min_notional = float(info['filters'][3]['minNotional'])
-        tick_size = float(info['filters'][0]['tickSize'])
+        tickers = client.get_symbol_ticker()
+    return {x['symbol']: float(x['price']) for x in tickers}
 
-        if notional is None and quantity is not None:
-            quantity = commontools.check_quantities(quantity, order_price, min_qty, min_notional, logger)
 
-        elif quantity is None and notional is not None:
-            quantity = notional / order_price
-            quantity = commontools.check_quantities(quantity, order_price, min_qty, min_notional, logger)
+def prepare_orders(market, orders, prices, symbols, eps=0.001):
+    """
+    Validate many orders and build their request parameters without any request (see order_params)
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param orders: list of dicts with create_order parameters ([{'symbol': 'BTCUSDT', 'side': 'BUY', 'notional': 100}])
+    :param prices: dict of symbol prices, used for the orders without a price
+    :param symbols: dict of symbol filters (see get_symbol_info)
+    :param eps: tolerance
+    :return: list with the order parameters (or None if it is not valid) for each order
+    """
+    params = []
+    for order in orders:
+        order = dict(order, symbol=order['symbol'].upper())
+        price = order.pop('price', None)
+        price = prices[order['symbol']] if price is None else price
+        params.append(order_params(market, info=symbols[order['symbol']], price=price, eps=order.pop('eps', eps), **order))
+    return params
 
-        else:
-            quantity = None
 
-        return send_order(function_spot, 'SPOT', quantity, price, limitprice, stopprice, symbol, side, positionside, timeinforce, tick_size, eps)
+def create_orders(client, market, orders, eps=0.001, workers=8):
+    """
+    Place many orders at once. All of them are validated before sending anything, then futures orders are sent
+    concurrently through the batch endpoint and spot orders one by one concurrently. A failed batch or order is logged
+    and does not stop the others
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param orders: list of dicts with create_order parameters ([{'symbol': 'BTCUSDT', 'side': 'BUY', 'notional': 100}])
+    :param eps: tolerance
+    :param workers: number of concurrent requests
+    :return: list with the placed order (or None if it was rejected or failed) for each order
+    """
+    market = market.upper()
+    prices = get_prices(client, market) if any(order.get('price') is None for order in orders) else {}
+    missing = {order['symbol'].upper() for order in orders if order.get('price') is None} - prices.keys()
+    prices.update({symbol: get_price(client, market, symbol) for symbol in missing})
+    symbols = {symbol: get_symbol_info(client, market, symbol) for symbol in {order['symbol'].upper() for order in orders}}
+    params = prepare_orders(market, orders, prices, symbols, eps)
+
+    valid = [i for i, p in enumerate(params) if p is not None]
+    results = [None] * len(orders)
+    function = client.futures_coin_place_batch_order if market == 'COINM' else client.futures_place_batch_order
+
+    def place_batch(batch):
+        try:
+            placed = function(batchOrders=[{k: str(v) for k, v in params[i].items() if v is not None} for i in batch])
+        except Exception as e:
+            logger.error(f'Batch of {len(batch)} orders {[params[i]["symbol"] for i in batch]} failed at {market}: {e}')
+            return
+        for i, order in zip(batch, placed):
+            if 'code' in order:
+                logger.error(f'Order {params[i]} rejected at {market}: {order["msg"]}')
+            else:
+                results[i] = order
+
+    def place(i):
+        try:
+            results[i] = client.create_order(**{k: v for k, v in params[i].items() if v is not None})
+        except Exception as e:
+            logger.error(f'Order {params[i]} failed at {market}: {e}')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if market in ('USDM', 'COINM'):
+            list(executor.map(place_batch, [valid[n:n + BATCH_ORDERS_LIMIT] for n in range(0, len(valid), BATCH_ORDERS_LIMIT)]))
+        else:
+            list(executor.map(place, valid))
+    logger.debug(f'{sum(r is not None for r in results)} of {len(orders)} orders placed at {market}.')
+    return results
 
 
 def get_orders(client, market, symbol=None):
@@ -244,79 +549,172 @@ def cancel_orders(client, market, symbol):
     return executed
 
 
-def get_positions(client, market, symbol=None, side=None):
+def cancel_order_list(client, market, orders, workers=8):
     """
-    Get the actual open positions
+    Cancel some placed orders. Futures orders are cancelled concurrently through the batch cancel endpoint, up to
+    BATCH_CANCEL_LIMIT orders of one symbol per request, and spot orders one by one concurrently. A failed batch or
+    order is logged and does not stop the others
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param orders: list of dicts with symbol and orderId, like the ones returned by create_orders or get_orders
+    :param workers: number of concurrent requests
+    :return: list with the cancelled order (or None if it was rejected or failed) for each order
+    """
+    market = market.upper()
+    results = [None] * len(orders)
+    function = client.futures_coin_cancel_orders if market == 'COINM' else client.futures_cancel_orders
+
+    def cancel_batch(batch):
+        symbol = orders[batch[0]]['symbol']
+        try:
+            cancelled = function(symbol=symbol, orderIdList=json.dumps([int(orders[i]['orderId']) for i in batch]))
+        except Exception as e:
+            logger.error(f'Batch cancel of {len(batch)} {symbol} orders failed at {market}: {e}')
+            return
+        for i, order in zip(batch, cancelled):
+            if 'code' in order:
+                logger.error(f'Cancel of order {orders[i]["orderId"]} rejected at {market}: {order["msg"]}')
+            else:
+                results[i] = order
+
+    def cancel(i):
+        try:
+            results[i] = client.cancel_order(symbol=orders[i]['symbol'], orderId=orders[i]['orderId'])
+        except Exception as e:
+            logger.error(f'Cancel of order {orders[i]["orderId"]} failed at {market}: {e}')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if market in ('USDM', 'COINM'):
+            by_symbol = {}
+            for i, order in enumerate(orders):
+                by_symbol.setdefault(order['symbol'], []).append(i)
+            list(executor.map(cancel_batch, [indexes[n:n + BATCH_CANCEL_LIMIT] for indexes in by_symbol.values()
+                                             for n in range(0, len(indexes), BATCH_CANCEL_LIMIT)]))
+        else:
+            list(executor.map(cancel, range(len(orders))))
+    logger.debug(f'{sum(r is not None for r in results)} of {len(orders)} orders cancelled at {market}.')
+    return results
+
+
+def cancel_all_orders(client, market, symbols=None, workers=8):
+    """
+    Cancel all placed orders of many symbols using the cancel-all endpoint of each symbol concurrently. Only the open
+    orders of the given symbols are listed, and a symbol that fails is logged and does not stop the others
     :param client: client class
     :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbols: list of symbol strings (['BTCUSDT']). All the symbols with open orders if None
+    :param workers: number of concurrent requests
+    :return: number of orders cancelled
+    """
+    market = market.upper()
+    listed = {}
+    if symbols is None:
+        for order in get_orders(client, market):
+            listed.setdefault(order['symbol'], []).append(order)
+    symbols = sorted(listed) if symbols is None else sorted({symbol.upper() for symbol in symbols})
+
+    if market == 'COINM':
+        function = client.futures_coin_cancel_all_open_orders
+    elif market == 'USDM':
+        function = client.futures_cancel_all_open_orders
+    else:
+        function = getattr(client, 'cancel_all_open_orders', None)
+
+    def cancel(symbol):
+        try:
+            orders = listed[symbol] if symbol in listed else get_orders(client, market, symbol)
+            if orders and function is not None:
+                function(symbol=symbol)
+            elif orders:
+                return sum(order is not None for order in cancel_order_list(client, market, orders, 1))
+            return len(orders)
+        except Exception as e:
+            logger.error(f'Cancelling the orders of {symbol} failed at {market}: {e}')
+            return 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        cancelled = sum(executor.map(cancel, symbols))
+    logger.debug(f'{cancelled} orders cancelled for {symbols} at {market}.')
+    return cancelled
+
+
+def filter_positions(data, market, symbol=None, side=None):
+    """
+    Filter the open positions out of the positions (or account for SPOT) information
+    :param data: positions information list, or account dict for SPOT
+    :param market: 'SPOT', 'USDM' or 'COINM'
     :param symbol: symbol string ('BTCUSDT')
-    :param side: 'BUY' or 'SELL'
-    :return: list of open positions
+    :param side: 'LONG' or 'SHORT'
+    :return: pandas.DataFrame with the open positions
     """
-    logger.debug(f'Getting all active positions of {symbol} at {market}.')
-    if market.upper() == 'COINM':
-        df = pd.DataFrame(client.futures_coin_position_information())
+    import pandas as pd
+    if market.upper() in ('COINM', 'USDM'):
+        df = pd.DataFrame(data)
+        amount = df['positionAmt'].astype(int if market.upper() == 'COINM' else float)
         if symbol:
             if side:
                 if side == 'LONG':
-                    return df[(df['positionAmt'].astype(int) > 0) & (df['symbol'] == symbol)]
-                return df[(df['positionAmt'].astype(int) < 0) & (df['symbol'] == symbol)]
-            return df[(df['positionAmt'].astype(int) != 0) & (df['symbol'] == symbol)]
-        return df[df['positionAmt'].astype(int) != 0]
-    elif market.upper() == 'USDM':
-        df = pd.DataFrame(client.futures_position_information())
-        if symbol:
-            if side:
-                if side == 'LONG':
-                    return df[(df['positionAmt'].astype(float) > 0) & (df['symbol'] == symbol)]
-                return df[(df['positionAmt'].astype(float) < 0) & (df['symbol'] == symbol)]
-            return df[(df['positionAmt'].astype(float) != 0) & (df['symbol'] == symbol)]
-        return df[df['positionAmt'].astype(float) != 0]
+                    return df[(amount > 0) & (df['symbol'] == symbol)]
+                return df[(amount < 0) & (df['symbol'] == symbol)]
+            return df[(amount != 0) & (df['symbol'] == symbol)]
+        return df[amount != 0]
     else:
-        df = pd.DataFrame(client.get_account()['balances'])
+        df = pd.DataFrame(data['balances'])
         df['balance'] = df['free'].astype(float) + df['locked'].astype(float)
         if symbol:
-            return df[(df['balance'].astype(float) != 0) & (df['asset'] == symbol)]
-        return df[df['balance'].astype(float) != 0]
+            return df[(df['balance'] != 0) & (df['asset'] == symbol)]
+        return df[df['balance'] != 0]
 
 
-def close_positions(client, market, symbol=None):
+def closing_orders(positions):
     """
-    Close the actual open positions
+    Build the orders that close some futures positions
+    :param positions: pandas.DataFrame with the open positions
+    :return: list of dicts with create_order parameters
+    """
+    orders = []
+    for i in positions.index:
+        quantity = float(positions.loc[i, 'positionAmt'])
+        if quantity > 0:
+            orders.append({'symbol': positions.loc[i, 'symbol'], 'side': 'SELL', 'quantity': abs(quantity), 'positionside': 'LONG'})
+        else:
+            orders.append({'symbol': positions.loc[i, 'symbol'], 'side': 'BUY', 'quantity': abs(quantity), 'positionside': 'SHORT'})
+    return orders
+
+
+def get_positions(client, market, symbol=None, side=None, tracker=None):
+    """
+    Get the actual open positions
     :param client: client class
     :param market: 'SPOT', 'USDM' or 'COINM'
     :param symbol: symbol string ('BTCUSDT')
-    :return: number of positions closed
+    :param side: 'LONG' or 'SHORT'
+    :param tracker: PositionTracker of the market. Positions are read from it instead of fetched if given
+    :return: list of open positions
     """
-    executed = 0
-
+    if tracker is not None:
+        tracker.maybe_reconcile(client)
+        return tracker.frame(symbol, side)
+    logger.debug(f'Getting all active positions of {symbol} at {market}.')
     if market.upper() == 'COINM':
-        df = pd.DataFrame(client.futures_coin_position_information())
-        if symbol:
-            positions = df[(df['positionAmt'].astype(int) != 0) & (df['symbol'] == symbol)]
-        else:
-            positions = df[df['positionAmt'].astype(int) != 0]
-
+        return filter_positions(client.futures_coin_position_information(), market, symbol, side)
     elif market.upper() == 'USDM':
-        df = pd.DataFrame(client.futures_position_information())
-        if symbol:
-            positions = df[(df['positionAmt'].astype(float) != 0) & (df['symbol'] == symbol)]
-        else:
-            positions = df[df['positionAmt'].astype(float) != 0]
-
+        return filter_positions(client.futures_position_information(), market, symbol, side)
     else:
-        return
+        return filter_positions(client.get_account(), market, symbol, side)
 
-    for i in positions.index:
-        symbol = positions.loc[i, 'symbol']
-        quantity = abs(float(positions.loc[i, 'positionAmt']))
-        if float(positions.loc[i, 'positionAmt']) > 0:
-            positionSide = 'LONG'
-            side = 'SELL'
-        else:
-            positionSide = 'SHORT'
-            side = 'BUY'
-        create_order(client, market, symbol, side, quantity=quantity, positionside=positionSide)
-        executed += 1
 
-    return executed
+def close_positions(client, market, symbol=None, tracker=None):
+    """
+    Close the actual open positions
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param tracker: PositionTracker of the market. Positions are read from it instead of fetched if given
+    :return: number of positions closed
+    """
+    if market.upper() not in ('COINM', 'USDM'):
+        return
+
+    positions = get_positions(client, market, symbol, tracker=tracker)
+    return sum(order is not None for order in create_orders(client, market, closing_orders(positions)))
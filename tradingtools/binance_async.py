@@ -0,0 +1,286 @@
+"""Binance Async Tools"""
+import asyncio
+import logging
+import time
+from tradingtools import commontools, binancetools
+
+logger = logging.getLogger('asyncbinancetools')
+
+
+async def fix_time(client):
+    """
+    Fix the client time if it drifts over some hours working
+    :param client: broken AsyncClient
+    :return: fixed AsyncClient
+    """
+    client.timestamp_offset = (await client.get_server_time())['serverTime'] - time.time() * 1000
+    return client
+
+
+def keep_time(client, interval=3600):
+    """
+    Run fix_time periodically in the background
+    :param client: AsyncClient
+    :param interval: seconds between two corrections
+    :return: asyncio.Task, cancel it to stop the corrections
+    """
+    async def loop():
+        while True:
+            try:
+                await fix_time(client)
+                logger.debug(f'Client time fixed. Offset {client.timestamp_offset:.0f} ms.')
+            except Exception as e:
+                logger.warning(f'Could not fix the client time: {e}')
+            await asyncio.sleep(interval)
+    return asyncio.ensure_future(loop())
+
+
+async def get_klines(client, market, symbol, timeframe, start, end, reduce=None, float32=False):
+    """
+    Get the candles of a symbol in a specified time-frame between two timestamps
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param reduce: reduce the indices in the pandas.DataFrame to some list ([1, 150])
+    :param float32: store prices and volumes as float32
+    :return: pandas.DataFrame with the data
+    """
+    market = market.upper()
+    symbol = symbol.upper()
+    fun = client.futures_historical_klines if market == 'USDM' else (client.futures_coin_klines if market == 'COINM' else client.get_historical_klines)
+    return binancetools.klines_to_frame(await fun(symbol, timeframe, commontools.to_milliseconds(start), commontools.to_milliseconds(end)),
+                                        reduce, float32)
+
+
+async def refresh_symbol_info(client, market):
+    """
+    Fetch the exchange info of a market and store the parsed filters of every symbol in the shared cache
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: dict of symbol filters
+    """
+    market = market.upper()
+    logger.debug(f'Refreshing exchange info of {market}.')
+    if market == 'COINM':
+        info = await client.futures_coin_exchange_info()
+    elif market == 'USDM':
+        info = await client.futures_exchange_info()
+    else:
+        info = await client.get_exchange_info()
+    key = binancetools.symbol_info_key(client, market)
+    binancetools.symbol_info_cache[key] = (time.time(), {x['symbol']: binancetools.parse_symbol_info(x) for x in info['symbols']}, set())
+    return binancetools.symbol_info_cache[key][1]
+
+
+async def get_symbol_info(client, market, symbol, ttl=binancetools.EXCHANGE_INFO_TTL, refresh=False):
+    """
+    Get the order filters of a symbol from the shared cache, refreshing the market info when it is older than ttl
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param ttl: maximum age in seconds of the cached info
+    :param refresh: force a refresh of the market info
+    :return: dict with tick_size, min_qty and min_notional
+    """
+    market, symbol, key = market.upper(), symbol.upper(), binancetools.symbol_info_key(client, market)
+    cached = binancetools.symbol_info_cache.get(key)
+    if refresh or cached is None or time.time() - cached[0] > ttl or (symbol not in cached[1] and symbol not in cached[2]):
+        await refresh_symbol_info(client, market)
+        cached = binancetools.symbol_info_cache[key]
+    if symbol not in cached[1]:
+        cached[2].add(symbol)
+        raise ValueError(f'Unknown symbol {symbol} at {market}')
+    return cached[1][symbol]
+
+
+async def get_price(client, market, symbol):
+    """
+    Get the actual price of a symbol
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :return: price float
+    """
+    if market.upper() == 'COINM':
+        return float((await client.futures_coin_symbol_ticker(symbol=symbol))[0]['price'])
+    elif market.upper() == 'USDM':
+        return float((await client.futures_symbol_ticker(symbol=symbol))['price'])
+    return float((await client.get_symbol_ticker(symbol=symbol))['price'])
+
+
+async def get_prices(client, market):
+    """
+    Get the actual price of every symbol in one request
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :return: dict of symbol prices
+    """
+    if market.upper() == 'COINM':
+        tickers = await client.futures_coin_symbol_ticker()
+    elif market.upper() == 'USDM':
+        tickers = await client.futures_symbol_ticker()
+    else:
+        tickers = await client.get_symbol_ticker()
+    return {x['symbol']: float(x['price']) for x in tickers}
+
+
+async def create_order(client, market, symbol, side, quantity=None, notional=None, limitprice=None, stopprice=None,
+                       positionside=None, timeinforce='GTC', custom=None, eps=0.001, price=None):
+    """
+    Place an order into the exchange, fetching the symbol info and the price concurrently
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol ('BTCUSDT')
+    :param side: 'BUY' or 'SELL'
+    :param quantity: quantity to buy/sell in coin (0.01)
+    :param notional: quantity to buy/sell in notional (100)
+    :param limitprice: limit price
+    :param stopprice: stop price
+    :param positionside: 'LONG' or 'SHORT'
+    :param timeinforce: 'GTC', 'IOC' or 'FOK'
+    :param custom: custom order coroutines
+    :param eps: tolerance
+    :param price: actual price, the ticker is not requested when given
+    :return: placed order
+    """
+    market, symbol = market.upper(), symbol.upper()
+    if price is None:
+        info, price = await asyncio.gather(get_symbol_info(client, market, symbol), get_price(client, market, symbol))
+    else:
+        info = await get_symbol_info(client, market, symbol)
+
+    params = binancetools.order_params(market, symbol, side, info, price, quantity, notional, limitprice, stopprice, positionside,
+                                       timeinforce, eps)
+    if params is None:
+        return None
+    function = custom[('SPOT', 'USDM', 'COINM').index(market)] if custom is not None else binancetools.order_function(client, market)
+    return await function(**params)
+
+
+async def create_orders(client, market, orders, eps=0.001):
+    """
+    Place many orders at once. All of them are validated before sending anything, futures orders are sent through
+    the batch endpoint and every request runs concurrently. A failed batch or order is logged and does not stop the others
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param orders: list of dicts with create_order parameters ([{'symbol': 'BTCUSDT', 'side': 'BUY', 'notional': 100}])
+    :param eps: tolerance
+    :return: list with the placed order (or None if it was rejected or failed) for each order
+    """
+    market = market.upper()
+    symbols = {order['symbol'].upper() for order in orders}
+    key = binancetools.symbol_info_key(client, market)
+    cached = binancetools.symbol_info_cache.get(key)
+    stale = cached is None or time.time() - cached[0] > binancetools.EXCHANGE_INFO_TTL or not symbols <= cached[1].keys() | cached[2]
+    need_prices = any(order.get('price') is None for order in orders)
+    if need_prices and stale:
+        prices, info = await asyncio.gather(get_prices(client, market), refresh_symbol_info(client, market))
+    else:
+        prices = await get_prices(client, market) if need_prices else {}
+        info = await refresh_symbol_info(client, market) if stale else cached[1]
+    if not symbols <= info.keys():
+        binancetools.symbol_info_cache[key][2].update(symbols - info.keys())
+        raise ValueError(f'Unknown symbols {sorted(symbols - info.keys())} at {market}')
+    missing = sorted({order['symbol'].upper() for order in orders if order.get('price') is None} - prices.keys())
+    prices.update(zip(missing, await asyncio.gather(*[get_price(client, market, symbol) for symbol in missing])))
+    params = binancetools.prepare_orders(market, orders, prices, info, eps)
+
+    valid = [i for i, p in enumerate(params) if p is not None]
+    placed = [None] * len(orders)
+    if market in ('USDM', 'COINM'):
+        function = client.futures_coin_place_batch_order if market == 'COINM' else client.futures_place_batch_order
+        batches = [valid[n:n + binancetools.BATCH_ORDERS_LIMIT] for n in range(0, len(valid), binancetools.BATCH_ORDERS_LIMIT)]
+        responses = await asyncio.gather(*[function(batchOrders=[{k: str(v) for k, v in params[i].items() if v is not None} for i in batch])
+                                           for batch in batches], return_exceptions=True)
+        for batch, response in zip(batches, responses):
+            if isinstance(response, Exception):
+                logger.error(f'Batch of {len(batch)} orders {[params[i]["symbol"] for i in batch]} failed at {market}: {response}')
+                continue
+            for i, order in zip(batch, response):
+                if 'code' in order:
+                    logger.error(f'Order {params[i]} rejected at {market}: {order["msg"]}')
+                else:
+                    placed[i] = order
+    else:
+        responses = await asyncio.gather(*[client.create_order(**{k: v for k, v in params[i].items() if v is not None}) for i in valid],
+                                         return_exceptions=True)
+        for i, order in zip(valid, responses):
+            if isinstance(order, Exception):
+                logger.error(f'Order {params[i]} failed at {market}: {order}')
+            else:
+                placed[i] = order
+    logger.debug(f'{sum(p is not None for p in placed)} of {len(orders)} orders placed at {market}.')
+    return placed
+
+
+async def get_orders(client, market, symbol=None):
+    """
+    Get placed orders
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :return: list of created orders
+    """
+    logger.debug(f'Getting all open orders of {symbol} at {market}.')
+    if market.upper() == 'COINM':
+        return await client.futures_coin_get_open_orders(symbol=symbol)
+    elif market.upper() == 'USDM':
+        return await client.futures_get_open_orders(symbol=symbol)
+    else:
+        return await client.get_open_orders(symbol=symbol)
+
+
+async def cancel_orders(client, market, symbol):
+    """
+    Cancel all placed orders, sending the cancellations concurrently
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :return: number of orders cancelled
+    """
+    if market.upper() == 'COINM':
+        function = client.futures_coin_cancel_order
+    elif market.upper() == 'USDM':
+        function = client.futures_cancel_order
+    else:
+        function = client.cancel_order
+    orders = await get_orders(client, market, symbol)
+    await asyncio.gather(*[function(symbol=symbol, orderId=order['orderId']) for order in orders])
+    logger.debug(f'{len(orders)} orders cancelled for {symbol} at {market.upper()}.')
+    return len(orders)
+
+
+async def get_positions(client, market, symbol=None, side=None):
+    """
+    Get the actual open positions
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param side: 'LONG' or 'SHORT'
+    :return: list of open positions
+    """
+    logger.debug(f'Getting all active positions of {symbol} at {market}.')
+    if market.upper() == 'COINM':
+        return binancetools.filter_positions(await client.futures_coin_position_information(), market, symbol, side)
+    elif market.upper() == 'USDM':
+        return binancetools.filter_positions(await client.futures_position_information(), market, symbol, side)
+    else:
+        return binancetools.filter_positions(await client.get_account(), market, symbol, side)
+
+
+async def close_positions(client, market, symbol=None):
+    """
+    Close the actual open positions
+    :param client: AsyncClient
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :return: number of positions closed
+    """
+    if market.upper() not in ('COINM', 'USDM'):
+        return
+
+    positions = await get_positions(client, market, symbol)
+    return sum(order is not None for order in await create_orders(client, market, binancetools.closing_orders(positions)))
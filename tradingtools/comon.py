@@ -1,55 +1,391 @@
-import os
-import dateparser
-import pandas as pd
+import re
+import time
+import datetime
+import functools
+import collections
+import threading
+from operator import itemgetter
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tradingtools import metricstools
 
 
-def download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines):
+KLINES_SCHEMA = ['open_time', 'open', 'high', 'low', 'close', 'vol', 'close_time', 'quote_vol', 'trades', 'taker_base_vol', 'taker_quote_vol']
+TIMEFRAME_UNITS = {'m': 60000, 'min': 60000, 'h': 3600000, 'hour': 3600000, 'd': 86400000, 'day': 86400000,
+                   'w': 604800000, 'week': 604800000, 'M': 2678400000, 'mon': 2678400000}
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?')
+RELATIVE_DATE = re.compile(r'(\d+) (second|minute|hour|day|week)s? ago')
+RELATIVE_UNITS = {'second': 1000, 'minute': 60000, 'hour': 3600000, 'day': 86400000, 'week': 604800000}
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+USED_WEIGHT_HEADER = 'x-mbx-used-weight-1m'
+
+
+class RateLimiter:
+    """
+    Thread-safe request-weight budget over a sliding window: the weight acquired in any period never exceeds the limit
     """
 
-    :param client:
-    :param market:
-    :param symbol:
-    :param timeframe:
-    :param start:
-    :param end:
-    :param path:
-    :param logger:
-    :param get_klines:
-    :return:
+    def __init__(self, weight, period=60):
+        """
+        :param weight: maximum weight allowed per period
+        :param period: period in seconds
+        """
+        self.weight = weight
+        self.period = period
+        self._used = 0.0
+        self._history = collections.deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._history and self._history[0][0] <= now - self.period:
+            self._used -= self._history.popleft()[1]
+
+    def acquire(self, weight=1):
+        """
+        Block until the requested weight fits in the last period and consume it
+        :param weight: weight of the request
+        :return: None
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                if self._used + weight <= self.weight or not self._history:
+                    self._history.append((now, weight))
+                    self._used += weight
+                    return
+                freed = 0.0
+                for t, w in self._history:
+                    freed += w
+                    if self._used - freed + weight <= self.weight:
+                        break
+                wait = t + self.period - now
+            time.sleep(max(wait, 0.001))
+
+    def sync(self, used):
+        """
+        Resync with the weight the exchange reports as used in the actual period, which includes the requests of other
+        clients sharing the same IP. The local count is only ever raised
+        :param used: used weight reported by the exchange
+        :return: None
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if used > self._used:
+                self._history.append((now, used - self._used))
+                self._used = float(used)
+
+
+def used_weight(client, header=USED_WEIGHT_HEADER):
+    """
+    Get the used weight reported in the headers of the last response of a client
+    :param client: client class
+    :param header: header name
+    :return: used weight float, or None if the client or the exchange does not report it
+    """
+    headers = getattr(getattr(client, 'response', None), 'headers', None)
+    value = headers.get(header) if headers else None
+    return float(value) if value is not None else None
+
+
+def timeframe_to_ms(timeframe):
+    """
+    Convert a timeframe into milliseconds (months are taken as 31 days)
+    :param timeframe: klines timeframe string ('5m', '1h', '5min', '1hour') or minutes int (5)
+    :return: milliseconds int
+    """
+    if isinstance(timeframe, (int, np.integer)):
+        return int(timeframe) * TIMEFRAME_UNITS['m']
+    match = re.fullmatch(r'(\d+)([a-zA-Z]+)', timeframe)
+    if match is None or match.group(2) not in TIMEFRAME_UNITS:
+        raise ValueError(f'Unknown timeframe {timeframe}')
+    return int(match.group(1)) * TIMEFRAME_UNITS[match.group(2)]
+
+
+def to_milliseconds(date):
+    """
+    Convert a date into epoch milliseconds. Numbers, datetimes, ISO strings, 'now' and 'N units ago' are converted
+    directly and only other phrases go through dateparser. Naive dates are taken as UTC
+    :param date: epoch milliseconds, datetime, numpy.datetime64, ISO string ('2021-01-01 12:00') or human-readable
+    datetime ('5 days ago')
+    :return: epoch milliseconds int
+    """
+    if isinstance(date, (int, float, np.integer, np.floating)):
+        return int(date)
+    if isinstance(date, np.datetime64):
+        return int(date.astype('datetime64[ms]').astype(np.int64))
+    if isinstance(date, datetime.datetime):
+        date = date if date.tzinfo is not None else date.replace(tzinfo=datetime.timezone.utc)
+        return (date - EPOCH) // datetime.timedelta(milliseconds=1)
+    if isinstance(date, datetime.date):
+        return to_milliseconds(datetime.datetime(date.year, date.month, date.day))
+    text = ' '.join(date.lower().split())
+    if ISO_DATE.fullmatch(text.upper()):
+        return to_milliseconds(datetime.datetime.fromisoformat(text.upper().replace('Z', '+00:00')))
+    if text == 'now':
+        return int(time.time() * 1000)
+    match = RELATIVE_DATE.fullmatch(text)
+    if match is not None:
+        return int(time.time() * 1000) - int(match.group(1)) * RELATIVE_UNITS[match.group(2)]
+    absolute = parse_absolute(text)
+    return absolute if absolute is not None else parse_date(text)
+
+
+def parse_date(text, base=None):
+    """
+    Parse a human-readable datetime with dateparser, imported on the first call
+    :param text: human-readable datetime ('last friday')
+    :param base: datetime relative dates are computed from. The actual time if None
+    :return: epoch milliseconds int
+    """
+    import dateparser
+    settings = {'TIMEZONE': 'UTC', 'RETURN_AS_TIMEZONE_AWARE': True}
+    if base is not None:
+        settings['RELATIVE_BASE'] = base
+    parsed = dateparser.parse(text, settings=settings)
+    if parsed is None:
+        raise ValueError(f'Unknown date {text}')
+    return to_milliseconds(parsed)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_absolute(text):
+    """
+    Parse a human-readable datetime once, if it does not depend on the actual time ('1 jan 2021' but not 'yesterday')
+    :param text: human-readable datetime
+    :return: epoch milliseconds int, or None for relative datetimes
+    """
+    first, second = parse_date(text, datetime.datetime(2000, 1, 1)), parse_date(text, datetime.datetime(2001, 7, 15, 12, 30))
+    return first if first == second else None
+
+
+def decode_klines(klines, fields, step=None, time_scale=1, float32=False):
+    """
+    Decode the klines returned by an exchange straight into typed columns with the common KLINES_SCHEMA
+    :param klines: list of klines
+    :param fields: name of each field of a kline in KLINES_SCHEMA, None for the fields to drop
+    :param step: timeframe in milliseconds, used to fill close_time when the exchange does not return it
+    :param time_scale: factor converting the exchange timestamps into epoch milliseconds (1000 for seconds)
+    :param float32: store prices and volumes as float32 instead of float64
+    :return: pandas.DataFrame sorted by open_time (trades is -1 when the exchange does not return it)
+    """
+    import pandas as pd
+    n = len(klines)
+    index = {name: i for i, name in enumerate(fields) if name is not None}
+    dtype = np.float32 if float32 else np.float64
+    columns = {}
+    for name in KLINES_SCHEMA:
+        if name in ('open_time', 'close_time'):
+            if name in index:
+                columns[name] = np.fromiter(map(itemgetter(index[name]), klines), dtype=np.int64, count=n) * time_scale
+            else:
+                columns[name] = columns['open_time'] + (step - 1)
+        elif name == 'trades':
+            columns[name] = np.fromiter(map(itemgetter(index[name]), klines), dtype=np.int64, count=n) if name in index else np.full(n, -1, dtype=np.int64)
+        else:
+            columns[name] = np.fromiter(map(itemgetter(index[name]), klines), dtype=dtype, count=n) if name in index else np.full(n, np.nan, dtype=dtype)
+    if n > 1 and np.any(np.diff(columns['open_time']) < 0):
+        order = np.argsort(columns['open_time'], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+    columns['open_time'] = (columns['open_time'] * 1000).view('datetime64[us]')
+    columns['close_time'] = (columns['close_time'] * 1000).view('datetime64[us]')
+    return pd.DataFrame(columns, columns=KLINES_SCHEMA)
+
+
+def open_times(df):
+    """
+    Get the open times of some klines as epoch milliseconds
+    :param df: pandas.DataFrame with an 'open_time' column
+    :return: int64 numpy.array
     """
-    if not os.path.isfile(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip'):
-        logger.info(f'Creating File: {path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip')
-        df = get_klines(client, market, symbol.upper(), timeframe, start, end)
-        df.to_parquet(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip', compression='gzip', allow_truncated_timestamps=True)
+    return df['open_time'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+
+def download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines, compression='zstd', repair=False):
+    """
+    Download the desired klines into the partitioned store, writing only the partitions that change
+    :param client: client class
+    :param market: market string passed to get_klines
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param path: store root path string
+    :param logger: exchange logger
+    :param get_klines: exchange get_klines function
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param repair: fetch every interval missing from the range (see get_coverage), not only before and after the stored data
+    :return: None
+    """
+    import pandas as pd
+    from tradingtools import storetools
+    folder = storetools.dataset_path(path, symbol, timeframe)
+    storetools.migrate(path, symbol, timeframe, compression)
+    start, end = to_milliseconds(start), to_milliseconds(end)
+
+    step, fetched = timeframe_to_ms(timeframe), []
+    if not storetools.exists(path, symbol, timeframe):
+        logger.info(f'Creating Dataset: {folder}')
+        fetched = [(start, end)]
+        new = [get_klines(client, market, symbol.upper(), timeframe, start, end)]
+    elif repair:
+        missing = storetools.gaps(storetools.coverage(path, symbol, timeframe, step), start, end, step,
+                                  storetools.empty_intervals(path, symbol, timeframe))
+        logger.debug(f'{len(missing)} gaps to repair in {folder}')
+        if len(missing) == 0:
+            logger.debug('Nothing to update')
+            return None
+        fetched = missing.tolist()
+        new = [get_klines(client, market, symbol, timeframe, first, last) for first, last in fetched]
     else:
-        df = pd.read_parquet(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip')
-        dt_range = (dateparser.parse(start, settings={'TIMEZONE': 'UTC'}), dateparser.parse(end, settings={'TIMEZONE': 'UTC'}))
-        dt_data = (df['open_time'].iloc[0], df['open_time'].iloc[-1])
-        logger.debug(f'Requested date range: {dt_range[0].strftime("%Y/%m/%d %H:%M:%S")} to {dt_range[1].strftime("%Y/%m/%d %H:%M:%S")}')
-        logger.debug(f'Database date range: {dt_data[0].strftime("%Y/%m/%d %H:%M:%S")} to {dt_data[1].strftime("%Y/%m/%d %H:%M:%S")}')
-
-        if (dt_range[1] < dt_data[0]) or (dt_range[0] < dt_data[0] <= dt_range[1] <= dt_data[1]):
-            df = pd.concat([get_klines(client, market, symbol, timeframe, str(dt_range[0]), str(dt_data[0])).iloc[:-1], df])
+        first, last = (int(t.value // 10 ** 6) for t in storetools.time_range(path, symbol, timeframe))
+        logger.debug(f'Requested date range: {pd.Timestamp(start, unit="ms"):%Y/%m/%d %H:%M:%S} to {pd.Timestamp(end, unit="ms"):%Y/%m/%d %H:%M:%S}')
+        logger.debug(f'Database date range: {pd.Timestamp(first, unit="ms"):%Y/%m/%d %H:%M:%S} to {pd.Timestamp(last, unit="ms"):%Y/%m/%d %H:%M:%S}')
+
+        if (end < first) or (start < first <= end <= last):
+            new = [get_klines(client, market, symbol, timeframe, start, first).iloc[:-1]]
             logger.debug('Range lower than database')
 
-        elif dt_range[0] < dt_data[0] and dt_range[1] > dt_data[1]:
-            df = pd.concat([get_klines(client, market, symbol, timeframe, str(dt_range[0]), str(dt_data[0])).iloc[:-1], df])
-            df = pd.concat([df, get_klines(client, market, symbol, timeframe, str(dt_data[1]), str(dt_range[1])).iloc[1:]])
+        elif start < first and end > last:
+            new = [get_klines(client, market, symbol, timeframe, start, first).iloc[:-1],
+                   get_klines(client, market, symbol, timeframe, last, end).iloc[1:]]
             logger.debug('Range lower and greater than database')
 
-        elif (dt_data[0] <= dt_range[0] <= dt_data[1] < dt_range[1]) or (dt_range[0] > dt_data[1]):
-            df = pd.concat([df, get_klines(client, market, symbol, timeframe, str(dt_data[1]), str(dt_range[1])).iloc[1:]])
+        elif (first <= start <= last < end) or (start > last):
+            new = [get_klines(client, market, symbol, timeframe, last, end).iloc[1:]]
             logger.debug('Range greater than database')
 
         else:
             logger.debug('Nothing to update')
+            return None
 
-    df.to_parquet(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip', compression='gzip', allow_truncated_timestamps=True)
-    logger.info(f'Database updated and saved into {path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip')
+    written = sum(storetools.write_klines(df, path, symbol, timeframe, compression) for df in new)
+    storetools.record_empty(path, symbol, timeframe, fetched, np.concatenate([open_times(df) for df in new]), step)
+    logger.info(f'Database updated and saved into {folder} ({written} partitions written)')
     return None
 
 
+def bulk_download(client, jobs, path, logger, get_window, window_size, weights, limiters, endpoints, workers=8, retries=3,
+                  compression='zstd', progress=None, repair=False):
+    """
+    Download many datasets at once, splitting each range into windows fetched concurrently under a weight budget
+    :param client: client class
+    :param jobs: list of (market, symbol, timeframe, start, end) tuples
+    :param path: store root path string
+    :param logger: exchange logger
+    :param get_window: function (client, market, symbol, timeframe, start_ms, end_ms) returning one page of klines
+    :param window_size: number of candles returned by one get_window call, int or dict with one for each market
+    :param weights: dict with the request weight of one get_window call for each market
+    :param limiters: dict with the RateLimiter shared by each market
+    :param endpoints: dict with the client method name called by get_window for each market, used to report the retries
+    :param workers: number of concurrent requests
+    :param retries: attempts for each window before giving it up
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param progress: function called with the job report every time one of its windows finishes
+    :param repair: fetch every interval missing from the ranges (see get_coverage), not only before and after the stored data
+    :return: list with one report dict per job
+    """
+    import pandas as pd
+    from tradingtools import storetools
+    reports, tasks = [], []
+    for market, symbol, timeframe, start, end in jobs:
+        market, step = market.upper(), timeframe_to_ms(timeframe)
+        size = window_size[market] if isinstance(window_size, dict) else window_size
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        storetools.migrate(path, symbol, timeframe, compression)
+        ranges = [(start, end)]
+        if repair and storetools.exists(path, symbol, timeframe):
+            ranges = storetools.gaps(storetools.coverage(path, symbol, timeframe, step), start, end, step,
+                                     storetools.empty_intervals(path, symbol, timeframe)).tolist()
+        elif storetools.exists(path, symbol, timeframe):
+            first, last = (int(t.value // 10 ** 6) for t in storetools.time_range(path, symbol, timeframe))
+            ranges = [(start, min(end, first - 1)), (max(start, last + step), end)]
+        windows = [(w, min(w + size * step, e + 1) - 1) for s, e in ranges if s <= e
+                   for w in range(s - s % step, e + 1, size * step)]
+        reports.append({'market': market, 'symbol': symbol, 'timeframe': timeframe, 'windows': len(windows), 'done': 0,
+                        'failed': 0, 'rows': 0, 'errors': []})
+        tasks += [(len(reports) - 1, window) for window in windows]
+        if not windows:
+            logger.debug(f'Nothing to update for {symbol} {timeframe} at {market}')
+    frames, fetched = [[] for _ in reports], [[] for _ in reports]
+
+    def fetch(report, window):
+        for attempt in range(retries):
+            limiters[report['market']].acquire(weights[report['market']])
+            try:
+                df = get_window(client, report['market'], report['symbol'], report['timeframe'], window[0], window[1])
+                used = used_weight(client)
+                if used is not None:
+                    limiters[report['market']].sync(used)
+                return df
+            except Exception as e:
+                logger.warning(f'Window {window} of {report["symbol"]} {report["timeframe"]} failed ({attempt + 1}/{retries}): {e}')
+                if attempt == retries - 1:
+                    raise
+                metricstools.record_retry(client, endpoints[report['market']])
+                time.sleep(2 ** attempt)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, reports[i], window): (i, window) for i, window in tasks}
+        for future in as_completed(futures):
+            i, window = futures[future]
+            report = reports[i]
+            try:
+                df = future.result()
+                frames[i].append(df)
+                fetched[i].append(window)
+                report['rows'] += len(df)
+                report['done'] += 1
+            except Exception as e:
+                report['errors'].append((window, repr(e)))
+                report['failed'] += 1
+            if report['done'] + report['failed'] == report['windows']:
+                if frames[i]:
+                    df = pd.concat(frames[i])
+                    storetools.write_klines(df, path, report['symbol'], report['timeframe'], compression)
+                    storetools.record_empty(path, report['symbol'], report['timeframe'], fetched[i], open_times(df),
+                                            timeframe_to_ms(report['timeframe']))
+                    frames[i] = []
+                logger.info(f'{report["symbol"]} {report["timeframe"]} at {report["market"]} saved: {report["rows"]} rows, '
+                            f'{report["failed"]} failed windows')
+            if progress is not None:
+                progress(report)
+
+    return reports
+
+
+def get_coverage(path, symbol, timeframe, start=None, end=None):
+    """
+    Get the intervals stored and missing for a dataset from its coverage manifest, without loading the data
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: range start (epoch milliseconds or human-readable datetime). The first stored open time if None
+    :param end: range end (epoch milliseconds or human-readable datetime). The last stored open time if None
+    :return: pandas.DataFrame with start, end (first and last open time), candles and stored (False for gaps) columns.
+    The intervals fetched without klines at the exchange (see storetools.record_empty) are not gaps
+    """
+    import pandas as pd
+    from tradingtools import storetools
+    step = timeframe_to_ms(timeframe)
+    covered = storetools.coverage(path, symbol, timeframe, step)
+    if len(covered) == 0 and (start is None or end is None):
+        return pd.DataFrame({'start': pd.Series(dtype='datetime64[ms]'), 'end': pd.Series(dtype='datetime64[ms]'),
+                             'candles': pd.Series(dtype=np.int64), 'stored': pd.Series(dtype=bool)})
+    start = to_milliseconds(start) if start is not None else int(covered[0, 0])
+    end = to_milliseconds(end) if end is not None else int(covered[-1, 1])
+    missing = storetools.gaps(covered, start, end, step, storetools.empty_intervals(path, symbol, timeframe))
+    covered = covered[(covered[:, 1] >= start) & (covered[:, 0] <= end)]
+    covered = np.stack([np.maximum(covered[:, 0], start), np.minimum(covered[:, 1], end)], axis=1).reshape(-1, 2)
+    rows = np.r_[covered, missing]
+    order = np.argsort(rows[:, 0], kind='stable')
+    rows, stored = rows[order], np.r_[np.ones(len(covered), dtype=bool), np.zeros(len(missing), dtype=bool)][order]
+    candles = np.where(stored, (rows[:, 1] - rows[:, 0]) // step + 1, (rows[:, 1] - rows[:, 0] + 1) // step)
+    return pd.DataFrame({'start': rows[:, 0].astype('datetime64[ms]'), 'end': rows[:, 1].astype('datetime64[ms]'),
+                         'candles': candles, 'stored': stored})
+
+
 def check_prices(price, limit, stop, side, eps, logger):
     """
 
@@ -105,4 +441,48 @@ def check_quantities(quantity, price, min_qty, min_notional, logger):
     if notional < min_notional or quantity < min_qty:
         logger.error('Insufficent quantity or notional')
         return None
-    return str(quantity)
\ No newline at end of file
+    return str(quantity)
+
+
+def check_prices_array(price, limit, stop, side, eps):
+    """
+    Vectorized check_prices over many orders, with NaN for the missing limit or stop prices
+    :param price: numpy.array of actual prices
+    :param limit: numpy.array of limit prices
+    :param stop: numpy.array of stop prices
+    :param side: numpy.array with 1 for 'BUY' and -1 for 'SELL'
+    :param eps: tolerance
+    :return: tuple of (limit, stop) numpy.array
+    """
+    limit, stop = np.array(limit, dtype=float), np.array(stop, dtype=float)
+    has_limit, has_stop = ~np.isnan(limit), ~np.isnan(stop)
+    buy, sell = side > 0, side < 0
+
+    only_limit = has_limit & ~has_stop
+    close = only_limit & ((1 - eps) * limit <= price) & (price <= (1 + eps) * limit)
+    inconsistent = only_limit & ~close & ((buy & (price < limit)) | (sell & (price > limit)))
+    stop[inconsistent] = limit[inconsistent]
+    limit[close | inconsistent] = np.nan
+
+    only_stop = has_stop & ~has_limit
+    stop[only_stop & ((1 - eps) * stop <= price) & (price <= (1 + eps) * stop)] = np.nan
+
+    both = has_limit & has_stop
+    close = both & ((1 - eps) * limit <= stop) & (stop <= (1 + eps) * limit)
+    inconsistent = both & ~close & ((buy & (stop < limit)) | (sell & (stop > limit)))
+    stop[inconsistent] = limit[inconsistent]
+    limit[close | inconsistent] = np.nan
+    return limit, stop
+
+
+def check_quantities_array(quantity, price, min_qty, min_notional):
+    """
+    Vectorized check_quantities over many orders
+    :param quantity: numpy.array of quantities
+    :param price: numpy.array of order prices
+    :param min_qty: minimum quantity (and quantity step)
+    :param min_notional: minimum notional
+    :return: numpy.array of floored quantities, NaN where the quantity or the notional are insufficient
+    """
+    quantity = np.floor(np.asarray(quantity, dtype=float) * round(1 / min_qty)) / round(1 / min_qty)
+    return np.where((quantity * price < min_notional) | (quantity < min_qty), np.nan, quantity)
\ No newline at end of file
@@ -0,0 +1,502 @@
+"""Technical Indicators Tools"""
+import os
+import abc
+import json
+import logging
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from tradingtools import storetools, resampletools
+
+logger = logging.getLogger('indicatortools')
+
+
+class Indicator(abc.ABC):
+    """
+    Base of the indicators. bulk computes the outputs over whole columns and leaves the state at the last kline, update
+    advances that state by one kline in O(1) giving the same values bulk gives for that kline
+    """
+    outputs = ()
+    columns = ()
+
+    def __init__(self, **params):
+        """
+        :param params: indicator parameters
+        """
+        self.params = params
+        self.state = {}
+
+    @abc.abstractmethod
+    def bulk(self, data):
+        """
+        Compute the outputs over whole columns, replacing the state
+        :param data: dict with float numpy.array columns (and int64 'open_time' in epoch milliseconds)
+        :return: tuple with one numpy.array per output
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update(self, row):
+        """
+        Advance the state by one closed kline
+        :param row: dict with the float values of the kline (and int 'open_time' in epoch milliseconds)
+        :return: tuple with one value per output
+        """
+        raise NotImplementedError
+
+
+def wilder(values, alpha):
+    """
+    Exponential moving average seeded with the first value (pandas ewm with adjust=False)
+    :param values: float numpy.array
+    :param alpha: smoothing factor
+    :return: float numpy.array
+    """
+    return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+
+def smooth(previous, value, alpha):
+    """
+    One step of wilder, with the same floating point operations as pandas
+    :param previous: previous average, None for the first value
+    :param value: new value
+    :param alpha: smoothing factor
+    :return: new average
+    """
+    if previous is None:
+        return value
+    return ((1. - alpha) * previous + alpha * value) / ((1. - alpha) + alpha)
+
+
+class EMA(Indicator):
+    """
+    Exponential moving average
+    """
+    outputs = ('ema',)
+
+    def __init__(self, period=20, column='close'):
+        """
+        :param period: span of the average
+        :param column: kline column averaged
+        """
+        super().__init__(period=period, column=column)
+        self.columns = (column,)
+        self.alpha = 2. / (period + 1)
+
+    def bulk(self, data):
+        ema = wilder(data[self.params['column']], self.alpha)
+        self.state = {'value': float(ema[-1])} if len(ema) else {}
+        return ema,
+
+    def update(self, row):
+        self.state['value'] = smooth(self.state.get('value'), row[self.params['column']], self.alpha)
+        return self.state['value'],
+
+
+class RSI(Indicator):
+    """
+    Relative strength index with Wilder smoothing of the gains and losses
+    """
+    outputs = ('rsi',)
+
+    def __init__(self, period=14, column='close'):
+        """
+        :param period: Wilder smoothing period
+        :param column: kline column used
+        """
+        super().__init__(period=period, column=column)
+        self.columns = (column,)
+        self.alpha = 1. / period
+
+    def bulk(self, data):
+        close = data[self.params['column']]
+        delta = np.diff(close)
+        gain, loss = wilder(np.maximum(delta, 0.), self.alpha), wilder(np.maximum(-delta, 0.), self.alpha)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.r_[np.nan, 100. * gain / (gain + loss)]
+        self.state = {'close': float(close[-1])} if len(close) else {}
+        if len(delta):
+            self.state.update(gain=float(gain[-1]), loss=float(loss[-1]))
+        return rsi[:len(close)],
+
+    def update(self, row):
+        close, previous = row[self.params['column']], self.state.get('close')
+        self.state['close'] = close
+        if previous is None:
+            return np.nan,
+        delta = close - previous
+        gain = self.state['gain'] = smooth(self.state.get('gain'), max(delta, 0.), self.alpha)
+        loss = self.state['loss'] = smooth(self.state.get('loss'), max(-delta, 0.), self.alpha)
+        return (100. * gain / (gain + loss) if gain + loss != 0 else np.nan),
+
+
+class ATR(Indicator):
+    """
+    Average true range with Wilder smoothing
+    """
+    outputs = ('atr',)
+    columns = ('high', 'low', 'close')
+
+    def __init__(self, period=14):
+        """
+        :param period: Wilder smoothing period
+        """
+        super().__init__(period=period)
+        self.alpha = 1. / period
+
+    def bulk(self, data):
+        high, low, close = data['high'], data['low'], data['close']
+        previous = np.r_[np.nan, close[:-1]]
+        true_range = np.fmax(np.fmax(high - low, np.abs(high - previous)), np.abs(low - previous))
+        atr = wilder(true_range, self.alpha)
+        self.state = {'close': float(close[-1]), 'value': float(atr[-1])} if len(close) else {}
+        return atr,
+
+    def update(self, row):
+        high, low, previous = row['high'], row['low'], self.state.get('close')
+        true_range = high - low if previous is None else max(high - low, abs(high - previous), abs(low - previous))
+        self.state['close'] = row['close']
+        self.state['value'] = smooth(self.state.get('value'), true_range, self.alpha)
+        return self.state['value'],
+
+
+class Bollinger(Indicator):
+    """
+    Bollinger bands: rolling mean and k population standard deviations above and below it
+    """
+    outputs = ('mid', 'upper', 'lower')
+
+    def __init__(self, period=20, k=2., column='close'):
+        """
+        :param period: rolling window length
+        :param k: number of standard deviations of the bands
+        :param column: kline column used
+        """
+        super().__init__(period=period, k=k, column=column)
+        self.columns = (column,)
+
+    def bands(self, window):
+        n = window.shape[-1]
+        mid = window.sum(axis=-1) / n
+        std = np.sqrt(((window - mid[..., None]) ** 2).sum(axis=-1) / n)
+        return mid, mid + self.params['k'] * std, mid - self.params['k'] * std
+
+    def bulk(self, data):
+        values, n = data[self.params['column']], self.params['period']
+        bands = [np.full(len(values), np.nan) for _ in self.outputs]
+        if len(values) >= n:
+            for band, computed in zip(bands, self.bands(sliding_window_view(values, n))):
+                band[n - 1:] = computed
+        self.state = {'window': values[-n:].tolist()}
+        return tuple(bands)
+
+    def update(self, row):
+        window = self.state.setdefault('window', [])
+        window.append(row[self.params['column']])
+        if len(window) > self.params['period']:
+            del window[0]
+        if len(window) < self.params['period']:
+            return (np.nan,) * len(self.outputs)
+        return tuple(float(band[0]) for band in self.bands(np.array([window])))
+
+
+class VWAP(Indicator):
+    """
+    Volume weighted average of the typical price ((high + low + close) / 3), restarted at every anchor period
+    """
+    outputs = ('vwap',)
+    columns = ('open_time', 'high', 'low', 'close', 'vol')
+
+    def __init__(self, anchor='1d'):
+        """
+        :param anchor: timeframe string of the periods the average restarts at ('1d', '1w')
+        """
+        super().__init__(anchor=anchor)
+
+    def bulk(self, data):
+        times = data['open_time']
+        price = (data['high'] + data['low'] + data['close']) / 3.
+        pv, vol = price * data['vol'], data['vol']
+        cum_pv, cum_vol = np.empty(len(times)), np.empty(len(times))
+        if len(times):
+            starts, ends = resampletools.buckets(times, self.params['anchor'])
+            first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+            for a, b in zip(first, np.r_[first[1:], len(times)]):
+                cum_pv[a:b], cum_vol[a:b] = np.cumsum(pv[a:b]), np.cumsum(vol[a:b])
+            self.state = {'end': int(ends[-1]), 'pv': float(cum_pv[-1]), 'vol': float(cum_vol[-1])}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cum_pv / cum_vol,
+
+    def update(self, row):
+        pv = (row['high'] + row['low'] + row['close']) / 3. * row['vol']
+        if row['open_time'] >= self.state.get('end', -1):
+            end = resampletools.buckets(np.array([row['open_time']], dtype=np.int64), self.params['anchor'])[1][0]
+            self.state = {'end': int(end), 'pv': pv, 'vol': row['vol']}
+        else:
+            self.state['pv'] += pv
+            self.state['vol'] += row['vol']
+        return (self.state['pv'] / self.state['vol'] if self.state['vol'] != 0 else np.nan),
+
+
+class Volatility(Indicator):
+    """
+    Rolling sample standard deviation of the log returns
+    """
+    outputs = ('volatility',)
+
+    def __init__(self, period=20, column='close'):
+        """
+        :param period: number of returns in the window
+        :param column: kline column used
+        """
+        super().__init__(period=period, column=column)
+        self.columns = (column,)
+
+    @staticmethod
+    def deviation(window):
+        n = window.shape[-1]
+        mean = window.sum(axis=-1) / n
+        return np.sqrt(((window - mean[..., None]) ** 2).sum(axis=-1) / (n - 1))
+
+    def bulk(self, data):
+        values, n = data[self.params['column']], self.params['period']
+        returns = np.log(values[1:] / values[:-1])
+        volatility = np.full(len(values), np.nan)
+        if len(returns) >= n:
+            volatility[n:] = self.deviation(sliding_window_view(returns, n))
+        self.state = {'close': float(values[-1]), 'window': returns[-n:].tolist()} if len(values) else {}
+        return volatility,
+
+    def update(self, row):
+        close, previous = row[self.params['column']], self.state.get('close')
+        self.state['close'] = close
+        if previous is None:
+            return np.nan,
+        window = self.state.setdefault('window', [])
+        window.append(float(np.log(np.array([close / previous]))[0]))
+        if len(window) > self.params['period']:
+            del window[0]
+        if len(window) < self.params['period']:
+            return np.nan,
+        return float(self.deviation(np.array([window]))[0]),
+
+
+INDICATORS = {cls.__name__: cls for cls in (EMA, RSI, ATR, Bollinger, VWAP, Volatility)}
+
+
+def ema(values, period=20):
+    """
+    Exponential moving average over a whole column
+    :param values: array of prices
+    :param period: span of the average
+    :return: float numpy.array
+    """
+    return EMA(period).bulk({'close': np.asarray(values, dtype=float)})[0]
+
+
+def rsi(close, period=14):
+    """
+    Relative strength index over a whole column
+    :param close: array of close prices
+    :param period: Wilder smoothing period
+    :return: float numpy.array (NaN for the first kline)
+    """
+    return RSI(period).bulk({'close': np.asarray(close, dtype=float)})[0]
+
+
+def atr(high, low, close, period=14):
+    """
+    Average true range over whole columns
+    :param high: array of high prices
+    :param low: array of low prices
+    :param close: array of close prices
+    :param period: Wilder smoothing period
+    :return: float numpy.array
+    """
+    return ATR(period).bulk({'high': np.asarray(high, dtype=float), 'low': np.asarray(low, dtype=float),
+                             'close': np.asarray(close, dtype=float)})[0]
+
+
+def bollinger(close, period=20, k=2.):
+    """
+    Bollinger bands over a whole column
+    :param close: array of close prices
+    :param period: rolling window length
+    :param k: number of standard deviations of the bands
+    :return: tuple of (mid, upper, lower) float numpy.array (NaN for the first period - 1 klines)
+    """
+    return Bollinger(period, k).bulk({'close': np.asarray(close, dtype=float)})
+
+
+def vwap(open_time, high, low, close, vol, anchor='1d'):
+    """
+    Anchored volume weighted average price over whole columns
+    :param open_time: array of open times (datetime64 or epoch milliseconds)
+    :param high: array of high prices
+    :param low: array of low prices
+    :param close: array of close prices
+    :param vol: array of volumes
+    :param anchor: timeframe string of the periods the average restarts at ('1d', '1w')
+    :return: float numpy.array
+    """
+    return VWAP(anchor).bulk({'open_time': np.asarray(open_time).astype('datetime64[ms]').astype(np.int64),
+                              'high': np.asarray(high, dtype=float), 'low': np.asarray(low, dtype=float),
+                              'close': np.asarray(close, dtype=float), 'vol': np.asarray(vol, dtype=float)})[0]
+
+
+def volatility(close, period=20):
+    """
+    Rolling volatility of the log returns over a whole column
+    :param close: array of close prices
+    :param period: number of returns in the window
+    :return: float numpy.array (NaN for the first period klines)
+    """
+    return Volatility(period).bulk({'close': np.asarray(close, dtype=float)})[0]
+
+
+class IndicatorSet:
+    """
+    Named indicators computed together over the klines of a dataset, computed in bulk once and then updated with the
+    new closed klines only
+    """
+
+    def __init__(self, indicators):
+        """
+        :param indicators: dict of name -> Indicator ({'ema50': EMA(50), 'rsi': RSI(14)})
+        """
+        self.indicators = dict(indicators)
+        self.last = None
+
+    def names(self):
+        """
+        Get the output column names
+        :return: list of strings (name, or name_output for indicators with many outputs)
+        """
+        return [name if len(ind.outputs) == 1 else f'{name}_{output}' for name, ind in self.indicators.items() for output in ind.outputs]
+
+    def _columns(self, df):
+        needed = {column for ind in self.indicators.values() for column in ind.columns} - {'open_time'}
+        data = {column: df[column].to_numpy(dtype=float) for column in needed}
+        data['open_time'] = df['open_time'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+        return data
+
+    def compute(self, df):
+        """
+        Compute every indicator over some klines, replacing the state
+        :param df: pandas.DataFrame with the closed klines sorted by open_time
+        :return: pandas.DataFrame with open_time and one column per output
+        """
+        data = self._columns(df)
+        columns = [values for ind in self.indicators.values() for values in ind.bulk(data)]
+        self.last = int(data['open_time'][-1]) if len(df) else self.last
+        return pd.DataFrame(dict(zip(['open_time'] + self.names(), [df['open_time'].to_numpy()] + columns)))
+
+    def update(self, df):
+        """
+        Update every indicator with the klines newer than the last one seen, in O(1) per kline
+        :param df: pandas.DataFrame with closed klines sorted by open_time (older klines are skipped)
+        :return: pandas.DataFrame with open_time and one column per output for the new klines
+        """
+        data = self._columns(df)
+        new = data['open_time'] > self.last if self.last is not None else np.ones(len(df), dtype=bool)
+        data = {column: values[new].tolist() for column, values in data.items()}
+        rows = []
+        for i, open_time in enumerate(data['open_time']):
+            row = {column: values[i] for column, values in data.items()}
+            rows.append([value for ind in self.indicators.values() for value in ind.update(row)])
+            self.last = open_time
+        values = np.array(rows, dtype=float).reshape(-1, len(self.names()))
+        return pd.DataFrame(dict(zip(['open_time'] + self.names(), [df['open_time'].to_numpy()[new]] + list(values.T))))
+
+    def to_dict(self):
+        """
+        Get the definition and state of the indicators
+        :return: JSON serializable dict
+        """
+        return {'last': self.last, 'indicators': {name: {'type': type(ind).__name__, 'params': ind.params, 'state': ind.state}
+                                                  for name, ind in self.indicators.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild indicators saved with to_dict
+        :param data: dict
+        :return: IndicatorSet
+        """
+        indicators = {}
+        for name, spec in data['indicators'].items():
+            indicators[name] = INDICATORS[spec['type']](**spec['params'])
+            indicators[name].state = spec['state']
+        result = cls(indicators)
+        result.last = data['last']
+        return result
+
+
+def state_path(path, symbol, timeframe, name='indicators'):
+    """
+    Get the path of the indicators state saved next to a dataset
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param name: name of the indicator set
+    :return: file path string
+    """
+    return os.path.join(storetools.dataset_path(path, symbol, timeframe), f'_{name}.json')
+
+
+def save_state(indicators, path, symbol, timeframe, name='indicators'):
+    """
+    Save the state of an indicator set next to a dataset
+    :param indicators: IndicatorSet
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param name: name of the indicator set
+    :return: file path string
+    """
+    file = state_path(path, symbol, timeframe, name)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file + '.tmp', 'w') as f:
+        json.dump(indicators.to_dict(), f)
+    os.replace(file + '.tmp', file)
+    return file
+
+
+def load_state(path, symbol, timeframe, name='indicators'):
+    """
+    Load the state of an indicator set saved next to a dataset
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param name: name of the indicator set
+    :return: IndicatorSet, or None if there is no state saved
+    """
+    file = state_path(path, symbol, timeframe, name)
+    if not os.path.isfile(file):
+        return None
+    with open(file) as f:
+        return IndicatorSet.from_dict(json.load(f))
+
+
+def update_indicators(path, symbol, timeframe, indicators=None, name='indicators'):
+    """
+    Bring an indicator set up to date with the stored klines and save its state. Only the klines after the saved state
+    are read and processed, so it can be run after every update
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param indicators: IndicatorSet used when there is no state saved yet
+    :param name: name of the indicator set
+    :return: tuple of (IndicatorSet, pandas.DataFrame with the outputs of the klines processed)
+    """
+    saved = load_state(path, symbol, timeframe, name)
+    if saved is None:
+        if indicators is None:
+            raise ValueError(f'No indicators state saved at {state_path(path, symbol, timeframe, name)}')
+        df = indicators.compute(storetools.read_klines(path, symbol, timeframe))
+    else:
+        indicators = saved
+        df = indicators.update(storetools.read_klines(path, symbol, timeframe, indicators.last + 1))
+    save_state(indicators, path, symbol, timeframe, name)
+    logger.debug(f'{len(df)} klines of {symbol} {timeframe} processed by {len(indicators.indicators)} indicators')
+    return indicators, df
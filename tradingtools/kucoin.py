@@ -1,60 +1,195 @@
 """Kucoin Tools"""
 
+import time
 import logging
-import dateparser
-import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tradingtools import commontools
 
 logger = logging.getLogger('kucointools')
 
+BASE_TIMEFRAME = '1min'
+SPOT_KLINES_FIELDS = ['open_time', 'open', 'close', 'high', 'low', 'vol', 'quote_vol']
+FUTURES_KLINES_FIELDS = ['open_time', 'open', 'high', 'low', 'close', 'vol']
+KLINES_LIMIT = {'SPOT': 1500, 'FUTURES': 200}
+KLINES_WEIGHT = {'SPOT': 3, 'FUTURES': 3}
+KLINES_ENDPOINT = {'SPOT': 'get_kline_data', 'FUTURES': 'get_kline_data'}
+WEIGHT_LIMIT = {'SPOT': 2000, 'FUTURES': 2000}
+WEIGHT_PERIOD = 30
+BUDGET = 0.8
 
-def get_klines(client, market, symbol, timeframe, start, end):
+# public request pools of each market, shared by every call of this module so concurrent downloads stay under the limit
+limiters = {market: commontools.RateLimiter(limit * BUDGET, WEIGHT_PERIOD) for market, limit in WEIGHT_LIMIT.items()}
+
+
+def set_budget(budget):
+    """
+    Change the fraction of the public pool limits used by the shared limiters
+    :param budget: fraction of the exchange weight limit per period to use (0.8)
+    :return: None
+    """
+    for market, limiter in limiters.items():
+        limiter.weight = WEIGHT_LIMIT[market] * budget
+
+
+def get_klines_window(client, market, symbol, timeframe, start, end, float32=False):
     """
-    Get the candles of a symbol in a specified time-frame between two timestamps
+    Get a single page of candles (up to KLINES_LIMIT) between two timestamps
     :param client: client class
     :param market: 'SPOT' or 'FUTURES'
     :param symbol: symbol string ('KCS-XBT')
     :param timeframe: klines timeframe string ('5min')
-    :param start: human-readable datetime for data start ('5 days ago')
-    :param end: human-readable datetime for data end ('now')
+    :param start: epoch milliseconds for data start
+    :param end: epoch milliseconds for data end
+    :param float32: store prices and volumes as float32
     :return: pandas.DataFrame with the data
     """
-    start = int(dateparser.parse(start + ' UTC').timestamp()) if start is not None else None
-    end = int(dateparser.parse(end + ' UTC').timestamp()) if end is not None else None
-
-    if market == 'SPOT':
-        klines = client.get_kline_data(symbol, kline_type=timeframe, start=start, end=end)
-        df = pd.DataFrame(klines, columns=['open_time', 'open', 'close', 'high', 'low', 'trades', 'vol']).astype(float)
-        df['open_time'] = pd.to_datetime(df['open_time'] * 1e9).astype("datetime64[us]")
+    step = commontools.timeframe_to_ms(timeframe)
+    if market.upper() == 'SPOT':
+        klines = client.get_kline_data(symbol, kline_type=timeframe, start=start // 1000, end=end // 1000)
+        df = commontools.decode_klines(klines, SPOT_KLINES_FIELDS, step, 1000, float32)
     else:
-        klines = market.get_kline_data(symbol, granularity=timeframe, begin_t=start * 1000, end_t=end * 1000)
-        df = pd.DataFrame(klines, columns=['open_time', 'open', 'high', 'low', 'close', 'vol']).astype(float)
-        df['open_time'] = pd.to_datetime(df['open_time'] * 1e6).astype("datetime64[us]")
-    return df
+        klines = client.get_kline_data(symbol, granularity=step // 60000, begin_t=start, end_t=end)
+        df = commontools.decode_klines(klines, FUTURES_KLINES_FIELDS, step, 1, float32)
+    times = df['open_time'].to_numpy().view(np.int64) // 1000
+    return df[(times >= start) & (times <= end)]
+
+
+def get_klines(client, market, symbol, timeframe, start, end, float32=False, workers=4):
+    """
+    Get the candles of a symbol in a specified time-frame between two timestamps, split into KLINES_LIMIT windows
+    fetched concurrently under the market rate limit
+    :param client: client class
+    :param market: 'SPOT' or 'FUTURES'
+    :param symbol: symbol string ('KCS-XBT')
+    :param timeframe: klines timeframe string ('5min')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param float32: store prices and volumes as float32
+    :param workers: number of concurrent requests
+    :return: pandas.DataFrame with the data
+    """
+    import pandas as pd
+    market, step = market.upper(), commontools.timeframe_to_ms(timeframe)
+    size = KLINES_LIMIT[market] * step
+    end = commontools.to_milliseconds(end) if end is not None else int(time.time() * 1000)
+    start = commontools.to_milliseconds(start) if start is not None else end - size + 1
+    windows = [(w, min(w + size, end + 1) - 1) for w in range(start - start % step, end + 1, size)]
+
+    def fetch(window):
+        limiters[market].acquire(KLINES_WEIGHT[market])
+        return get_klines_window(client, market, symbol, timeframe, window[0], window[1], float32)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as executor:
+        frames = list(executor.map(fetch, windows))
+    logger.debug(f'{len(windows)} windows of {symbol} {timeframe} at {market} fetched')
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    return pd.concat(frames).drop_duplicates('open_time', keep='last').sort_values('open_time', ignore_index=True)
+
+
+def bulk_download(client, jobs, path, workers=8, budget=None, retries=3, compression='zstd', progress=None, repair=False):
+    """
+    Download many symbols and timeframes concurrently into the partitioned store without exceeding the rate limits
+    :param client: client class of the market of the jobs (spot or futures)
+    :param jobs: list of (market, symbol, timeframe, start, end) tuples (('SPOT', 'KCS-XBT', '1min', '1 year ago', 'now'))
+    :param path: store root path string
+    :param workers: number of concurrent requests
+    :param budget: fraction of the exchange weight limit per period to use, applied to the shared limiters (see set_budget).
+    The actual one if None
+    :param retries: attempts for each window before giving it up
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param progress: function called with the job report every time one of its windows finishes
+    :param repair: fetch every interval missing from the ranges, not only before and after the stored data
+    :return: list with one report dict per job
+    """
+    if budget is not None:
+        set_budget(budget)
+    return commontools.bulk_download(client, jobs, path, logger, get_klines_window, KLINES_LIMIT, KLINES_WEIGHT, limiters,
+                                     KLINES_ENDPOINT, workers, retries, compression, progress, repair)
 
 
-def download_data(client, market, symbol, timeframe, start, end, path):
+def download_data(client, market, symbol, timeframe, start, end, path, compression='zstd', repair=False):
     """
-    Download the desired klines to a parquet file
+    Download the desired klines into the partitioned store
     :param client: client class
     :param market: 'SPOT' or 'FUTURES'
     :param symbol: symbol string ('KCS-XBT')
     :param timeframe: klines timeframe string ('5min')
-    :param start: human-readable datetime for data start ('5 days ago')
-    :param end: human-readable datetime for data end ('now')
-    :param path: save path string
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '5 days ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param path: store root path string
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param repair: fetch every interval missing from the range, not only before and after the stored data
     :return: None
     """
-    return commontools.download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines)
+    return commontools.download_data(client, market, symbol, timeframe, start, end, path, logger, get_klines, compression, repair)
 
 
-def get_data(symbol, timeframe, path):
+def get_coverage(symbol, timeframe, path, start=None, end=None):
     """
-    Read a parquet file
+    Get the intervals stored and missing for a dataset without loading it
     :param symbol: symbol string ('KCS-XBT')
     :param timeframe: klines timeframe string ('5min')
-    :param path: save path string
-    :return: pandas.DataFrame with the data
-    :return: pandas.DataFrame with the data
+    :param path: store root path string
+    :param start: datetime for range start ('5 days ago'). The first stored open time if None
+    :param end: datetime for range end ('now'). The last stored open time if None
+    :return: pandas.DataFrame with start, end, candles and stored (False for gaps) columns
+    """
+    return commontools.get_coverage(path, symbol, timeframe, start, end)
+
+
+def get_data(symbol, timeframe, path, start=None, end=None, columns=None, mmap=False):
+    """
+    Read a dataset from the partitioned store
+    :param symbol: symbol string ('KCS-XBT')
+    :param timeframe: klines timeframe string ('5min')
+    :param path: store root path string
+    :param start: datetime for data start ('5 days ago'). Only the partitions and row groups after it are read
+    :param end: datetime for data end ('now'). Only the partitions and row groups before it are read
+    :param columns: list of columns to read (['open_time', 'close'])
+    :param mmap: read from a memory-mapped Arrow copy of the dataset
+    :return: pandas.DataFrame with the data (resampled from BASE_TIMEFRAME klines if the timeframe is not stored, and
+    with the buckets newer than the stored ones resampled from them if it was stored with resample_data)
+    """
+    from tradingtools import storetools, resampletools
+    start = commontools.to_milliseconds(start) if start is not None else None
+    end = commontools.to_milliseconds(end) if end is not None else None
+    if timeframe != BASE_TIMEFRAME and storetools.exists(path, symbol, BASE_TIMEFRAME):
+        if not storetools.exists(path, symbol, timeframe):
+            return resampletools.read_resampled(path, symbol, BASE_TIMEFRAME, timeframe, start, end, columns)
+        return resampletools.read_refreshed(path, symbol, BASE_TIMEFRAME, timeframe, start, end, columns, mmap)
+    return storetools.read_klines(path, symbol, timeframe, start, end, columns, mmap)
+
+
+def get_panel(symbols, timeframe, path, start=None, end=None, fields=('open', 'high', 'low', 'close', 'vol'), workers=8, mmap=False,
+              out=None):
+    """
+    Read many symbols from the partitioned store aligned on a shared time index
+    :param symbols: list of symbol strings (['KCS-XBT', 'BTC-USDT'])
+    :param timeframe: klines timeframe string ('1hour')
+    :param path: store root path string
+    :param start: datetime for data start ('5 days ago')
+    :param end: datetime for data end ('now')
+    :param fields: list of columns loaded for each symbol
+    :param workers: number of datasets read concurrently
+    :param mmap: read the datasets from their memory-mapped Arrow copies
+    :param out: folder where the panel is written as memory-mapped .npy files. In memory if None
+    :return: paneltools.Panel with (time, symbol, field) values and a (time, symbol) mask (resampled from BASE_TIMEFRAME
+    klines for the symbols without a stored timeframe)
+    """
+    from tradingtools import paneltools
+    return paneltools.load_panel(path, symbols, timeframe, start, end, fields, BASE_TIMEFRAME, workers, mmap, out)
+
+
+def resample_data(symbol, timeframe, path, compression='zstd'):
+    """
+    Store a higher timeframe derived from the stored BASE_TIMEFRAME klines, recomputing only from the last stored bucket
+    :param symbol: symbol string ('KCS-XBT')
+    :param timeframe: klines timeframe string ('4hour')
+    :param path: store root path string
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :return: number of partitions written
     """
-    return pd.read_parquet(f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip')
+    from tradingtools import resampletools
+    return resampletools.update_resampled(path, symbol, BASE_TIMEFRAME, timeframe, compression)
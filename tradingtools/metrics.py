@@ -0,0 +1,219 @@
+"""Exchange Calls Instrumentation"""
+import time
+import bisect
+import logging
+import inspect
+import threading
+
+logger = logging.getLogger('metricstools')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WEIGHT_HEADERS = ('x-mbx-used-weight', 'x-mbx-order-count')
+
+
+class MemorySink:
+    """
+    Keep call counts, error and retry counts, latency histograms and the last used-weight headers in memory
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self.calls = {}
+        self.errors = {}
+        self.retries = {}
+        self.latency = {}
+        self.latency_sum = {}
+        self.weights = {}
+        self._lock = threading.Lock()
+
+    def observe(self, exchange, endpoint, latency, error=None):
+        """
+        Record one call
+        :param exchange: exchange name string
+        :param endpoint: client method name string
+        :param latency: call duration in seconds
+        :param error: exception class name if the call failed
+        :return: None
+        """
+        key = (exchange, endpoint)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if key not in self.latency:
+                self.latency[key] = [0] * (len(self.buckets) + 1)
+                self.latency_sum[key] = 0.0
+            self.latency[key][bisect.bisect_left(self.buckets, latency)] += 1
+            self.latency_sum[key] += latency
+            if error is not None:
+                self.errors[key + (error,)] = self.errors.get(key + (error,), 0) + 1
+
+    def retry(self, exchange, endpoint):
+        """
+        Record one retry of a call
+        :param exchange: exchange name string
+        :param endpoint: client method name string
+        :return: None
+        """
+        with self._lock:
+            self.retries[(exchange, endpoint)] = self.retries.get((exchange, endpoint), 0) + 1
+
+    def weight(self, exchange, header, value):
+        """
+        Record the last value of a used-weight header
+        :param exchange: exchange name string
+        :param header: lowercase header name ('x-mbx-used-weight-1m')
+        :param value: header value
+        :return: None
+        """
+        self.weights[(exchange, header)] = value
+
+    def snapshot(self):
+        """
+        Get a copy of every metric
+        :return: dict of metrics
+        """
+        with self._lock:
+            return {'calls': dict(self.calls), 'errors': dict(self.errors), 'retries': dict(self.retries),
+                    'latency': {k: list(v) for k, v in self.latency.items()}, 'latency_sum': dict(self.latency_sum),
+                    'weights': dict(self.weights), 'buckets': self.buckets}
+
+
+class LogSink:
+    """
+    Log every call through a logger
+    """
+
+    def __init__(self, log=logger, level=logging.DEBUG):
+        """
+        :param log: logger used
+        :param level: logging level of the records
+        """
+        self.log = log
+        self.level = level
+
+    def observe(self, exchange, endpoint, latency, error=None):
+        self.log.log(self.level, f'{exchange} {endpoint} {latency * 1000:.1f} ms' + (f' failed: {error}' if error else ''))
+
+    def retry(self, exchange, endpoint):
+        self.log.log(self.level, f'{exchange} {endpoint} retried')
+
+    def weight(self, exchange, header, value):
+        self.log.log(self.level, f'{exchange} {header}: {value}')
+
+
+class PrometheusSink(MemorySink):
+    """
+    MemorySink that renders its metrics in the Prometheus text exposition format
+    """
+
+    def render(self, prefix='tradingtools'):
+        """
+        Render the metrics
+        :param prefix: metric names prefix
+        :return: Prometheus text format string
+        """
+        data = self.snapshot()
+        lines = [f'# TYPE {prefix}_requests_total counter']
+        lines += [f'{prefix}_requests_total{{exchange="{e}",endpoint="{p}"}} {v}' for (e, p), v in sorted(data['calls'].items())]
+        lines += [f'# TYPE {prefix}_request_errors_total counter']
+        lines += [f'{prefix}_request_errors_total{{exchange="{e}",endpoint="{p}",error="{x}"}} {v}' for (e, p, x), v in sorted(data['errors'].items())]
+        lines += [f'# TYPE {prefix}_request_retries_total counter']
+        lines += [f'{prefix}_request_retries_total{{exchange="{e}",endpoint="{p}"}} {v}' for (e, p), v in sorted(data['retries'].items())]
+        lines += [f'# TYPE {prefix}_request_latency_seconds histogram']
+        for (e, p), counts in sorted(data['latency'].items()):
+            total = 0
+            for le, count in zip(data['buckets'] + ('+Inf',), counts):
+                total += count
+                lines.append(f'{prefix}_request_latency_seconds_bucket{{exchange="{e}",endpoint="{p}",le="{le}"}} {total}')
+            lines.append(f'{prefix}_request_latency_seconds_sum{{exchange="{e}",endpoint="{p}"}} {data["latency_sum"][(e, p)]}')
+            lines.append(f'{prefix}_request_latency_seconds_count{{exchange="{e}",endpoint="{p}"}} {total}')
+        lines += [f'# TYPE {prefix}_used_weight gauge']
+        lines += [f'{prefix}_used_weight{{exchange="{e}",header="{h}"}} {v}' for (e, h), v in sorted(data['weights'].items())]
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedClient:
+    """
+    Proxy of an exchange client that reports every method call to one or more sinks
+    """
+
+    def __init__(self, client, sinks, exchange='binance'):
+        """
+        :param client: python-binance Client / AsyncClient or kucoin-python client
+        :param sinks: sink or list of sinks (MemorySink, LogSink, PrometheusSink)
+        :param exchange: exchange name string used as label
+        """
+        object.__setattr__(self, 'client', client)
+        object.__setattr__(self, 'sinks', sinks if isinstance(sinks, (list, tuple)) else [sinks])
+        object.__setattr__(self, 'exchange', exchange)
+        object.__setattr__(self, '_wrapped', {})
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+        if name not in self._wrapped:
+            self._wrapped[name] = self._wrap(name, attribute)
+        return self._wrapped[name]
+
+    def __setattr__(self, name, value):
+        setattr(self.client, name, value)
+
+    def _record(self, name, start, error):
+        latency = time.perf_counter() - start
+        for sink in self.sinks:
+            sink.observe(self.exchange, name, latency, error)
+        headers = getattr(getattr(self.client, 'response', None), 'headers', None)
+        if headers:
+            for header, value in headers.items():
+                if header.lower().startswith(WEIGHT_HEADERS):
+                    for sink in self.sinks:
+                        sink.weight(self.exchange, header.lower(), float(value))
+
+    def _wrap(self, name, function):
+        if inspect.iscoroutinefunction(function):
+            async def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    return await function(*args, **kwargs)
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    self._record(name, start, error)
+        else:
+            def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    return function(*args, **kwargs)
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    self._record(name, start, error)
+        return wrapper
+
+
+def instrument(client, sinks=None, exchange='binance'):
+    """
+    Wrap a client so every call is measured
+    :param client: python-binance Client / AsyncClient or kucoin-python client
+    :param sinks: sink or list of sinks. A new MemorySink if None
+    :param exchange: exchange name string used as label
+    :return: InstrumentedClient
+    """
+    return InstrumentedClient(client, sinks if sinks is not None else MemorySink(), exchange)
+
+
+def record_retry(client, endpoint):
+    """
+    Report a retry of a call if the client is instrumented
+    :param client: client class
+    :param endpoint: client method name string
+    :return: None
+    """
+    if isinstance(client, InstrumentedClient):
+        for sink in client.sinks:
+            sink.retry(client.exchange, endpoint)
@@ -0,0 +1,165 @@
+"""Multi-Symbol Panel Tools"""
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from tradingtools import commontools, storetools, resampletools
+
+logger = logging.getLogger('paneltools')
+
+FIELDS = ['open', 'high', 'low', 'close', 'vol']
+
+
+class Panel:
+    """
+    Klines of many symbols aligned on a shared time index: values is a (time, symbol, field) array and mask is True where
+    a symbol has a kline
+    """
+
+    def __init__(self, times, symbols, fields, values, mask):
+        """
+        :param times: datetime64[ms] numpy.array with the open times
+        :param symbols: list of symbol strings
+        :param fields: list of field names
+        :param values: numpy.array of shape (time, symbol, field), NaN where missing
+        :param mask: bool numpy.array of shape (time, symbol)
+        """
+        self.times = times
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.values = values
+        self.mask = mask
+
+    def field(self, name):
+        """
+        Get a field of every symbol
+        :param name: field name ('close')
+        :return: numpy.array view of shape (time, symbol)
+        """
+        return self.values[:, :, self.fields.index(name)]
+
+    def to_frame(self, name):
+        """
+        Get a field of every symbol as a DataFrame
+        :param name: field name ('close')
+        :return: pandas.DataFrame indexed by open time with one column per symbol
+        """
+        return pd.DataFrame(self.field(name), index=pd.DatetimeIndex(self.times, name='open_time'), columns=self.symbols)
+
+
+def time_index(first, last, timeframe):
+    """
+    Build the open times of every bucket of a timeframe between two dates
+    :param first: first epoch milliseconds
+    :param last: last epoch milliseconds
+    :param timeframe: klines timeframe string ('1h')
+    :return: int64 numpy.array with epoch milliseconds
+    """
+    starts, ends = resampletools.buckets(np.array([first, last], dtype=np.int64), timeframe)
+    unit = timeframe.lstrip('0123456789')
+    if unit in ('M', 'mon'):
+        months = starts[0].astype('datetime64[ms]').astype('datetime64[M]'), ends[1].astype('datetime64[ms]').astype('datetime64[M]')
+        return np.arange(*months, int(timeframe[:-len(unit)])).astype('datetime64[ms]').astype(np.int64)
+    return np.arange(starts[0], starts[1] + 1, commontools.timeframe_to_ms(timeframe), dtype=np.int64)
+
+
+def allocate(shape, dtype, fill, out=None, name=None):
+    """
+    Create a filled array, in memory or as a memory-mapped {out}/{name}.npy file
+    :param shape: array shape tuple
+    :param dtype: numpy dtype
+    :param fill: initial value
+    :param out: folder of the file. In memory if None
+    :param name: file name without extension
+    :return: numpy.array or numpy.memmap
+    """
+    if out is None:
+        return np.full(shape, fill, dtype=dtype)
+    array = np.lib.format.open_memmap(os.path.join(out, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+    array[:] = fill
+    return array
+
+
+def load_panel(path, symbols, timeframe, start=None, end=None, fields=FIELDS, source=None, workers=8, mmap=False, out=None,
+               dtype=np.float64):
+    """
+    Read many symbols from the store in parallel and align them on a shared time index
+    :param path: store root path string
+    :param symbols: list of symbol strings (['BTCUSDT', 'ETHUSDT'])
+    :param timeframe: klines timeframe string ('1h')
+    :param start: first open time (epoch milliseconds, datetime or human-readable string). The first stored one if None
+    :param end: last open time (epoch milliseconds, datetime or human-readable string). The last stored one if None
+    :param fields: list of columns loaded for each symbol
+    :param source: stored timeframe resampled on the fly for the symbols without a stored timeframe dataset ('1m')
+    :param workers: number of datasets read concurrently
+    :param mmap: read the datasets from their memory-mapped Arrow copies
+    :param out: folder where the panel arrays are written as memory-mapped .npy files (see open_panel). In memory if None
+    :param dtype: numpy dtype of the values
+    :return: Panel
+    """
+    start = commontools.to_milliseconds(start) if start is not None else None
+    end = commontools.to_milliseconds(end) if end is not None else None
+    start, end = storetools.to_timestamp(start), storetools.to_timestamp(end)
+    stored = [timeframe if storetools.exists(path, s, timeframe) or source is None else source for s in symbols]
+    ranges = [storetools.time_range(path, s, tf) for s, tf in zip(symbols, stored) if storetools.exists(path, s, tf)]
+    if not ranges:
+        raise ValueError(f'No data stored for any of the {len(symbols)} symbols at {timeframe}')
+    first = start if start is not None else min(r[0] for r in ranges)
+    last = end if end is not None else max(r[1] for r in ranges)
+    times = time_index(first.value // 10 ** 6, last.value // 10 ** 6, timeframe)
+
+    if out is not None:
+        os.makedirs(out, exist_ok=True)
+    values = allocate((len(times), len(symbols), len(fields)), dtype, np.nan, out, 'values')
+    mask = allocate((len(times), len(symbols)), bool, False, out, 'mask')
+
+    def load(j):
+        symbol, tf = symbols[j], stored[j]
+        if not storetools.exists(path, symbol, tf):
+            return 0
+        columns = ['open_time'] + list(fields)
+        if tf != timeframe:
+            df = resampletools.read_resampled(path, symbol, tf, timeframe, start, end, columns)
+            data = {name: df[name].to_numpy() for name in columns}
+        elif mmap:
+            df = storetools.read_klines(path, symbol, tf, start, end, columns, mmap)
+            data = {name: df[name].to_numpy() for name in columns}
+        else:
+            table = storetools.read_table(path, symbol, tf, start, end, columns)
+            data = {name: table.column(name).to_numpy() for name in columns}
+        t = data['open_time'].astype('datetime64[ms]').astype(np.int64)
+        rows = np.searchsorted(times, t)
+        aligned = rows < len(times)
+        aligned[aligned] = times[rows[aligned]] == t[aligned]
+        rows = rows[aligned]
+        values[rows, j, :] = np.column_stack([data[field].astype(dtype, copy=False) for field in fields])[aligned]
+        mask[rows, j] = True
+        return len(rows)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded = sum(executor.map(load, range(len(symbols))))
+    logger.debug(f'Panel of {len(times)} x {len(symbols)} x {len(fields)} built with {loaded} klines')
+
+    times = times.astype('datetime64[ms]')
+    if out is not None:
+        np.save(os.path.join(out, 'times.npy'), times)
+        with open(os.path.join(out, 'panel.json'), 'w') as f:
+            json.dump({'timeframe': timeframe, 'symbols': list(symbols), 'fields': list(fields)}, f)
+        values.flush()
+        mask.flush()
+    return Panel(times, symbols, fields, values, mask)
+
+
+def open_panel(out, mode='r'):
+    """
+    Open a panel written by load_panel as memory-mapped arrays
+    :param out: folder of the panel
+    :param mode: numpy.memmap mode ('r' read-only, 'r+' read and write, 'c' copy on write)
+    :return: Panel
+    """
+    with open(os.path.join(out, 'panel.json')) as f:
+        meta = json.load(f)
+    return Panel(np.load(os.path.join(out, 'times.npy')), meta['symbols'], meta['fields'],
+                 np.load(os.path.join(out, 'values.npy'), mmap_mode=mode), np.load(os.path.join(out, 'mask.npy'), mmap_mode=mode))
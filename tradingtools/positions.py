@@ -0,0 +1,176 @@
+"""Positions Tracking Tools"""
+import time
+import logging
+import threading
+import pandas as pd
+
+logger = logging.getLogger('positiontools')
+
+
+class PositionTracker:
+    """
+    Local state of the positions (futures) or balances (spot) of a market, loaded once from a snapshot and kept up to
+    date with the user data stream events
+    """
+
+    def __init__(self, market, reconcile_interval=300):
+        """
+        :param market: 'SPOT', 'USDM' or 'COINM'
+        :param reconcile_interval: seconds after which maybe_reconcile reloads the snapshot
+        """
+        self.market = market.upper()
+        self.reconcile_interval = reconcile_interval
+        self.positions = {}
+        self.balances = {}
+        self.updated = None
+        self.reconciled = None
+        self._absolute = {}
+        self._lock = threading.Lock()
+
+    def _snapshot(self, client):
+        if self.market == 'COINM':
+            data, balances = client.futures_coin_position_information(), client.futures_coin_account_balance()
+        elif self.market == 'USDM':
+            data, balances = client.futures_position_information(), client.futures_account_balance()
+        else:
+            return {}, {b['asset']: {'asset': b['asset'], 'free': float(b['free']), 'locked': float(b['locked'])}
+                        for b in client.get_account()['balances'] if float(b['free']) + float(b['locked']) != 0}
+        positions = {}
+        for p in data:
+            if float(p['positionAmt']) != 0:
+                positions.setdefault(p['symbol'], {})[p.get('positionSide', 'BOTH')] = dict(p, positionAmt=float(p['positionAmt']))
+        return positions, {b['asset']: {'asset': b['asset'], 'walletBalance': float(b['balance']),
+                                        'crossWalletBalance': float(b.get('crossWalletBalance', b['balance']))}
+                           for b in balances if float(b['balance']) != 0}
+
+    def load(self, client):
+        """
+        Replace the local state with a snapshot from the exchange
+        :param client: client class
+        :return: self
+        """
+        positions, balances = self._snapshot(client)
+        with self._lock:
+            self.positions, self.balances, self._absolute = positions, balances, {}
+            self.updated = self.reconciled = time.time()
+        logger.debug(f'{self.market} snapshot loaded: {len(positions)} symbols with positions, {len(balances)} balances')
+        return self
+
+    def reconcile(self, client):
+        """
+        Reload the snapshot and report how many symbols or assets differed from the local state
+        :param client: client class
+        :return: number of differences found
+        """
+        positions, balances = self._snapshot(client)
+        with self._lock:
+            local = {(s, side): p['positionAmt'] for s, sides in self.positions.items() for side, p in sides.items()}
+            remote = {(s, side): p['positionAmt'] for s, sides in positions.items() for side, p in sides.items()}
+            differences = sum(local.get(k) != remote.get(k) for k in local.keys() | remote.keys())
+            local = {a: tuple(v for k, v in b.items() if k != 'asset') for a, b in self.balances.items()}
+            remote = {a: tuple(v for k, v in b.items() if k != 'asset') for a, b in balances.items()}
+            differences += sum(local.get(k) != remote.get(k) for k in local.keys() | remote.keys())
+            self.positions, self.balances, self._absolute = positions, balances, {}
+            self.updated = self.reconciled = time.time()
+        if differences:
+            logger.warning(f'{differences} differences found reconciling {self.market}')
+        return differences
+
+    def maybe_reconcile(self, client):
+        """
+        Load or reconcile the snapshot if it was never loaded or it is older than reconcile_interval
+        :param client: client class
+        :return: number of differences found (0 if nothing was done)
+        """
+        if self.reconciled is None:
+            self.load(client)
+        elif time.time() - self.reconciled > self.reconcile_interval:
+            return self.reconcile(client)
+        return 0
+
+    def apply(self, event):
+        """
+        Apply a user data stream event: futures ACCOUNT_UPDATE (positions and balances), spot outboundAccountPosition
+        (absolute balances) and balanceUpdate (deltas, skipped when an absolute balance at least as recent was applied)
+        :param event: event dict, plain or wrapped in a combined stream message
+        :return: None
+        """
+        event = event.get('data', event)
+        kind = event.get('e')
+        with self._lock:
+            if kind == 'ACCOUNT_UPDATE':
+                for p in event['a'].get('P', []):
+                    amount, side = float(p['pa']), p.get('ps', 'BOTH')
+                    if amount == 0:
+                        sides = self.positions.get(p['s'], {})
+                        sides.pop(side, None)
+                        if not sides:
+                            self.positions.pop(p['s'], None)
+                    else:
+                        position = self.positions.setdefault(p['s'], {}).setdefault(side, {'symbol': p['s'], 'positionSide': side})
+                        position.update(positionAmt=amount, entryPrice=p.get('ep'), unRealizedProfit=p.get('up'))
+                for b in event['a'].get('B', []):
+                    if float(b['wb']) == 0:
+                        self.balances.pop(b['a'], None)
+                    else:
+                        self.balances[b['a']] = {'asset': b['a'], 'walletBalance': float(b['wb']), 'crossWalletBalance': float(b['cw'])}
+            elif kind == 'outboundAccountPosition':
+                for b in event['B']:
+                    free, locked = float(b['f']), float(b['l'])
+                    self._absolute[b['a']] = event.get('u', event.get('E', 0))
+                    if free + locked == 0:
+                        self.balances.pop(b['a'], None)
+                    else:
+                        self.balances[b['a']] = {'asset': b['a'], 'free': free, 'locked': locked}
+            elif kind == 'balanceUpdate':
+                if event.get('T', event.get('E', 0)) <= self._absolute.get(event['a'], -1):
+                    return
+                balance = self.balances.setdefault(event['a'], {'asset': event['a'], 'free': 0.0, 'locked': 0.0})
+                balance['free'] += float(event['d'])
+            else:
+                return
+            self.updated = time.time()
+
+    def get(self, symbol, side=None):
+        """
+        Get the open positions of a symbol, or the balance of an asset for SPOT
+        :param symbol: symbol string ('BTCUSDT') or asset string for SPOT ('BTC')
+        :param side: 'LONG' or 'SHORT'
+        :return: list of position dicts
+        """
+        if self.market == 'SPOT':
+            return [self.balances[symbol]] if symbol in self.balances else []
+        positions = list(self.positions.get(symbol, {}).values())
+        if side == 'LONG':
+            return [p for p in positions if p['positionAmt'] > 0]
+        elif side == 'SHORT':
+            return [p for p in positions if p['positionAmt'] < 0]
+        return positions
+
+    def balance(self, asset):
+        """
+        Get the balance of an asset (free and locked for SPOT, wallet and cross wallet balances for futures)
+        :param asset: asset string ('USDT')
+        :return: balance dict, or None if there is no balance
+        """
+        with self._lock:
+            return dict(self.balances[asset]) if asset in self.balances else None
+
+    def frame(self, symbol=None, side=None):
+        """
+        Get the open positions as get_positions returns them
+        :param symbol: symbol string ('BTCUSDT')
+        :param side: 'LONG' or 'SHORT'
+        :return: pandas.DataFrame with the open positions
+        """
+        with self._lock:
+            if symbol:
+                rows = [dict(p) for p in self.get(symbol, side)]
+            elif self.market == 'SPOT':
+                rows = [dict(b) for b in self.balances.values()]
+            else:
+                rows = [dict(p) for sides in self.positions.values() for p in sides.values()]
+        df = pd.DataFrame(rows)
+        if self.market == 'SPOT' and len(df):
+            df['balance'] = df['free'] + df['locked']
+        return df
@@ -0,0 +1,131 @@
+"""Klines Resampling Tools"""
+import logging
+import numpy as np
+import pandas as pd
+from tradingtools import commontools, storetools
+
+logger = logging.getLogger('resampletools')
+
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'vol': 'sum', 'quote_vol': 'sum', 'trades': 'sum',
+                'taker_base_vol': 'sum', 'taker_quote_vol': 'sum'}
+WEEK_OFFSET = 4 * 86400000
+
+
+def buckets(times, timeframe):
+    """
+    Get the start and end of the bucket each timestamp belongs to. Days are aligned to UTC midnight, weeks to Monday
+    and months to the first day of the month
+    :param times: int64 numpy.array with epoch milliseconds
+    :param timeframe: target timeframe string ('4h')
+    :return: tuple of int64 numpy.array (starts, ends) in epoch milliseconds
+    """
+    unit = timeframe.lstrip('0123456789')
+    if unit in ('M', 'mon'):
+        n = int(timeframe[:-len(unit)])
+        months = times.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+        months -= months % n
+        return (months.astype('datetime64[M]').astype('datetime64[ms]').astype(np.int64),
+                (months + n).astype('datetime64[M]').astype('datetime64[ms]').astype(np.int64))
+    step = commontools.timeframe_to_ms(timeframe)
+    offset = WEEK_OFFSET if unit in ('w', 'week') else 0
+    starts = times - (times - offset) % step
+    return starts, starts + step
+
+
+def resample_klines(df, timeframe):
+    """
+    Aggregate sorted klines into a higher timeframe (open first, high max, low min, close last and volumes, trades sum)
+    :param df: pandas.DataFrame with the klines sorted by open_time
+    :param timeframe: target timeframe string ('4h')
+    :return: pandas.DataFrame with the resampled klines (the last one may be still open)
+    """
+    if len(df) == 0:
+        return df.iloc[:0].copy()
+    times = df['open_time'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    starts, ends = buckets(times, timeframe)
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:], len(times)] - 1
+
+    columns = {}
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if name == 'open_time':
+            columns[name] = (starts[first] * 1000).view('datetime64[us]')
+        elif name == 'close_time':
+            columns[name] = ((ends[first] - 1) * 1000).view('datetime64[us]')
+        elif AGGREGATIONS.get(name) == 'first':
+            columns[name] = values[first]
+        elif AGGREGATIONS.get(name) == 'last':
+            columns[name] = values[last]
+        elif AGGREGATIONS.get(name) == 'max':
+            columns[name] = np.maximum.reduceat(values, first)
+        elif AGGREGATIONS.get(name) == 'min':
+            columns[name] = np.minimum.reduceat(values, first)
+        elif name == 'trades':
+            columns[name] = np.where(np.minimum.reduceat(values, first) < 0, -1, np.add.reduceat(values, first))
+        elif AGGREGATIONS.get(name) == 'sum':
+            columns[name] = np.add.reduceat(values, first)
+        else:
+            columns[name] = values[last]
+    return pd.DataFrame(columns, columns=df.columns)
+
+
+def read_resampled(path, symbol, source, timeframe, start=None, end=None, columns=None):
+    """
+    Read the source klines from the store and resample them on the fly
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param source: stored timeframe string ('1m')
+    :param timeframe: target timeframe string ('4h')
+    :param start: first open time (epoch milliseconds, datetime or ISO string)
+    :param end: last open time (epoch milliseconds, datetime or ISO string)
+    :param columns: list of columns to read (['open_time', 'close']). All of them if None
+    :return: pandas.DataFrame with the resampled klines
+    """
+    start, end = storetools.to_timestamp(start), storetools.to_timestamp(end)
+    if start is not None:
+        start = pd.Timestamp(int(buckets(np.array([start.value // 10 ** 6]), timeframe)[0][0]), unit='ms')
+    if end is not None:
+        end = pd.Timestamp(int(buckets(np.array([end.value // 10 ** 6]), timeframe)[1][0]) - 1, unit='ms')
+    read = None if columns is None else ['open_time'] + [c for c in columns if c != 'open_time']
+    df = resample_klines(storetools.read_klines(path, symbol, source, start, end, read), timeframe)
+    return df if columns is None else df[columns]
+
+
+def read_refreshed(path, symbol, source, timeframe, start=None, end=None, columns=None, mmap=False):
+    """
+    Read a stored resampled timeframe with its last stored bucket (which may have been open) and the newer ones
+    resampled on the fly from the source klines, so the result is up to date even if update_resampled was not run
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param source: stored timeframe string ('1m')
+    :param timeframe: stored target timeframe string ('4h')
+    :param start: first open time (epoch milliseconds, datetime or ISO string)
+    :param end: last open time (epoch milliseconds, datetime or ISO string)
+    :param columns: list of columns to read (['open_time', 'close']). All of them if None
+    :param mmap: read the stored buckets from a memory-mapped Arrow file
+    :return: pandas.DataFrame with the klines
+    """
+    start, end = storetools.to_timestamp(start), storetools.to_timestamp(end)
+    last = storetools.time_range(path, symbol, timeframe)[1]
+    if (end is not None and end < last) or storetools.time_range(path, symbol, source)[1] < last:
+        return storetools.read_klines(path, symbol, timeframe, start, end, columns, mmap)
+    stored = storetools.read_klines(path, symbol, timeframe, start, last - pd.Timedelta(1, 'ms'), columns, mmap)
+    fresh = read_resampled(path, symbol, source, timeframe, max(start, last) if start is not None else last, end, columns)
+    return pd.concat([stored, fresh], ignore_index=True) if len(stored) else fresh
+
+
+def update_resampled(path, symbol, source, timeframe, compression='zstd'):
+    """
+    Store a resampled timeframe, recomputing only the buckets from the last stored one (which may have been open)
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param source: stored timeframe string ('1m')
+    :param timeframe: target timeframe string ('4h')
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :return: number of partitions written
+    """
+    start = storetools.time_range(path, symbol, timeframe)[1] if storetools.exists(path, symbol, timeframe) else None
+    df = resample_klines(storetools.read_klines(path, symbol, source, start), timeframe)
+    logger.debug(f'{len(df)} {timeframe} klines of {symbol} resampled from {source} since {start}')
+    return storetools.write_klines(df, path, symbol, timeframe, compression)
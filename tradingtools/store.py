@@ -0,0 +1,437 @@
+"""Partitioned Klines Store"""
+import os
+import glob
+import json
+import logging
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from tradingtools import commontools
+
+logger = logging.getLogger('storetools')
+
+KLINES_SCHEMA = commontools.KLINES_SCHEMA
+COMPRESSIONS = ('zstd', 'snappy', 'gzip', 'none')
+ROW_GROUP_SIZE = 10000
+MANIFEST = '_coverage.json'
+
+
+def dataset_path(path, symbol, timeframe):
+    """
+    Get the folder holding the partitions of a dataset
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: folder path string
+    """
+    return os.path.join(path, f'{symbol.lower()}_{timeframe_name(timeframe)}')
+
+
+def timeframe_name(timeframe):
+    """
+    Get the lowercase name of a timeframe, keeping months ('1M') apart from minutes ('1m')
+    :param timeframe: klines timeframe string ('5m')
+    :return: timeframe name string ('5m', '1mon')
+    """
+    return timeframe[:-1] + 'mon' if timeframe.endswith('M') else timeframe.lower()
+
+
+def legacy_path(path, symbol, timeframe):
+    """
+    Get the path of the single gzip parquet file used before the partitioned store
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: file path string
+    """
+    return f'{path}\\{symbol.lower()}_{timeframe.lower()}.parquet.gzip'
+
+
+def arrow_path(path, symbol, timeframe):
+    """
+    Get the path of the uncompressed Arrow file used for memory-mapped reads
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: file path string
+    """
+    return os.path.join(path, f'{symbol.lower()}_{timeframe_name(timeframe)}.arrow')
+
+
+def conform(table):
+    """
+    Cast a klines table to the common schema: only the KLINES_SCHEMA columns in order (dropping the legacy 'ignore' and
+    index columns), times as timestamp[us], trades as int64 (-1 where missing) and prices and volumes as float64 unless
+    they are stored as float32
+    :param table: pyarrow.Table
+    :return: pyarrow.Table
+    """
+    names = [name for name in KLINES_SCHEMA if name in table.column_names]
+    columns = []
+    for name in names:
+        column = table.column(name)
+        if name in ('open_time', 'close_time'):
+            column = column.cast(pa.timestamp('us'), safe=False)
+        elif name == 'trades':
+            if pa.types.is_floating(column.type):
+                column = pc.if_else(pc.is_nan(column), -1.0, column)
+            column = pc.fill_null(column, -1).cast(pa.int64())
+        elif column.type != pa.float32():
+            column = column.cast(pa.float64())
+        columns.append(column)
+    return pa.table(columns, names=names)
+
+
+def concat(tables):
+    """
+    Concatenate conformed klines tables, promoting the float32 columns to float64 where the partitions differ
+    :param tables: list of pyarrow.Table
+    :return: pyarrow.Table
+    """
+    tables = [conform(table) for table in tables]
+    return pa.concat_tables(tables, promote_options='permissive') if len(tables) > 1 else tables[0]
+
+
+def partitions(path, symbol, timeframe, start=None, end=None):
+    """
+    List the monthly partition files of a dataset in chronological order
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: skip the partitions before this pandas.Timestamp
+    :param end: skip the partitions after this pandas.Timestamp
+    :return: list of file path strings
+    """
+    files = sorted(glob.glob(os.path.join(dataset_path(path, symbol, timeframe), '*.parquet')))
+    if start is not None:
+        files = [f for f in files if os.path.basename(f)[:7] >= start.strftime('%Y-%m')]
+    if end is not None:
+        files = [f for f in files if os.path.basename(f)[:7] <= end.strftime('%Y-%m')]
+    return files
+
+
+def to_timestamp(date):
+    """
+    Convert a date into a naive UTC pandas.Timestamp
+    :param date: epoch milliseconds, datetime, ISO string or None
+    :return: pandas.Timestamp or None
+    """
+    if date is None:
+        return None
+    if isinstance(date, (int, float)):
+        return pd.Timestamp(int(date), unit='ms')
+    date = pd.Timestamp(date)
+    return date.tz_convert(None) if date.tzinfo is not None else date
+
+
+def exists(path, symbol, timeframe):
+    """
+    Check if a dataset has any stored data
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: True if there is data stored
+    """
+    return len(partitions(path, symbol, timeframe)) > 0 or os.path.isfile(legacy_path(path, symbol, timeframe))
+
+
+def migrate(path, symbol, timeframe, compression='zstd'):
+    """
+    Move a legacy single-file dataset into monthly partitions (the legacy file is kept)
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :return: number of partitions written
+    """
+    if partitions(path, symbol, timeframe) or not os.path.isfile(legacy_path(path, symbol, timeframe)):
+        return 0
+    logger.info(f'Migrating {legacy_path(path, symbol, timeframe)} into {dataset_path(path, symbol, timeframe)}')
+    return write_klines(pd.read_parquet(legacy_path(path, symbol, timeframe)), path, symbol, timeframe, compression)
+
+
+def write_klines(df, path, symbol, timeframe, compression='zstd'):
+    """
+    Merge some klines into the store, rewriting only the monthly partitions they touch with the common schema (see conform)
+    :param df: pandas.DataFrame with an 'open_time' column
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :return: number of partitions written
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression}. Use one of {COMPRESSIONS}')
+    if df is None or len(df) == 0:
+        return 0
+
+    folder = dataset_path(path, symbol, timeframe)
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    for month, part in df.groupby(df['open_time'].dt.strftime('%Y-%m'), sort=True):
+        file = os.path.join(folder, f'{month}.parquet')
+        if os.path.isfile(file):
+            part = pd.concat([pd.read_parquet(file), part])
+        part = part.drop_duplicates('open_time', keep='last').sort_values('open_time')
+        pq.write_table(conform(pa.Table.from_pandas(part, preserve_index=False)), file,
+                       compression=None if compression == 'none' else compression, row_group_size=ROW_GROUP_SIZE)
+        logger.debug(f'Partition {file} saved with {len(part)} rows')
+        written += 1
+    return written
+
+
+def read_klines(path, symbol, timeframe, start=None, end=None, columns=None, mmap=False):
+    """
+    Read a dataset from the store, loading only the partitions, row groups and columns requested
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: first open time (epoch milliseconds, datetime or ISO string)
+    :param end: last open time (epoch milliseconds, datetime or ISO string)
+    :param columns: list of columns to read (['open_time', 'close']). All of them if None
+    :param mmap: read from a memory-mapped Arrow file (created or refreshed when needed) instead of the parquet files
+    :return: pandas.DataFrame with the data
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    if mmap:
+        return read_arrow(path, symbol, timeframe, start, end, columns)
+
+    filters = ([('open_time', '>=', start)] if start is not None else []) + ([('open_time', '<=', end)] if end is not None else [])
+    files = partitions(path, symbol, timeframe, start, end) or partitions(path, symbol, timeframe)[:1] or [legacy_path(path, symbol, timeframe)]
+    table = concat([pq.read_table(file, columns=columns, filters=filters or None) for file in files])
+    return table.to_pandas(split_blocks=True)
+
+
+def read_table(path, symbol, timeframe, start=None, end=None, columns=None):
+    """
+    Read a dataset from the store as a pyarrow.Table, skipping the pandas conversion of read_klines
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: first open time (epoch milliseconds, datetime or ISO string)
+    :param end: last open time (epoch milliseconds, datetime or ISO string)
+    :param columns: list of columns to read (['open_time', 'close']). All of them if None
+    :return: pyarrow.Table with the data
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    read = None if columns is None or 'open_time' in columns else ['open_time'] + list(columns)
+    files = partitions(path, symbol, timeframe, start, end) or partitions(path, symbol, timeframe)[:1] or [legacy_path(path, symbol, timeframe)]
+    table = concat([pq.ParquetFile(file).read(columns=read or columns) for file in files])
+    if start is not None or end is not None:
+        times = table.column('open_time').to_numpy()
+        first = np.searchsorted(times, start.to_datetime64()) if start is not None else 0
+        last = np.searchsorted(times, end.to_datetime64(), side='right') if end is not None else len(times)
+        table = table.slice(first, max(0, last - first))
+    return table.select(columns) if columns is not None else table
+
+
+def write_arrow(path, symbol, timeframe):
+    """
+    Write the whole dataset into an uncompressed Arrow file that can be memory-mapped
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: file path string
+    """
+    files = partitions(path, symbol, timeframe) or [legacy_path(path, symbol, timeframe)]
+    table = concat([pq.read_table(file) for file in files]).combine_chunks()
+    feather.write_feather(table, arrow_path(path, symbol, timeframe), compression='uncompressed')
+    logger.debug(f'Arrow file {arrow_path(path, symbol, timeframe)} saved with {table.num_rows} rows')
+    return arrow_path(path, symbol, timeframe)
+
+
+def read_arrow(path, symbol, timeframe, start=None, end=None, columns=None):
+    """
+    Read a dataset through its memory-mapped Arrow file, rewriting it first if any partition is newer
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param start: first open time pandas.Timestamp
+    :param end: last open time pandas.Timestamp
+    :param columns: list of columns to read (['open_time', 'close']). All of them if None
+    :return: pandas.DataFrame with the data
+    """
+    file = arrow_path(path, symbol, timeframe)
+    sources = partitions(path, symbol, timeframe) or [legacy_path(path, symbol, timeframe)]
+    if not os.path.isfile(file) or os.path.getmtime(file) < max(os.path.getmtime(f) for f in sources):
+        write_arrow(path, symbol, timeframe)
+    table = feather.read_table(file, memory_map=True)
+    if start is not None or end is not None:
+        times = table.column('open_time').to_numpy()
+        first = np.searchsorted(times, start.to_datetime64()) if start is not None else 0
+        last = np.searchsorted(times, end.to_datetime64(), side='right') if end is not None else len(times)
+        table = table.slice(first, max(0, last - first))
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def time_range(path, symbol, timeframe):
+    """
+    Get the first and last open times stored for a dataset reading only the parquet metadata
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: tuple of (first, last) pandas.Timestamp
+    """
+    files = partitions(path, symbol, timeframe) or [legacy_path(path, symbol, timeframe)]
+    first, last = pq.ParquetFile(files[0]).metadata, pq.ParquetFile(files[-1]).metadata
+    column = first.schema.names.index('open_time')
+    return (pd.Timestamp(min(first.row_group(i).column(column).statistics.min for i in range(first.num_row_groups))),
+            pd.Timestamp(max(last.row_group(i).column(column).statistics.max for i in range(last.num_row_groups))))
+
+
+def manifest_path(path, symbol, timeframe):
+    """
+    Get the path of the coverage manifest of a dataset
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: file path string
+    """
+    return os.path.join(dataset_path(path, symbol, timeframe), MANIFEST)
+
+
+def intervals(times, step):
+    """
+    Split sorted open times into contiguous intervals, breaking wherever two consecutive klines are more than a step apart
+    :param times: sorted int64 numpy.array with epoch milliseconds
+    :param step: timeframe in milliseconds (months as 31 days)
+    :return: int64 numpy.array of shape (n, 2) with the first and last open time of each interval
+    """
+    if len(times) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(times) > step)
+    return np.stack([times[np.r_[0, breaks + 1]], times[np.r_[breaks, len(times) - 1]]], axis=1).astype(np.int64)
+
+
+def merge_intervals(covered, step):
+    """
+    Merge overlapping or adjacent intervals
+    :param covered: int64 numpy.array of shape (n, 2) with first and last open times
+    :param step: timeframe in milliseconds (months as 31 days)
+    :return: int64 numpy.array of shape (m, 2) sorted by first open time
+    """
+    if len(covered) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    covered = covered[np.argsort(covered[:, 0], kind='stable')]
+    ends = np.maximum.accumulate(covered[:, 1])
+    first = np.r_[True, covered[1:, 0] > ends[:-1] + step]
+    return np.stack([covered[first, 0], np.maximum.reduceat(ends, np.flatnonzero(first))], axis=1)
+
+
+def save_manifest(file, manifest):
+    """
+    Replace a coverage manifest atomically
+    :param file: manifest path string (see manifest_path)
+    :param manifest: dict with timeframe, step, partitions and empty
+    :return: None
+    """
+    with open(file + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(file + '.tmp', file)
+    logger.debug(f'Coverage manifest {file} updated')
+
+
+def coverage(path, symbol, timeframe, step):
+    """
+    Get the intervals stored for a dataset. They are kept per partition in a manifest ({dataset}/_coverage.json) and only
+    the partitions modified since the manifest was saved have their open_time column scanned again
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param step: timeframe in milliseconds (months as 31 days)
+    :return: int64 numpy.array of shape (n, 2) with the first and last open time (epoch milliseconds) of each interval
+    """
+    file = manifest_path(path, symbol, timeframe)
+    manifest = {'partitions': {}}
+    if os.path.isfile(file):
+        with open(file) as f:
+            manifest = json.load(f)
+    entries, changed = {}, False
+    for partition in partitions(path, symbol, timeframe):
+        name, stat = os.path.basename(partition), os.stat(partition)
+        entry = manifest['partitions'].get(name)
+        if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            times = pq.read_table(partition, columns=['open_time']).column('open_time').to_numpy()
+            times = times.astype('datetime64[ms]').astype(np.int64)
+            entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'rows': len(times), 'intervals': intervals(times, step).tolist()}
+            changed = True
+        entries[name] = entry
+    if changed or len(entries) != len(manifest['partitions']):
+        save_manifest(file, dict(manifest, timeframe=timeframe, step=step, partitions=entries))
+    covered = [interval for entry in entries.values() for interval in entry['intervals']]
+    return merge_intervals(np.array(covered, dtype=np.int64).reshape(-1, 2), step)
+
+
+def empty_intervals(path, symbol, timeframe):
+    """
+    Get the intervals of a dataset fetched from the exchange that came back without klines (maintenance, before the
+    listing...), kept in the coverage manifest by record_empty
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :return: int64 numpy.array of shape (n, 2) with the first and last epoch milliseconds of each interval
+    """
+    file = manifest_path(path, symbol, timeframe)
+    if not os.path.isfile(file):
+        return np.empty((0, 2), dtype=np.int64)
+    with open(file) as f:
+        return np.array(json.load(f).get('empty', []), dtype=np.int64).reshape(-1, 2)
+
+
+def record_empty(path, symbol, timeframe, ranges, times, step, until=None):
+    """
+    Record in the coverage manifest the parts of some fetched ranges where the exchange returned no klines, so gaps
+    does not report them again
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param timeframe: klines timeframe string ('5m')
+    :param ranges: list of (first, last) epoch milliseconds fetched successfully
+    :param times: int64 numpy.array with the open times returned for those ranges
+    :param step: timeframe in milliseconds (months as 31 days)
+    :param until: ignore the parts after this epoch milliseconds, which the exchange may not have published yet. One
+    step before now if None
+    :return: number of empty intervals found
+    """
+    until = until if until is not None else int(time.time() * 1000) - step
+    covered = intervals(np.sort(np.asarray(times, dtype=np.int64)), step)
+    found = [gaps(covered, first, min(last, until), step) for first, last in ranges if first <= min(last, until)]
+    found = np.concatenate(found) if found else np.empty((0, 2), dtype=np.int64)
+    if len(found) == 0 or not exists(path, symbol, timeframe):
+        return 0
+    coverage(path, symbol, timeframe, step)
+    file = manifest_path(path, symbol, timeframe)
+    with open(file) as f:
+        manifest = json.load(f)
+    manifest['empty'] = merge_intervals(np.r_[empty_intervals(path, symbol, timeframe), found], 1).tolist()
+    save_manifest(file, manifest)
+    logger.debug(f'{len(found)} intervals without klines recorded for {symbol} {timeframe}')
+    return len(found)
+
+
+def gaps(covered, start, end, step, empty=None):
+    """
+    Get the intervals missing from a range
+    :param covered: int64 numpy.array of shape (n, 2) with the stored intervals (see coverage)
+    :param start: range start in epoch milliseconds
+    :param end: range end in epoch milliseconds
+    :param step: timeframe in milliseconds (months as 31 days)
+    :param empty: int64 numpy.array of shape (k, 2) with the intervals known to have no klines (see empty_intervals)
+    :return: int64 numpy.array of shape (m, 2) with the first and last epoch milliseconds of each gap
+    """
+    if empty is not None and len(empty):
+        covered = merge_intervals(np.r_[covered, empty], step)
+    covered = covered[(covered[:, 1] >= start) & (covered[:, 0] <= end)]
+    if len(covered) == 0:
+        return np.array([[start, end]], dtype=np.int64) if end - start >= 0 else np.empty((0, 2), dtype=np.int64)
+    missing = np.stack([covered[:-1, 1] + 1, covered[1:, 0] - 1], axis=1)
+    if covered[0, 0] - start >= step:
+        missing = np.r_[[[start, covered[0, 0] - 1]], missing]
+    if end - covered[-1, 1] >= step:
+        missing = np.r_[missing, [[covered[-1, 1] + 1, end]]]
+    return missing.astype(np.int64).reshape(-1, 2)
@@ -0,0 +1,211 @@
+"""Klines Streaming Tools"""
+import time
+import asyncio
+import logging
+import numpy as np
+import pandas as pd
+from tradingtools import commontools, storetools
+
+logger = logging.getLogger('streamtools')
+
+FIELDS = ['open', 'high', 'low', 'close', 'vol', 'quote_vol', 'trades', 'taker_base_vol', 'taker_quote_vol']
+MESSAGE_FIELDS = ['o', 'h', 'l', 'c', 'v', 'q', 'n', 'V', 'Q']
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer keeping the last klines of a symbol in NumPy arrays
+    """
+
+    def __init__(self, size, fields=FIELDS):
+        """
+        :param size: number of klines kept
+        :param fields: names of the values stored for each kline
+        """
+        self.size = size
+        self.fields = list(fields)
+        self.times = np.zeros(size, dtype=np.int64)
+        self.values = np.full((size, len(self.fields)), np.nan)
+        self.count = 0
+        self.closed = False
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def push(self, open_time, values, closed=True):
+        """
+        Append a kline, or overwrite the last one if it has the same open time (a kline still open)
+        :param open_time: epoch milliseconds int
+        :param values: sequence with one value per field
+        :param closed: whether the kline is final
+        :return: None
+        """
+        if self.count == 0 or self.times[(self.count - 1) % self.size] != open_time:
+            self.count += 1
+        i = (self.count - 1) % self.size
+        self.times[i] = open_time
+        self.values[i] = values
+        self.closed = closed
+
+    def latest(self):
+        """
+        Get the last kline
+        :return: tuple of (open_time, values numpy.array)
+        """
+        i = (self.count - 1) % self.size
+        return self.times[i], self.values[i]
+
+    def last(self, n=None):
+        """
+        Get the last klines in chronological order
+        :param n: number of klines. All the stored ones if None
+        :return: tuple of (open_times, values) numpy.array copies
+        """
+        n = len(self) if n is None else min(n, len(self))
+        index = np.arange(self.count - n, self.count) % self.size
+        return self.times[index], self.values[index]
+
+    def to_frame(self, n=None):
+        """
+        Get the last klines as a DataFrame
+        :param n: number of klines. All the stored ones if None
+        :return: pandas.DataFrame with the data
+        """
+        times, values = self.last(n)
+        df = pd.DataFrame(values, columns=self.fields)
+        df.insert(0, 'open_time', (times * 1000).view('datetime64[us]'))
+        return df
+
+
+class KlineStream:
+    """
+    Consume kline websocket messages of many symbols into ring buffers and flush the closed klines to the store in batches
+    """
+
+    def __init__(self, path=None, size=1000, flush_interval=60, flush_size=10000, compression='zstd'):
+        """
+        :param path: store root path string. Closed klines are not stored if None
+        :param size: number of klines kept for each symbol and timeframe
+        :param flush_interval: maximum seconds between two flushes
+        :param flush_size: maximum number of pending closed klines before a flush
+        :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+        """
+        self.path = path
+        self.size = size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.compression = compression
+        self.buffers = {}
+        self.pending = {}
+        self.pending_count = 0
+        self.flushed = time.monotonic()
+
+    def buffer(self, symbol, timeframe):
+        """
+        Get the ring buffer of a symbol and timeframe
+        :param symbol: symbol string ('BTCUSDT')
+        :param timeframe: klines timeframe string ('1m')
+        :return: RingBuffer
+        """
+        key = (symbol.upper(), timeframe)
+        if key not in self.buffers:
+            self.buffers[key] = RingBuffer(self.size)
+        return self.buffers[key]
+
+    def process(self, message):
+        """
+        Process one kline message, as sent by the Binance websockets (plain or combined stream), flushing when it is due
+        :param message: message dict
+        :return: None
+        """
+        if self.consume(message):
+            self.flush()
+
+    def consume(self, message):
+        """
+        Push one kline message into its ring buffer and queue it if closed, without writing anything
+        :param message: message dict
+        :return: True if a flush is due
+        """
+        message = message.get('data', message)
+        if message.get('e') != 'kline':
+            return False
+        kline = message['k']
+        symbol, timeframe, closed = kline['s'], kline['i'], kline['x']
+        values = [float(kline[field]) for field in MESSAGE_FIELDS]
+        self.buffer(symbol, timeframe).push(kline['t'], values, closed)
+        if closed and self.path is not None:
+            self.pending.setdefault((symbol, timeframe), []).append([kline['t']] + values + [kline['T']])
+            self.pending_count += 1
+        return self.pending_count >= self.flush_size or time.monotonic() - self.flushed >= self.flush_interval
+
+    def take(self):
+        """
+        Detach the pending closed klines, so they can be written while new messages are consumed
+        :return: dict of pending rows by (symbol, timeframe)
+        """
+        pending, self.pending, self.pending_count, self.flushed = self.pending, {}, 0, time.monotonic()
+        return pending
+
+    def write(self, pending):
+        """
+        Write detached closed klines into the store
+        :param pending: dict of pending rows by (symbol, timeframe) (see take)
+        :return: number of klines written
+        """
+        written = 0
+        for (symbol, timeframe), rows in pending.items():
+            df = commontools.decode_klines(rows, ['open_time'] + FIELDS + ['close_time'])
+            storetools.write_klines(df, self.path, symbol, timeframe, self.compression)
+            written += len(rows)
+        if written:
+            logger.debug(f'{written} klines of {len(pending)} datasets flushed into {self.path}')
+        return written
+
+    def flush(self):
+        """
+        Write the pending closed klines into the store
+        :return: number of klines written
+        """
+        return self.write(self.take())
+
+    def run(self, source):
+        """
+        Consume a message source until it is exhausted and flush the remaining klines
+        :param source: iterable of message dicts
+        :return: None
+        """
+        try:
+            for message in source:
+                self.process(message)
+        finally:
+            self.flush()
+
+    async def arun(self, source):
+        """
+        Consume an asynchronous message source until it is exhausted and flush the remaining klines. Flushes run in a
+        worker thread, one at a time, so the event loop keeps serving the websockets while partitions are rewritten
+        :param source: async iterable of message dicts (see socket_messages)
+        :return: None
+        """
+        task = None
+        try:
+            async for message in source:
+                if self.consume(message) and (task is None or task.done()):
+                    if task is not None:
+                        task.result()
+                    task = asyncio.ensure_future(asyncio.to_thread(self.write, self.take()))
+        finally:
+            if task is not None:
+                await task
+            await asyncio.to_thread(self.flush)
+
+
+async def socket_messages(socket):
+    """
+    Adapt a python-binance socket (BinanceSocketManager.multiplex_socket) into an async message source
+    :param socket: opened socket with a recv coroutine
+    :return: async generator of message dicts
+    """
+    while True:
+        yield await socket.recv()
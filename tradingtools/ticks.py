@@ -0,0 +1,466 @@
+"""Tick Data Tools"""
+import os
+import glob
+import time
+import logging
+from decimal import Decimal, ROUND_HALF_EVEN
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tradingtools import commontools, storetools, resampletools, paneltools, binancetools
+
+logger = logging.getLogger('ticktools')
+
+DAY = 86400000
+HOUR = 3600000
+ROW_GROUP_SIZE = 1000000
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+AGG_TRADES_KEYS = ['a', 'p', 'q', 'f', 'l', 'T', 'm']
+AGG_TRADES_LIMIT = 1000
+AGG_TRADES_WEIGHT = {'SPOT': 2, 'USDM': 20, 'COINM': 20}
+AGG_TRADES_SCHEMA = pa.schema([('agg_id', pa.int64()), ('price', pa.int64()), ('qty', pa.int64()), ('first_id', pa.int64()),
+                               ('last_id', pa.int64()), ('time', pa.int64()), ('is_buyer_maker', pa.bool_())])
+DEPTH_SCHEMA = pa.schema([('time', pa.int64()), ('update_id', pa.int64()), ('side', pa.int8()), ('level', pa.int16()),
+                          ('price', pa.int64()), ('qty', pa.int64())])
+
+
+def dataset_path(path, symbol, kind):
+    """
+    Get the folder holding the day partitions of a tick dataset
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param kind: 'aggtrades' or 'depth{limit}' ('depth100')
+    :return: folder path string
+    """
+    return os.path.join(path, f'{symbol.lower()}_{kind}')
+
+
+def scale(values, decimals):
+    """
+    Convert decimal prices or quantities into scaled integers
+    :param values: numbers or decimal strings, parsed exactly and rounded half to even past the kept decimals
+    :param decimals: number of decimals kept
+    :return: int64 numpy.array with the values times 10 ** decimals
+    """
+    scaled = [int(Decimal(v if isinstance(v, str) else repr(float(v))).scaleb(decimals).to_integral_value(ROUND_HALF_EVEN))
+              for v in values]
+    for value, s in zip(values, scaled):
+        if not INT64_MIN <= s <= INT64_MAX:
+            raise OverflowError(f'{value} scaled by 10 ** {decimals} does not fit in int64. Use less decimals')
+    return np.array(scaled, dtype=np.int64)
+
+
+def decode_agg_trades(trades, price_decimals=8, qty_decimals=8):
+    """
+    Decode the aggregate trades returned by the REST API or the aggTrade websocket into typed columns
+    :param trades: list of aggregate trade dicts
+    :param price_decimals: decimals kept of the prices
+    :param qty_decimals: decimals kept of the quantities
+    :return: dict of numpy.array columns following AGG_TRADES_SCHEMA
+    """
+    n = len(trades)
+    columns = {}
+    for name, key in zip(AGG_TRADES_SCHEMA.names, AGG_TRADES_KEYS):
+        if name in ('price', 'qty'):
+            columns[name] = scale(list(map(itemgetter(key), trades)), price_decimals if name == 'price' else qty_decimals)
+        elif name == 'is_buyer_maker':
+            columns[name] = np.fromiter(map(itemgetter(key), trades), dtype=bool, count=n)
+        else:
+            columns[name] = np.fromiter(map(itemgetter(key), trades), dtype=np.int64, count=n)
+    return columns
+
+
+class TickWriter:
+    """
+    Streaming writer of a tick dataset into day partitions ({dataset}/YYYY-MM-DD/{first key}.parquet). At most
+    row_group_size rows are kept in memory, every flush appends a row group to the part file of the actual day
+    """
+
+    def __init__(self, folder, schema, metadata=None, compression='zstd', row_group_size=ROW_GROUP_SIZE):
+        """
+        :param folder: dataset folder path string (see dataset_path)
+        :param schema: pyarrow.Schema of the rows. Must have an int64 'time' column in epoch milliseconds
+        :param metadata: dict saved in the schema of every part file (price and quantity decimals...)
+        :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+        :param row_group_size: rows buffered before a row group is written
+        """
+        if compression not in storetools.COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression}. Use one of {storetools.COMPRESSIONS}')
+        self.folder = folder
+        self.schema = schema.with_metadata({k: str(v) for k, v in (metadata or {}).items()})
+        self.compression = None if compression == 'none' else compression
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.buffered = 0
+        self.day = None
+        self.writer = None
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, columns):
+        """
+        Append some rows sorted by time
+        :param columns: dict of numpy.array with one column per schema field
+        :return: None
+        """
+        if len(columns['time']) == 0:
+            return
+        days = columns['time'] // DAY
+        bounds = np.flatnonzero(np.r_[True, days[1:] != days[:-1], True])
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if days[a] != self.day:
+                self.flush()
+                self._close_writer()
+                self.day = int(days[a])
+            self.buffer.append({name: values[a:b] for name, values in columns.items()})
+            self.buffered += b - a
+            if self.buffered >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a row group of the part file of the actual day
+        :return: number of rows written
+        """
+        if not self.buffered:
+            return 0
+        table = pa.Table.from_arrays([pa.array(np.concatenate([part[name] for part in self.buffer]), type=field.type)
+                                      for name, field in zip(self.schema.names, self.schema)], schema=self.schema)
+        if self.writer is None:
+            day = pd.Timestamp(self.day * DAY, unit='ms').strftime('%Y-%m-%d')
+            os.makedirs(os.path.join(self.folder, day), exist_ok=True)
+            file = os.path.join(self.folder, day, f'{table.column(0)[0].as_py():020d}.parquet')
+            self.writer = pq.ParquetWriter(file, self.schema, compression=self.compression)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        rows, self.buffer, self.buffered = self.buffered, [], 0
+        self.written += rows
+        return rows
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        """
+        Flush the buffered rows and close the part file
+        :return: None
+        """
+        self.flush()
+        self._close_writer()
+
+
+def part_files(folder, start=None, end=None):
+    """
+    List the part files of a tick dataset in chronological order
+    :param folder: dataset folder path string
+    :param start: skip the days before this epoch milliseconds
+    :param end: skip the days after this epoch milliseconds
+    :return: list of file path strings
+    """
+    days = sorted(d for d in glob.glob(os.path.join(folder, '????-??-??')) if os.path.isdir(d))
+    if start is not None:
+        days = [d for d in days if os.path.basename(d) >= pd.Timestamp(start, unit='ms').strftime('%Y-%m-%d')]
+    if end is not None:
+        days = [d for d in days if os.path.basename(d) <= pd.Timestamp(end, unit='ms').strftime('%Y-%m-%d')]
+    return [f for d in days for f in sorted(glob.glob(os.path.join(d, '*.parquet')))]
+
+
+def last_values(folder, columns):
+    """
+    Get the maximum of some columns in the last part file reading only its metadata
+    :param folder: dataset folder path string
+    :param columns: list of column names
+    :return: tuple with one int per column, or None if the dataset is empty
+    """
+    files = part_files(folder)
+    if not files:
+        return None
+    metadata = pq.ParquetFile(files[-1]).metadata
+    if metadata.num_rows == 0:
+        return None
+    index = [metadata.schema.names.index(c) for c in columns]
+    return tuple(max(metadata.row_group(i).column(j).statistics.max for i in range(metadata.num_row_groups)) for j in index)
+
+
+def schema_metadata(schema):
+    """
+    Decode the metadata saved in a tick schema
+    :param schema: pyarrow.Schema
+    :return: dict of strings
+    """
+    return {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+
+
+def stored_decimals(folder, price_decimals=None, qty_decimals=None):
+    """
+    Get the decimals a dataset is stored with, so a resumed download keeps the scale of the stored part files
+    :param folder: dataset folder path string
+    :param price_decimals: decimals requested for the prices. The stored ones (or 8 for a new dataset) if None
+    :param qty_decimals: decimals requested for the quantities. The stored ones (or 8 for a new dataset) if None
+    :return: tuple with the price and quantity decimals
+    """
+    files = part_files(folder)
+    if not files:
+        return (8 if price_decimals is None else price_decimals), (8 if qty_decimals is None else qty_decimals)
+    metadata = schema_metadata(pq.read_schema(files[-1]))
+    stored = int(metadata['price_decimals']), int(metadata['qty_decimals'])
+    for name, requested, value in zip(('price_decimals', 'qty_decimals'), (price_decimals, qty_decimals), stored):
+        if requested is not None and requested != value:
+            raise ValueError(f'{folder} is stored with {name}={value}, not {requested}')
+    return stored
+
+
+def read_ticks(folder, start=None, end=None, columns=None):
+    """
+    Read a tick dataset between two times, loading only the days and row groups needed
+    :param folder: dataset folder path string
+    :param start: first time (epoch milliseconds, datetime or human-readable string)
+    :param end: last time (epoch milliseconds, datetime or human-readable string)
+    :param columns: list of columns to read. All of them if None
+    :return: pyarrow.Table with the rows and the dataset metadata
+    """
+    start = commontools.to_milliseconds(start) if start is not None else None
+    end = commontools.to_milliseconds(end) if end is not None else None
+    filters = ([('time', '>=', start)] if start is not None else []) + ([('time', '<=', end)] if end is not None else [])
+    tables = [pq.read_table(file, columns=columns, filters=filters or None) for file in part_files(folder, start, end)]
+    if not tables:
+        raise FileNotFoundError(f'No tick data stored in {folder}')
+    decimals = {tuple(schema_metadata(t.schema).get(f'{n}_decimals') for n in ('price', 'qty')) for t in tables}
+    if len(decimals) > 1:
+        raise ValueError(f'Part files of {folder} are stored with different (price, qty) decimals {sorted(map(str, decimals))}')
+    return pa.concat_tables(tables)
+
+
+def to_frame(table, scaled=False):
+    """
+    Convert a tick table into a DataFrame, with the prices and quantities back to floats and the times to datetime64[ms]
+    :param table: pyarrow.Table read with read_ticks
+    :param scaled: keep the scaled integer prices and quantities
+    :return: pandas.DataFrame
+    """
+    metadata = schema_metadata(table.schema)
+    columns = {}
+    for name in table.column_names:
+        values = table.column(name).to_numpy()
+        if name == 'time':
+            values = values.astype('datetime64[ms]')
+        elif name in ('price', 'qty') and not scaled:
+            values = values / 10 ** int(metadata[f'{name}_decimals'])
+        columns[name] = values
+    return pd.DataFrame(columns)
+
+
+def get_agg_trades(client, market, symbol, **params):
+    """
+    Get a single page of aggregate trades
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param params: fromId, startTime, endTime...
+    :return: list of aggregate trade dicts
+    """
+    market = market.upper()
+    fun = client.futures_aggregate_trades if market == 'USDM' else (client.futures_coin_aggregate_trades if market == 'COINM'
+                                                                   else client.get_aggregate_trades)
+    return fun(symbol=symbol.upper(), limit=AGG_TRADES_LIMIT, **params)
+
+
+def download_agg_trades(client, market, symbol, start, end, path, price_decimals=None, qty_decimals=None, compression='zstd',
+                        row_group_size=ROW_GROUP_SIZE, budget=None):
+    """
+    Download the aggregate trades of a symbol into day partitions with bounded memory. Pages are chained by trade id
+    and a dataset already stored is continued from its last trade
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param start: data start (epoch milliseconds, datetime, ISO string or human-readable datetime like '1 day ago')
+    :param end: data end (epoch milliseconds, datetime, ISO string or human-readable datetime like 'now')
+    :param path: store root path string
+    :param price_decimals: decimals kept of the prices. The stored ones (or 8) if None, and they must match when given
+    :param qty_decimals: decimals kept of the quantities. The stored ones (or 8) if None, and they must match when given
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param row_group_size: rows kept in memory before they are written
+    :param budget: fraction of the exchange weight limit per minute to use, applied to the limiters shared with
+    binancetools (see binancetools.set_budget). The actual one if None
+    :return: number of trades written
+    """
+    market, symbol = market.upper(), symbol.upper()
+    start, end = commontools.to_milliseconds(start), commontools.to_milliseconds(end)
+    folder = dataset_path(path, symbol, 'aggtrades')
+    price_decimals, qty_decimals = stored_decimals(folder, price_decimals, qty_decimals)
+    if budget is not None:
+        binancetools.set_budget(budget)
+    limiter = binancetools.limiters[market]
+    last = last_values(folder, ['agg_id', 'time'])
+    from_id = last[0] + 1 if last is not None and last[1] >= start else None
+    window = start
+
+    metadata = {'symbol': symbol, 'market': market, 'price_decimals': price_decimals, 'qty_decimals': qty_decimals}
+    with TickWriter(folder, AGG_TRADES_SCHEMA, metadata, compression, row_group_size) as writer:
+        while window <= end:
+            limiter.acquire(AGG_TRADES_WEIGHT[market])
+            by_id = from_id is not None
+            if by_id:
+                page = get_agg_trades(client, market, symbol, fromId=from_id)
+                if not page:
+                    break
+            else:
+                page = get_agg_trades(client, market, symbol, startTime=window, endTime=min(window + HOUR - 1, end))
+                if not page:
+                    window += HOUR
+                    continue
+            used = commontools.used_weight(client)
+            if used is not None:
+                limiter.sync(used)
+            columns = decode_agg_trades(page, price_decimals, qty_decimals)
+            keep = columns['time'] <= end
+            writer.write({name: values[keep] for name, values in columns.items()})
+            from_id, window = int(columns['agg_id'][-1]) + 1, int(columns['time'][-1])
+            # a short startTime page only means a quiet hour, a short fromId page means the latest trade was reached
+            if not keep.all() or (by_id and len(page) < AGG_TRADES_LIMIT):
+                break
+    logger.info(f'{writer.written} aggregate trades of {symbol} at {market} saved into {folder}')
+    return writer.written
+
+
+def read_agg_trades(path, symbol, start=None, end=None, columns=None, scaled=False):
+    """
+    Read the stored aggregate trades of a symbol
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param start: first trade time (epoch milliseconds, datetime, ISO string or human-readable datetime)
+    :param end: last trade time (epoch milliseconds, datetime, ISO string or human-readable datetime)
+    :param columns: list of columns to read (['time', 'price', 'qty']). All of them if None
+    :param scaled: keep the scaled integer prices and quantities
+    :return: pandas.DataFrame with the trades
+    """
+    return to_frame(read_ticks(dataset_path(path, symbol, 'aggtrades'), start, end, columns), scaled)
+
+
+def get_depth(client, market, symbol, limit=100, price_decimals=8, qty_decimals=8):
+    """
+    Get an order book snapshot as depth rows (one per side and level)
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param limit: number of levels of each side
+    :param price_decimals: decimals kept of the prices
+    :param qty_decimals: decimals kept of the quantities
+    :return: dict of numpy.array columns following DEPTH_SCHEMA
+    """
+    market = market.upper()
+    fun = client.futures_order_book if market == 'USDM' else (client.futures_coin_order_book if market == 'COINM' else client.get_order_book)
+    book = fun(symbol=symbol.upper(), limit=limit)
+    bids, asks = book['bids'], book['asks']
+    levels = bids + asks
+    n = len(levels)
+    return {'time': np.full(n, book.get('T', int(time.time() * 1000)), dtype=np.int64),
+            'update_id': np.full(n, book['lastUpdateId'], dtype=np.int64),
+            'side': np.r_[np.ones(len(bids), dtype=np.int8), -np.ones(len(asks), dtype=np.int8)],
+            'level': np.r_[np.arange(len(bids)), np.arange(len(asks))].astype(np.int16),
+            'price': scale([lv[0] for lv in levels], price_decimals), 'qty': scale([lv[1] for lv in levels], qty_decimals)}
+
+
+def download_depth(client, market, symbol, path, interval=60, count=None, limit=100, price_decimals=None, qty_decimals=None,
+                   compression='zstd', row_group_size=ROW_GROUP_SIZE):
+    """
+    Take periodic order book snapshots into day partitions with bounded memory
+    :param client: client class
+    :param market: 'SPOT', 'USDM' or 'COINM'
+    :param symbol: symbol string ('BTCUSDT')
+    :param path: store root path string
+    :param interval: seconds between snapshots
+    :param count: number of snapshots. Until interrupted if None
+    :param limit: number of levels of each side
+    :param price_decimals: decimals kept of the prices. The stored ones (or 8) if None, and they must match when given
+    :param qty_decimals: decimals kept of the quantities. The stored ones (or 8) if None, and they must match when given
+    :param compression: 'zstd', 'snappy', 'gzip' or 'none'
+    :param row_group_size: rows kept in memory before they are written
+    :return: number of snapshots taken
+    """
+    market, symbol = market.upper(), symbol.upper()
+    folder = dataset_path(path, symbol, f'depth{limit}')
+    price_decimals, qty_decimals = stored_decimals(folder, price_decimals, qty_decimals)
+    metadata = {'symbol': symbol, 'market': market, 'price_decimals': price_decimals, 'qty_decimals': qty_decimals}
+    taken = 0
+    with TickWriter(folder, DEPTH_SCHEMA, metadata, compression, row_group_size) as writer:
+        while count is None or taken < count:
+            started = time.monotonic()
+            try:
+                writer.write(get_depth(client, market, symbol, limit, price_decimals, qty_decimals))
+                taken += 1
+            except Exception as e:
+                logger.warning(f'Depth snapshot of {symbol} at {market} failed: {e}')
+            if count is None or taken < count:
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    logger.info(f'{taken} depth snapshots of {symbol} at {market} saved into {folder}')
+    return taken
+
+
+def read_depth(path, symbol, start=None, end=None, limit=100, levels=None, scaled=False):
+    """
+    Read the stored order book snapshots of a symbol
+    :param path: store root path string
+    :param symbol: symbol string ('BTCUSDT')
+    :param start: first snapshot time (epoch milliseconds, datetime, ISO string or human-readable datetime)
+    :param end: last snapshot time (epoch milliseconds, datetime, ISO string or human-readable datetime)
+    :param limit: number of levels the snapshots were taken with
+    :param levels: keep only the first levels of each side
+    :param scaled: keep the scaled integer prices and quantities
+    :return: pandas.DataFrame with one row per snapshot, side and level
+    """
+    df = to_frame(read_ticks(dataset_path(path, symbol, f'depth{limit}'), start, end), scaled)
+    return df[df['level'] < levels].reset_index(drop=True) if levels is not None else df
+
+
+def trades_to_klines(trades, timeframe):
+    """
+    Build klines from aggregate trades, to cross-check them against get_klines. Buckets without trades repeat the
+    previous close with zero volume, like the exchange klines
+    :param trades: pandas.DataFrame read with read_agg_trades (not scaled)
+    :param timeframe: klines timeframe string ('1m')
+    :return: pandas.DataFrame with the common klines schema
+    """
+    if len(trades) == 0:
+        return pd.DataFrame(columns=commontools.KLINES_SCHEMA)
+    times = trades['time'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    price, qty = trades['price'].to_numpy(dtype=np.float64), trades['qty'].to_numpy(dtype=np.float64)
+    taker = ~trades['is_buyer_maker'].to_numpy()
+    starts = resampletools.buckets(times, timeframe)[0]
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:], len(times)] - 1
+
+    index = paneltools.time_index(int(starts[0]), int(starts[-1]), timeframe)
+    rows = np.searchsorted(index, starts[first])
+    present = np.zeros(len(index), dtype=bool)
+    present[rows] = True
+    close = np.full(len(index), np.nan)
+    close[rows] = price[last]
+    close = pd.Series(close).ffill().to_numpy()
+    previous = np.r_[close[:1], close[:-1]]
+
+    def fill(values, default):
+        column = np.full(len(index), default, dtype=np.asarray(values).dtype)
+        column[rows] = values
+        return column
+
+    columns = {'open_time': (index * 1000).view('datetime64[us]'),
+               'open': np.where(present, fill(price[first], np.nan), previous),
+               'high': np.where(present, fill(np.maximum.reduceat(price, first), np.nan), previous),
+               'low': np.where(present, fill(np.minimum.reduceat(price, first), np.nan), previous),
+               'close': close,
+               'vol': fill(np.add.reduceat(qty, first), 0.0),
+               'close_time': ((resampletools.buckets(index, timeframe)[1] - 1) * 1000).view('datetime64[us]'),
+               'quote_vol': fill(np.add.reduceat(price * qty, first), 0.0),
+               'trades': fill(np.add.reduceat(trades['last_id'].to_numpy() - trades['first_id'].to_numpy() + 1, first), 0),
+               'taker_base_vol': fill(np.add.reduceat(qty * taker, first), 0.0),
+               'taker_quote_vol': fill(np.add.reduceat(price * qty * taker, first), 0.0)}
+    return pd.DataFrame(columns, columns=commontools.KLINES_SCHEMA)